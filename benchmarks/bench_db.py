@@ -0,0 +1,85 @@
+'''Per-request database overhead: one connection per request vs the pooled layer
+
+Usage: python benchmarks/bench_db.py [--mods N] [--requests N] [--threads N] [--out FILE]
+'''
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+from harness import scratch_env, seed_mods, summarize, write_results
+
+
+def legacy_mods_info():
+    '''What every request used to do: connect, run the schema script, query, close'''
+    from sqlite3 import connect, Row
+    from server.config import DB_PATH
+    from server.database import FOREIGN_KEYS, INIT_TABLES
+    from server.database.sql import SELECT_MODS_INFO
+
+    conn = connect(DB_PATH)
+    conn.execute(FOREIGN_KEYS)
+    conn.executescript(INIT_TABLES)
+    conn.commit()
+    conn.row_factory = Row
+    mods = [dict(row) for row in conn.execute(SELECT_MODS_INFO)]
+    conn.commit()
+    conn.close()
+    return mods
+
+
+def pooled_mods_info():
+    from server.database.db import DBConnection
+
+    with DBConnection(readonly=True) as db:
+        return db.get_mods_info()
+
+
+def measure(fn, requests: int, threads: int) -> dict:
+    def timed(_):
+        start = perf_counter()
+        fn()
+        return perf_counter() - start
+
+    # warm up so connection setup is not counted against the pooled layer
+    with ThreadPoolExecutor(threads) as pool:
+        list(pool.map(lambda _: fn(), range(threads)))
+
+    start = perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        samples = list(pool.map(timed, range(requests)))
+    elapsed = perf_counter() - start
+
+    return {**summarize(samples), 'requests_per_s': requests / elapsed}
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mods', type=int, default=150)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--out')
+    args = parser.parse_args()
+
+    scratch_env()
+    seed_mods(args.mods)
+
+    from server import create_app
+    client = create_app().test_client()
+
+    def manifest_request():
+        response = client.get('/api/info/mod-display-list')
+        assert response.status_code == 200
+
+    results = {
+        'benchmark': 'db',
+        'mods': args.mods,
+        'threads': args.threads,
+        'legacy_connection': measure(legacy_mods_info, args.requests, args.threads),
+        'pooled_connection': measure(pooled_mods_info, args.requests, args.threads),
+        'manifest_request': measure(manifest_request, args.requests, args.threads),
+    }
+
+    write_results(results, args.out)
+
+
+if __name__ == '__main__':
+    main()
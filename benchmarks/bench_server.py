@@ -0,0 +1,220 @@
+'''End-to-end server load test: manifest latency, download throughput and add-mod throughput
+
+Runs against the Flask test client, a real gunicorn instance, or both, using
+a scratch database seeded with synthetic jars of varied sizes.
+
+Usage: python benchmarks/bench_server.py [--mods N] [--requests N] [--concurrency N]
+                                         [--downloads N] [--uploads N]
+                                         [--target test-client|gunicorn|both] [--workers N] [--out FILE]
+'''
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from os import environ
+from socket import socket
+from subprocess import Popen, DEVNULL
+from sys import executable
+from threading import local
+from time import perf_counter, sleep
+from harness import REPO_ROOT, scratch_env, seed_mods, jar_sizes, make_jar, mod_form, summarize, git_commit, write_results
+
+
+class TestClientTarget:
+    '''Requests through Flask's test client, one client per thread'''
+    name = 'test_client'
+
+    def __init__(self):
+        from server import create_app
+        self.app = create_app()
+        self._local = local()
+
+    def _client(self):
+        if not hasattr(self._local, 'client'):
+            self._local.client = self.app.test_client()
+        return self._local.client
+
+    def get(self, path: str) -> tuple[int, int]:
+        response = self._client().get(path)
+        return response.status_code, len(response.data)
+
+    def post_form(self, path: str, form: dict, filename: str, data: bytes) -> int:
+        response = self._client().post(path, data={**form, 'file_upload': (BytesIO(data), filename)},
+                                       content_type='multipart/form-data')
+        return response.status_code
+
+    def close(self):
+        pass
+
+
+class GunicornTarget:
+    '''Requests over HTTP to a gunicorn started on the same scratch environment'''
+    name = 'gunicorn'
+
+    def __init__(self, workers: int):
+        import requests
+        self._requests = requests
+        self._local = local()
+
+        with socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+        self.base = f'http://127.0.0.1:{port}'
+
+        self.process = Popen(
+            [executable, '-m', 'gunicorn', '-w', str(workers), '-b', f'127.0.0.1:{port}', 'server:create_app()'],
+            cwd=REPO_ROOT, env=environ.copy(), stdout=DEVNULL, stderr=DEVNULL
+        )
+        self._wait_ready()
+
+    def _wait_ready(self, timeout: float = 30.0):
+        deadline = perf_counter() + timeout
+        while perf_counter() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError('gunicorn exited during startup')
+            try:
+                self._requests.get(self.base + '/api/info/mod-display-list', timeout=1)
+                return
+            except self._requests.ConnectionError:
+                sleep(0.1)
+        raise RuntimeError('gunicorn did not start in time')
+
+    def _session(self):
+        if not hasattr(self._local, 'session'):
+            self._local.session = self._requests.Session()
+        return self._local.session
+
+    def get(self, path: str) -> tuple[int, int]:
+        response = self._session().get(self.base + path)
+        return response.status_code, len(response.content)
+
+    def post_form(self, path: str, form: dict, filename: str, data: bytes) -> int:
+        response = self._session().post(self.base + path, data=form, files={'file_upload': (filename, data)})
+        return response.status_code
+
+    def close(self):
+        self.process.terminate()
+        self.process.wait()
+
+
+def run_concurrently(fn, count: int, concurrency: int) -> tuple[list[float], float]:
+    '''Call fn(i) count times on concurrency threads, return per-call latencies and wall time'''
+    def timed(i):
+        start = perf_counter()
+        fn(i)
+        return perf_counter() - start
+
+    start = perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        samples = list(pool.map(timed, range(count)))
+    return samples, perf_counter() - start
+
+
+def bench_manifest(target, requests: int, concurrency: int) -> dict:
+    def fetch(_):
+        status, _ = target.get('/api/info/mod-display-list')
+        assert status == 200, status
+
+    # warm the manifest cache and every worker's connections
+    run_concurrently(fetch, concurrency * 2, concurrency)
+
+    samples, elapsed = run_concurrently(fetch, requests, concurrency)
+    return {**summarize(samples), 'requests_per_s': requests / elapsed}
+
+
+def bench_search(target, requests: int, concurrency: int) -> dict:
+    queries = ['/api/info/mods?limit=50', '/api/info/mods?role=Client&limit=50', '/api/info/mods?q=bench&limit=50']
+
+    def fetch(i):
+        status, _ = target.get(queries[i % len(queries)])
+        assert status == 200, status
+
+    samples, elapsed = run_concurrently(fetch, requests, concurrency)
+    return {**summarize(samples), 'requests_per_s': requests / elapsed}
+
+
+def bench_downloads(target, hashes: list[str], count: int, concurrency: int) -> dict:
+    received = []
+
+    def fetch(i):
+        status, size = target.get(f'/api/download/blob/{hashes[i % len(hashes)]}')
+        assert status == 200, status
+        received.append(size)
+
+    samples, elapsed = run_concurrently(fetch, count, concurrency)
+    total = sum(received)
+    return {
+        **summarize(samples),
+        'bytes': total,
+        'mib_per_s': total / elapsed / 1024 ** 2,
+        'downloads_per_s': count / elapsed,
+    }
+
+
+def bench_uploads(target, first_index: int, count: int, concurrency: int, size: int) -> dict:
+    # jars are built up front so only the request itself is timed
+    jars = [make_jar(first_index + i, size) for i in range(count)]
+
+    def upload(i):
+        index = first_index + i
+        status = target.post_form('/api/admin/add-mod', mod_form(index), f'upload-mod-{index}.jar', jars[i])
+        assert status == 200, status
+
+    samples, elapsed = run_concurrently(upload, count, concurrency)
+    return {**summarize(samples), 'mods_per_s': count / elapsed}
+
+
+def run_target(target, args, hashes: list[str], first_upload: int) -> dict:
+    try:
+        return {
+            'manifest': bench_manifest(target, args.requests, args.concurrency),
+            'search': bench_search(target, args.requests, args.concurrency),
+            'download': bench_downloads(target, hashes, args.downloads, args.concurrency),
+            'add_mod': bench_uploads(target, first_upload, args.uploads, args.concurrency, args.upload_size),
+        }
+    finally:
+        target.close()
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mods', type=int, default=300)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--downloads', type=int, default=300)
+    parser.add_argument('--uploads', type=int, default=100)
+    parser.add_argument('--upload-size', type=int, default=256 * 1024)
+    parser.add_argument('--target', choices=['test-client', 'gunicorn', 'both'], default='both')
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn worker processes')
+    parser.add_argument('--out')
+    args = parser.parse_args()
+
+    root = scratch_env()
+    sizes = jar_sizes(args.mods)
+    hashes = seed_mods(args.mods, sizes)
+
+    results = {
+        'benchmark': 'server',
+        'commit': git_commit(),
+        'mods': args.mods,
+        'seed_bytes': sum(sizes),
+        'concurrency': args.concurrency,
+        'scratch_dir': root,
+        'targets': {},
+    }
+
+    # each target uploads its own mods, so indexes must not collide between them
+    first_upload = args.mods
+
+    if args.target in ('test-client', 'both'):
+        results['targets']['test_client'] = run_target(TestClientTarget(), args, hashes, first_upload)
+        first_upload += args.uploads
+
+    if args.target in ('gunicorn', 'both'):
+        results['gunicorn_workers'] = args.workers
+        results['targets']['gunicorn'] = run_target(GunicornTarget(args.workers), args, hashes, first_upload)
+
+    write_results(results, args.out)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+'''Compare two benchmark result files, e.g. from before and after a change
+
+Usage: python benchmarks/compare.py BASELINE.json CANDIDATE.json [--threshold PCT]
+
+Prints every numeric metric present in both files with its relative change,
+marking changes larger than the threshold. Latencies (*_ms) are better when
+lower, rates (*_per_s) when higher.
+'''
+from argparse import ArgumentParser
+from json import load
+
+
+def flatten(results: dict, prefix: str = '') -> dict[str, float]:
+    flat = {}
+    for key, value in results.items():
+        name = f'{prefix}{key}'
+        if isinstance(value, dict):
+            flat.update(flatten(value, name + '.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def verdict(name: str, change: float, threshold: float) -> str:
+    if abs(change) < threshold:
+        return ''
+    if name.endswith('_ms'):
+        return 'slower' if change > 0 else 'faster'
+    if name.endswith('_per_s'):
+        return 'faster' if change > 0 else 'slower'
+    return 'changed'
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    parser.add_argument('--threshold', type=float, default=5.0, help='percent change worth flagging')
+    args = parser.parse_args()
+
+    with open(args.baseline) as file:
+        baseline = flatten(load(file))
+    with open(args.candidate) as file:
+        candidate = flatten(load(file))
+
+    width = max(map(len, baseline), default=0)
+    for name in sorted(baseline.keys() & candidate.keys()):
+        old, new = baseline[name], candidate[name]
+        change = 100 * (new - old) / old if old else 0.0
+        print(f'{name:<{width}}  {old:>12.3f}  {new:>12.3f}  {change:>+8.1f}%  {verdict(name, change, args.threshold)}')
+
+
+if __name__ == '__main__':
+    main()
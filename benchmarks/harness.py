@@ -0,0 +1,147 @@
+'''Shared setup for the server benchmarks
+
+Importing this module does not touch the real server config. Call
+scratch_env() before importing anything from `server`, since the config
+module reads its MCMM_* overrides at import time.
+'''
+from hashlib import sha256
+from io import BytesIO
+from json import dump
+from os import environ, makedirs, urandom
+from os.path import abspath, dirname, join
+from statistics import mean
+from sys import path
+from tempfile import mkdtemp
+from zipfile import ZipFile, ZIP_DEFLATED
+
+
+# make `server` importable when running a benchmark as a script
+REPO_ROOT = dirname(dirname(abspath(__file__)))
+if REPO_ROOT not in path:
+    path.insert(0, REPO_ROOT)
+
+
+def scratch_env(root: str | None = None) -> str:
+    '''Point every server path at a fresh scratch directory and return it'''
+    root = root or mkdtemp(prefix='mcmm-bench-')
+
+    dirs = {
+        'MCMM_SERVER_MODS_DIR': join(root, 'mods'),
+        'MCMM_CLIENT_MODS_DIR': join(root, 'client_mods'),
+        'MCMM_TEMP_DIR': join(root, 'tmp'),
+        'MCMM_BLOB_DIR': join(root, 'blobs'),
+        'MCMM_PACK_CACHE_DIR': join(root, 'packs'),
+        'MCMM_PATCH_CACHE_DIR': join(root, 'patches'),
+    }
+    for name, dir in dirs.items():
+        makedirs(dir, exist_ok=True)
+        environ[name] = dir
+
+    environ['MCMM_DB_PATH'] = join(root, 'db', 'database.sqlite')
+
+    # seeded jars are registered directly, the background indexer would only rehash them
+    environ['MCMM_INDEXER'] = '0'
+
+    return root
+
+
+def make_jar(index: int, size: int) -> bytes:
+    '''Build a small but valid jar with roughly size bytes of incompressible content'''
+    buffer = BytesIO()
+    with ZipFile(buffer, 'w', ZIP_DEFLATED) as jar:
+        jar.writestr('META-INF/MANIFEST.MF', f'Manifest-Version: 1.0\nImplementation-Version: 1.0.{index}\n')
+        jar.writestr(f'bench/mod{index}/Main.class', urandom(size))
+    return buffer.getvalue()
+
+
+def mod_form(index: int) -> dict[str, str]:
+    '''Form values for the index-th synthetic mod, as add-mod.html would post them'''
+    return {
+        'name': f'Bench Mod {index}',
+        'description': f'Synthetic mod number {index} used for benchmarking. ' * 4,
+        'version': f'1.0.{index}',
+        'link': f'https://www.curseforge.com/minecraft/mc-mods/bench-{index}',
+        'type': 'Library' if index % 3 == 0 else 'Feature',
+        'role': ('Client/Server', 'Client', 'Server')[index % 3],
+    }
+
+
+def jar_sizes(count: int, smallest: int = 4096, largest: int = 4 * 1024 * 1024) -> list[int]:
+    '''Spread of jar sizes like a real pack: mostly small libraries, a few large content mods'''
+    # geometric steps from smallest to largest, repeated in a fixed order so runs are comparable
+    steps = 8
+    ratio = (largest / smallest) ** (1 / (steps - 1))
+    sizes = [int(smallest * ratio ** i) for i in range(steps)]
+    weights = [8, 6, 5, 4, 3, 2, 1, 1]
+    pattern = [size for size, weight in zip(sizes, weights) for _ in range(weight)]
+    return [pattern[(i * 7) % len(pattern)] for i in range(count)]
+
+
+def seed_mods(count: int, size: int | list[int] = 4096) -> list[str]:
+    '''Insert count synthetic mods directly through the storage layer, return their hashes
+
+    size is either one size for every jar or a list with one size per jar.
+    '''
+    from server.database.db import DBConnection, init_db
+    from server.database.params import ModInsert
+    from server.routes.utils import get_file_path
+    from server.storage import store_blob, copy_blob
+
+    init_db()
+
+    hashes = []
+    with DBConnection() as db:
+        for i in range(count):
+            data = make_jar(i, size if isinstance(size, int) else size[i])
+            filehash = sha256(data).hexdigest()
+            filename = f'bench-mod-{i}.jar'
+
+            mod = ModInsert(mod_form(i), filename, filehash)
+            db.add_mod(mod)
+            store_blob(BytesIO(data), filehash)
+            copy_blob(filehash, get_file_path(filename, mod.role))
+
+            hashes.append(filehash)
+
+    return hashes
+
+
+def summarize(samples: list[float]) -> dict[str, float]:
+    '''Latency summary in milliseconds'''
+    ordered = sorted(samples)
+
+    def pct(p: float) -> float:
+        return 1000 * ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+    return {
+        'count': len(ordered),
+        'mean_ms': 1000 * mean(ordered),
+        'p50_ms': pct(0.50),
+        'p90_ms': pct(0.90),
+        'p99_ms': pct(0.99),
+        'max_ms': 1000 * ordered[-1],
+    }
+
+
+def git_commit() -> str | None:
+    '''Commit the benchmarked tree is at, so saved results can be compared between commits'''
+    from subprocess import run
+
+    try:
+        result = run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT, capture_output=True, text=True)
+    except OSError:
+        return None
+
+    return result.stdout.strip() or None
+
+
+def write_results(results: dict, out: str | None):
+    '''Print results as JSON, and also save them to out if given'''
+    from sys import stdout
+
+    dump(results, stdout, indent=2)
+    stdout.write('\n')
+
+    if out is not None:
+        with open(out, 'w') as file:
+            dump(results, file, indent=2)
@@ -0,0 +1,137 @@
+import os
+import json
+import time
+import shutil
+import threading
+
+
+def _is_hash(s: str):
+    return len(s) == 64 and all(c in "0123456789abcdef" for c in s)
+
+
+class BlobCache:
+    """Local content-addressed file cache with a size budget
+
+    Files live under <root>/<ab>/<cdef...>, named by their sha256. An index
+    records each file's size and when it was last used; once the cache grows
+    past max_bytes, the least recently used files are evicted first.
+    """
+
+    def __init__(self, root: str, max_bytes: int):
+        if not isinstance(root, str):
+            raise TypeError("root must be a str")
+        if not isinstance(max_bytes, int):
+            raise TypeError("max_bytes must be an integer")
+        if max_bytes < 0:
+            raise ValueError("max_bytes must not be negative")
+
+        self.root = root
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(root, "index.json")
+        self._lock = threading.Lock()
+
+        os.makedirs(root, exist_ok=True)
+        self._index = self._load_index()
+
+    def _load_index(self):
+        try:
+            with open(self.index_path, "r") as file:
+                index = json.load(file)
+        except (OSError, ValueError):
+            index = dict()
+
+        # Drop entries whose file was removed behind our back
+        index = {h: e for h, e in index.items() if os.path.exists(self.path(h))}
+
+        # Adopt files a run added without getting to save the index, and clear
+        # out copies it was interrupted in the middle of
+        for entry in os.scandir(self.root):
+            if not entry.is_dir() or len(entry.name) != 2:
+                continue
+            for file in os.scandir(entry.path):
+                filehash = entry.name + file.name
+                if file.name.endswith(".tmp"):
+                    os.remove(file.path)
+                elif filehash not in index and file.is_file() and _is_hash(filehash):
+                    stat = file.stat()
+                    index[filehash] = {"size": stat.st_size, "last_used": stat.st_mtime}
+
+        return index
+
+    def save(self):
+        with self._lock:
+            tmp = self.index_path + ".tmp"
+            with open(tmp, "w") as file:
+                json.dump(self._index, file)
+            os.replace(tmp, self.index_path)
+
+    def path(self, filehash: str):
+        return os.path.join(self.root, filehash[:2], filehash[2:])
+
+    @property
+    def size(self):
+        return sum(entry["size"] for entry in self._index.values())
+
+    def get(self, filehash: str):
+        """Return the cached path for filehash and mark it used, or None"""
+        with self._lock:
+            entry = self._index.get(filehash)
+            if entry is None:
+                return None
+
+            path = self.path(filehash)
+            if not os.path.exists(path):
+                del self._index[filehash]
+                return None
+
+            entry["last_used"] = time.time()
+            return path
+
+    def add(self, filehash: str, src: str, *, move: bool = False):
+        """Put src in the cache under filehash, moving or hardlinking it when possible"""
+        dest = self.path(filehash)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+
+        if not os.path.exists(dest):
+            tmp = dest + ".tmp"
+            if move:
+                try:
+                    os.replace(src, tmp)
+                except OSError:
+                    shutil.copyfile(src, tmp)
+                    os.remove(src)
+            else:
+                try:
+                    os.link(src, tmp)
+                except OSError:
+                    shutil.copyfile(src, tmp)
+            os.replace(tmp, dest)
+        elif move:
+            os.remove(src)
+
+        with self._lock:
+            self._index[filehash] = {"size": os.path.getsize(dest), "last_used": time.time()}
+
+        return dest
+
+    def evict(self, keep: set[str] = frozenset()):
+        """Remove least recently used files until the cache fits in max_bytes"""
+        with self._lock:
+            total = sum(entry["size"] for entry in self._index.values())
+            by_age = sorted(self._index.items(), key=lambda item: item[1]["last_used"])
+
+            for filehash, entry in by_age:
+                if total <= self.max_bytes:
+                    break
+                if filehash in keep:
+                    continue
+
+                try:
+                    os.remove(self.path(filehash))
+                except FileNotFoundError:
+                    pass
+
+                del self._index[filehash]
+                total -= entry["size"]
+
+        self.save()
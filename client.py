@@ -15,7 +15,17 @@ try:
     import hashlib
     import json
     import argparse
-    from progress_bar import ProgressBar
+    import time
+    import threading
+    import queue
+    import urllib3
+    from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+    from requests.adapters import HTTPAdapter
+    from progress_bar import ProgressRenderer, Task
+    from installer import StagedInstall
+    from blob_cache import BlobCache
+    from jar_patch import apply_patch, PatchMismatch
+    from profiler import Profiler
 except ModuleNotFoundError as e:
     print("Python module not installed:", e)
     quit()
@@ -25,16 +35,47 @@ except ModuleNotFoundError as e:
 ### CONSTANTS & GLOBALS ###
 
 FILE_SERVER_ADDR = "http://172.30.1.1:8000/files/"
-MOD_PACK_ENDPOINT       = "ModPack.zip"
 SHADER_PACK_ENDPOINT    = "BSL_v10.1.zip"
 NEOFORGE_ENDPOINT       = "neoforge-21.1.218-installer.jar"
 
+API_SERVER_ADDR = "http://172.30.1.1:5000/api/"
+CLIENT_CHECK_ENDPOINT   = "client-check"
+BLOB_DOWNLOAD_ENDPOINT  = "download/blob/"
+PATCH_DOWNLOAD_ENDPOINT = "download/patch/"
+
 PATH_CACHE      = ".cache"
 PATH_DOWNLOADS  = os.path.join(PATH_CACHE, "downloads")
-PATH_MOD_HASHES = os.path.join(PATH_CACHE, "mod-hashes.json")
+PATH_MOD_INDEX  = os.path.join(PATH_CACHE, "mod-index.json")
+PATH_BLOBS      = os.path.join(PATH_CACHE, "blobs")
+
+CACHE_MAX_BYTES = 2 * 1024 ** 3         # budget for cached jars before LRU eviction
+
+MODS_ROLE = "client"                    # which mods to sync, "server" for the game server's own folder
+MODS_DIR = None                         # defaults to the mods folder in .minecraft
+
+HASH_WORKERS = min(8, os.cpu_count() or 1)
+
+DOWNLOAD_TIMEOUT        = (5.0, 30.0)   # (connect, read) seconds
+DOWNLOAD_RETRIES        = 5
+DOWNLOAD_BACKOFF        = 1.0           # seconds, doubled after every failed attempt
+DOWNLOAD_BACKOFF_MAX    = 30.0
+CHUNK_SIZE_MIN          = 16 * 1024
+CHUNK_SIZE_MAX          = 4 * 1024 * 1024
+CHUNK_TARGET_SECONDS    = 0.25          # aim for roughly this long per chunk read
+WRITE_QUEUE_CHUNKS      = 4             # chunks read ahead of the disk writer, per transfer
+
+DOWNLOAD_WORKERS        = 8             # jars fetched in parallel by download_files
+MAX_CONCURRENT_TRANSFERS = 8            # cap on open transfers across the whole program
+HTTP_POOL_SIZE          = 16            # keep-alive connections per host
 
 do_quit = False
 
+_session = None
+_session_lock = threading.Lock()
+_transfer_slots = None
+
+_profiler = Profiler()          # enabled by --timings / --profile
+
 
 
 ### UTILS ###
@@ -44,6 +85,11 @@ class QuitProgram(Exception):
     def __init__(self, *args):
         super().__init__(*args)
 
+class HashMismatch(Exception):
+    """Downloaded bytes don't hash to the sha256 the server published"""
+    def __init__(self, *args):
+        super().__init__(*args)
+
 def signal_handler(*args, **kwargs):
     global do_quit
     do_quit = True
@@ -97,7 +143,8 @@ def ask_user(query: str,
 
     resp = ""
     if valid_responses is None:    
-        resp = _try_input(query)
+        with _profiler.phase("waiting for input"):
+            resp = _try_input(query)
     else:
         for vr in valid_responses:
             if not isinstance(vr, str):
@@ -109,10 +156,11 @@ def ask_user(query: str,
         if not case_sensitive:
             valid_responses = tuple(vr.lower() for vr in valid_responses)
 
-        while resp not in valid_responses:
-            resp = _try_input(query)
-            if not case_sensitive:
-                resp = resp.lower()
+        with _profiler.phase("waiting for input"):
+            while resp not in valid_responses:
+                resp = _try_input(query)
+                if not case_sensitive:
+                    resp = resp.lower()
     
     return resp
 
@@ -131,41 +179,318 @@ def get_minecraft_dir():
         raise Exception("Could not locate .minecraft directory")
     return dot_minecraft_dir_abspath
 
-def download_file(url: str, filename: str):
+def get_mods_dir():
+    return MODS_DIR if MODS_DIR is not None else os.path.join(get_minecraft_dir(), "mods")
+
+def get_session():
+    """Shared HTTP session so every transfer reuses pooled keep-alive connections"""
+    global _session, _transfer_slots
+
+    with _session_lock:
+        if _session is None:
+            pool_size = max(HTTP_POOL_SIZE, DOWNLOAD_WORKERS)
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, pool_block=True)
+
+            _session = requests.Session()
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+            _transfer_slots = threading.BoundedSemaphore(MAX_CONCURRENT_TRANSFERS)
+
+        return _session
+
+def _is_cancelled(cancel: threading.Event | None):
     global do_quit
+    return do_quit or (cancel is not None and cancel.is_set())
 
-    chunk_size = 4096
+def _load_part_validators(meta_path: str, url: str):
+    """Return the validators saved next to a .part file, if they belong to url"""
+    try:
+        with open(meta_path, "r") as file:
+            meta = json.load(file)
+    except (OSError, ValueError):
+        return None
+
+    return meta if meta.get("url") == url else None
+
+def _save_part_validators(meta_path: str, url: str, headers):
+    # Weak ETags can't be used with If-Range, so fall back to Last-Modified
+    etag = headers.get("ETag")
+    if etag is not None and etag.startswith("W/"):
+        etag = None
+
+    with open(meta_path, "w") as file:
+        json.dump({"url": url, "etag": etag, "last_modified": headers.get("Last-Modified")}, file)
+
+def _discard_part(part: str, meta_path: str):
+    for path in (part, meta_path):
+        if os.path.exists(path):
+            os.remove(path)
+
+class _ChunkWriter:
+    """Writes and hashes downloaded chunks on a thread of its own
+
+    The socket read of the next chunk then overlaps the disk write of the
+    last one. At most WRITE_QUEUE_CHUNKS chunks wait in memory; a write
+    error is raised from the next write() or by close().
+    """
+
+    def __init__(self, file, digest):
+        self.file = file
+        self.digest = digest
+        self.error = None
+        self._queue = queue.Queue(WRITE_QUEUE_CHUNKS)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while (data := self._queue.get()) is not None:
+            if self.error is not None:
+                continue
+            try:
+                self.file.write(data)
+                self.digest.update(data)
+            except Exception as e:
+                self.error = e
+
+    def write(self, data: bytes):
+        if self.error is not None:
+            raise self.error
+        self._queue.put(data)
+
+    def close(self):
+        """Wait for queued chunks to hit the file"""
+        self._queue.put(None)
+        self._thread.join()
+        if self.error is not None:
+            raise self.error
+
+def _hash_part(part: str):
+    """sha256 state of the bytes already in a .part file, to resume hashing from"""
+    digest = hashlib.sha256()
+    with open(part, "rb") as file:
+        while data := file.read(CHUNK_SIZE_MAX):
+            digest.update(data)
+    return digest
+
+def _check_hash(digest, sha256: str | None, part: str, meta_path: str):
+    if sha256 is not None and digest.hexdigest() != sha256:
+        # Never resume from bytes we know are wrong
+        _discard_part(part, meta_path)
+        raise HashMismatch(f"Downloaded file hashes to {digest.hexdigest()}, expected {sha256}")
+
+def _fetch(url: str, dest: str, *, task: Task | None = None, sha256: str | None = None,
+           cancel: threading.Event | None = None):
+    """Download url to dest, resuming from dest.part when the server allows it
+
+    Bytes are hashed as they arrive; with sha256 given, dest only appears
+    if the whole file matches it. task, if given, follows the bytes written
+    so far.
+    """
+
+    part = dest + ".part"
+    meta_path = part + ".json"
+
+    # Only resume when we know which version of the file the .part came from
+    validators = _load_part_validators(meta_path, url)
+    if validators is None or not (validators["etag"] or validators["last_modified"]):
+        _discard_part(part, meta_path)
+        validators = None
+
+    offset = os.path.getsize(part) if os.path.exists(part) else 0
+
+    headers = {}
+    if offset > 0:
+        headers["Range"] = f"bytes={offset}-"
+        headers["If-Range"] = validators["etag"] or validators["last_modified"]
+
+    with get_session().get(url, headers=headers, timeout=DOWNLOAD_TIMEOUT, stream=True) as resp_stream:
+        if resp_stream.status_code == 416:
+            # Either the .part is already complete or it no longer fits the file
+            total = resp_stream.headers.get("Content-Range", "").rpartition("/")[2]
+            if total.isdigit() and int(total) == offset:
+                _check_hash(_hash_part(part), sha256, part, meta_path)
+                os.replace(part, dest)
+                _discard_part(part, meta_path)
+                return
+
+            _discard_part(part, meta_path)
+            raise requests.ConnectionError("Partial download no longer matches, restarting")
+
+        if resp_stream.status_code == 200:
+            # Server ignored the range (or the file changed), start over
+            offset = 0
+        elif resp_stream.status_code == 206:
+            start = resp_stream.headers.get("Content-Range", "").removeprefix("bytes ").partition("-")[0]
+            if start != str(offset):
+                _discard_part(part, meta_path)
+                raise requests.ConnectionError("Server resumed at the wrong offset, restarting")
+        else:
+            raise requests.HTTPError(f"Failed ({resp_stream.status_code}, {resp_stream.reason})", response=resp_stream)
+
+        # Chunked responses have no Content-Length, their size is only known once the stream ends
+        content_length = resp_stream.headers.get("Content-Length")
+        file_size = offset + int(content_length) if content_length is not None else None
+        if task is not None:
+            task.set_total(file_size)
+            task.update(offset)
+
+        _save_part_validators(meta_path, url, resp_stream.headers)
+        digest = _hash_part(part) if offset > 0 else hashlib.sha256()
+
+        with _profiler.file("download", os.path.basename(dest), resumed_from=offset) as span:
+            with open(part, "ab" if offset > 0 else "wb") as f:
+                writer = _ChunkWriter(f, digest)
+                try:
+                    n_read = offset
+                    chunk_size = CHUNK_SIZE_MIN
+                    while True:
+                        if _is_cancelled(cancel):
+                            # Keep the .part around so the next run can resume it
+                            raise QuitProgram()
+
+                        start = time.perf_counter()
+                        data = resp_stream.raw.read(chunk_size, decode_content=True)
+                        if not data:
+                            break
+                        elapsed = time.perf_counter() - start
+
+                        writer.write(data)
+                        n_read += len(data)
+                        span.add_bytes(len(data))
+                        if task is not None:
+                            task.update(n_read)
+
+                        # Grow the chunk while reads are quick, shrink it when they drag on
+                        if elapsed < CHUNK_TARGET_SECONDS / 2:
+                            chunk_size = min(chunk_size * 2, CHUNK_SIZE_MAX)
+                        elif elapsed > CHUNK_TARGET_SECONDS * 2:
+                            chunk_size = max(chunk_size // 2, CHUNK_SIZE_MIN)
+                finally:
+                    writer.close()
+
+    if file_size is not None and n_read != file_size:
+        raise requests.ConnectionError(f"Connection closed after {n_read} of {file_size} bytes")
+
+    _check_hash(digest, sha256, part, meta_path)
+    os.replace(part, dest)
+    _discard_part(part, meta_path)
+
+def _fetch_with_retries(url: str, dest: str, *, task: Task | None = None, sha256: str | None = None,
+                        cancel: threading.Event | None = None):
+    get_session()
+
+    backoff = DOWNLOAD_BACKOFF
+    mismatched = False
+    for attempt in range(DOWNLOAD_RETRIES + 1):
+        # Wait for a free transfer slot, but stay responsive to Ctrl+C
+        while not _transfer_slots.acquire(timeout=0.1):
+            if _is_cancelled(cancel):
+                raise QuitProgram()
+
+        try:
+            _fetch(url, dest, task=task, sha256=sha256, cancel=cancel)
+            return dest
+        except (requests.ConnectionError, requests.Timeout, urllib3.exceptions.HTTPError, HashMismatch) as e:
+            # A mismatch may be bytes mangled on the way, but twice means the server has it wrong
+            if isinstance(e, HashMismatch) and (mismatched or attempt == DOWNLOAD_RETRIES):
+                raise Exception(f"Refusing to install {os.path.basename(dest)}: {e}")
+            mismatched = mismatched or isinstance(e, HashMismatch)
+
+            if attempt == DOWNLOAD_RETRIES:
+                if isinstance(e, requests.ConnectTimeout):
+                    raise Exception("Timeout. Is your VPN connected?")
+                raise Exception(f"Download failed: {e}")
+
+            if task is not None:
+                task.renderer.log(yellow(f"  Retrying {task.label} in {backoff:g}s ({e.__class__.__name__})"))
+        finally:
+            _transfer_slots.release()
+
+        # Sleep in small steps so Ctrl+C still quits promptly
+        deadline = time.monotonic() + backoff
+        while time.monotonic() < deadline:
+            if _is_cancelled(cancel):
+                raise QuitProgram()
+            time.sleep(0.1)
+        backoff = min(backoff * 2, DOWNLOAD_BACKOFF_MAX)
+
+def download_file(url: str, filename: str, *, ask_replace: bool = True):
     dest = os.path.join(PATH_DOWNLOADS, filename)
 
-    if ask_user_replace_file(dest):
+    if not ask_replace or ask_user_replace_file(dest):
         print(f"Downloading {url}...")
-        try:
-            with requests.get(url, timeout=5.0, stream=True) as resp_stream:
-                if resp_stream.status_code != 200:
-                    raise Exception(f"Failed ({resp_stream.status_code}, {resp_stream.reason})")
-
-                file_size = int(resp_stream.headers.get("Content-Length", -1))
-                if file_size == -1:
-                    raise Exception("Could not determine file size")
-            
-                with ProgressBar(file_size, width=30) as bar:
-                    with open(dest, "wb") as f:
-                        n_read = 0
-                        for data in resp_stream.iter_content(chunk_size):
-                            if do_quit:
-                                print(red(" (Cancelled)"), end="")
-                                f.close()
-                                os.remove(dest)
-                                raise QuitProgram()
-
-                            n_read += f.write(data)
-                            bar.update(n_read)
-
-        except requests.ConnectTimeout:
-            raise Exception("Timeout. Is your VPN connected?")
-    
+        with _profiler.phase(f"download {filename}") as span, ProgressRenderer() as progress:
+            task = progress.add(filename)
+            _fetch_with_retries(url, dest, task=task)
+            task.finish()
+            span.add_bytes(os.path.getsize(dest))
+
     return dest
 
+def _fetch_shown(progress: ProgressRenderer, label: str, url: str, dest: str, sha256: str | None,
+                 cancel: threading.Event):
+    """_fetch_with_retries with its own bar, shown only while the transfer runs"""
+    task = progress.add(label, transient=True)
+    try:
+        return _fetch_with_retries(url, dest, task=task, sha256=sha256, cancel=cancel)
+    finally:
+        task.finish()
+
+def download_files(jobs: list[tuple[str, str]], *, allow_missing: bool = False, phase: str = "download",
+                   labels: list[str] | None = None, hashes: list[str] | None = None):
+    """Download many (url, filename) pairs in parallel and return their paths
+
+    At most DOWNLOAD_WORKERS files are in flight at once, each with its own
+    bar (named by labels, default the filenames) under an overall one. Files
+    with an entry in hashes are only kept if they match that sha256. The
+    first failure, or Ctrl+C, cancels everything that is still running. With
+    allow_missing, a 404 is not a failure and that file's path is None
+    instead. The whole batch is timed as one profiler phase named phase.
+    """
+    global do_quit
+
+    if not jobs:
+        return []
+
+    cancel = threading.Event()
+    dests = [os.path.join(PATH_DOWNLOADS, filename) for _, filename in jobs]
+    labels = labels or [filename for _, filename in jobs]
+    hashes = hashes or [None] * len(jobs)
+
+    print(f"Downloading {len(jobs)} files...")
+    pool = ThreadPoolExecutor(max_workers=min(DOWNLOAD_WORKERS, len(jobs)))
+    try:
+        with _profiler.phase(phase, files=len(jobs)) as span, ProgressRenderer() as progress:
+            overall = progress.add("Total", len(jobs), unit="files")
+            pending = {pool.submit(_fetch_shown, progress, label, url, dest, sha256, cancel): i
+                       for i, ((url, _), dest, label, sha256) in enumerate(zip(jobs, dests, labels, hashes))}
+            futures = dict(pending)
+            pending = set(pending)
+
+            while pending:
+                # Poll so the signal handler gets a chance to set do_quit
+                done, pending = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        span.add_bytes(os.path.getsize(future.result()))
+                    except requests.HTTPError as e:
+                        if not (allow_missing and e.response is not None and e.response.status_code == 404):
+                            raise
+                        dests[futures[future]] = None
+                    overall.advance()
+
+                if do_quit:
+                    progress.log(red("Cancelled"))
+                    raise QuitProgram()
+            overall.finish()
+    except BaseException:
+        cancel.set()
+        raise
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+    return dests
+
 def zip_dir(src_dir: str, dst: str):
     if not isinstance(src_dir, str):
         raise TypeError("src_dir must be a str")
@@ -200,13 +525,18 @@ def zip_dir(src_dir: str, dst: str):
 def send_mod_hashes(url: str):
     data = _init_mod_hash_table()
     try:
-        resp = requests.post(url, json=data)
-    except Exception as e:
-        raise e
+        with _profiler.phase("client check", mods=len(data)) as span:
+            # The server only answers with the mods this role runs
+            resp = get_session().post(url, params={"role": MODS_ROLE}, json=data, timeout=DOWNLOAD_TIMEOUT)
+            span.add_bytes(len(resp.content))
+    except requests.ConnectTimeout:
+        raise Exception("Timeout. Is your VPN connected?")
 
     if resp.status_code != 200:
         raise Exception("Failed to post data")
 
+    return resp.json()
+
 
 
 ### PROGRAM ROUTINES ###
@@ -224,35 +554,90 @@ def _init_directories():
     if not os.path.exists(PATH_DOWNLOADS):
         os.makedirs(PATH_DOWNLOADS)
 
+def _hash_file(path: str):
+    """Stream a file through sha256 without loading it into memory"""
+    with _profiler.file("hash", os.path.basename(path)) as span, open(path, "rb") as file:
+        digest = hashlib.file_digest(file, "sha256").hexdigest()
+        span.add_bytes(file.tell())
+        return digest
+
+def _load_mod_index():
+    try:
+        with open(PATH_MOD_INDEX, "r") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return dict()
+
+def _save_mod_index(index: dict):
+    tmp = PATH_MOD_INDEX + ".tmp"
+    with open(tmp, "w") as file:
+        json.dump(index, file)
+    os.replace(tmp, PATH_MOD_INDEX)
+
 def _init_mod_hash_table():
-    """Create mods hash file if it doesn't already exist"""
+    """Refresh the mods hash index and return it as {filename: sha256}
 
-    table = dict()
+    Entries are keyed on (size, mtime_ns, inode), so only jars that changed
+    since the last run are rehashed.
+    """
 
-    if not os.path.exists(PATH_MOD_HASHES):
-        mods_dir = os.path.join(get_minecraft_dir(), "mods")
+    with _profiler.phase("hash mods") as span:
+        return _refresh_mod_hash_table(span)
 
-        print("Initializing mods hash table... ", end="", flush=True)
+def _refresh_mod_hash_table(span):
+    mods_dir = get_mods_dir()
+    old_index = _load_mod_index()
+    index = dict()
+    stale = []
 
-        for mod in (f for f in os.listdir(mods_dir) if os.path.isfile(os.path.join(mods_dir, f))):
-            with open(os.path.join(mods_dir, mod), "rb") as file:
-                table.update({mod: hashlib.sha256(file.read()).hexdigest()})
-        
-        with open(PATH_MOD_HASHES, "w") as file:
-            file.write(json.dumps(table))
+    with os.scandir(mods_dir) as entries:
+        for entry in entries:
+            if not entry.is_file():
+                continue
+
+            st = entry.stat()
+            record = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "inode": entry.inode()}
+
+            cached = old_index.get(entry.name)
+            if cached is not None and all(cached.get(k) == v for k, v in record.items()):
+                record["sha256"] = cached["sha256"]
+            else:
+                stale.append((entry.name, entry.path))
+                span.add_bytes(st.st_size)
+
+            index[entry.name] = record
+
+    span.args.update(mods=len(index), hashed=len(stale))
+
+    if stale:
+        print(f"Hashing mods ({len(stale)})... ", end="", flush=True)
+
+        # hashlib releases the GIL while digesting, so threads hash in parallel
+        with ThreadPoolExecutor(max_workers=HASH_WORKERS) as pool:
+            digests = pool.map(_hash_file, (path for _, path in stale))
+            for (name, _), digest in zip(stale, digests):
+                index[name]["sha256"] = digest
 
         print("Done")
-    else:
-        with open(PATH_MOD_HASHES, "r") as file:
-            table = json.loads(file.read())
 
-    return table
+    if index != old_index:
+        _save_mod_index(index)
+
+    return {name: record["sha256"] for name, record in index.items()}
+
+def _recover_mods_install():
+    """Roll back a mods update that was interrupted part way through"""
+    mods_dir = get_mods_dir()
+    if StagedInstall.recover(mods_dir):
+        print(yellow("Recovered from an interrupted mods update"))
 
 def setup():
     # Quit gracefully on Ctrl+C
     signal.signal(signal.SIGINT, signal_handler)
 
     _init_directories()
+    with _profiler.phase("recover install"):
+        _recover_mods_install()
     _init_mod_hash_table()
 
 
@@ -282,40 +667,109 @@ def zip_mods(src_dir: str, dst: str):
     if zip_dir(src_dir, dst):
         print("Successfully created", os.path.relpath(dst))
 
+def _patch_cached_mods(cache: BlobCache, pairs: list[tuple[str, str]]):
+    """Rebuild new jars from cached old ones plus server patches, return the hashes rebuilt"""
+    pairs = [(old, new) for old, new in pairs if cache.get(old) is not None]
+    if not pairs:
+        return set()
+
+    patches = download_files([(API_SERVER_ADDR + PATCH_DOWNLOAD_ENDPOINT + f"{old}/{new}", f"{old}-{new}.patch")
+                              for old, new in pairs], allow_missing=True, phase="download patches")
+
+    rebuilt = set()
+    with _profiler.phase("apply patches") as phase:
+        for (old, new), patch in zip(pairs, patches):
+            # No worthwhile patch for this pair, it gets downloaded in full instead
+            if patch is None:
+                continue
+
+            jar = os.path.join(PATH_DOWNLOADS, new + ".jar")
+            try:
+                with _profiler.file("patch", new + ".jar") as span:
+                    # apply_patch checks the header's hash, make sure it is the one we asked for
+                    if apply_patch(cache.path(old), patch, jar) != new:
+                        raise PatchMismatch(f"Patch rebuilds a different jar than {new}")
+                    span.add_bytes(os.path.getsize(jar))
+                    phase.add_bytes(os.path.getsize(jar))
+                cache.add(new, jar, move=True)
+                rebuilt.add(new)
+            except PatchMismatch as e:
+                print(yellow(f"  Patch failed, downloading full jar ({e})"))
+                if os.path.exists(jar):
+                    os.remove(jar)
+            finally:
+                os.remove(patch)
+
+    if rebuilt:
+        print(f"Patched {len(rebuilt)} mods")
+
+    return rebuilt
+
 def update_client_mods():
-    # Download new mods
-    new_mods_zip = download_file(FILE_SERVER_ADDR + MOD_PACK_ENDPOINT, "mods.zip")
-    with zipfile.ZipFile(new_mods_zip) as zip:
-        new_mods_filenames = set(entry.filename for entry in zip.infolist())
-
-    # Tally existing mods
-    mods_dir = os.path.join(get_minecraft_dir(), "mods")
-    existing_mods_filenames = set(f for f in os.listdir(mods_dir) if os.path.isfile(os.path.join(mods_dir, f)))
-
-    # Display which mods will be added (A), updated (U), and deleted (D).
-    # Then ask the user if they want to continue.
-    # for m in sorted(new_mods_filenames - existing_mods_filenames):
-    #     print(" ", green("A:"), m)
-    # for m in sorted(existing_mods_filenames & new_mods_filenames):
-    #     print(" ", yellow("U:"), m)
-    for m in sorted(existing_mods_filenames - new_mods_filenames):
-        print(" ", red("D:"), m)
+    # Ask the server which mods need to be added (A), updated (U), and deleted (D)
+    diff = send_mod_hashes(API_SERVER_ADDR + CLIENT_CHECK_ENDPOINT)
+    added, updated, deleted = diff["add"], diff["update"], diff["delete"]
+
+    if not (added or updated or deleted):
+        print("Mods are already up to date")
+        return
+
+    # Display the changes then ask the user if they want to continue.
+    for mod in added:
+        print(" ", green("A:"), mod["filename"])
+    for mod in updated:
+        print(" ", yellow("U:"), mod["filename"])
+    for filename in deleted:
+        print(" ", red("D:"), filename)
 
     if ask_user_yes_no("Continue?"):
-        # Remove existing mods
-        for filename in existing_mods_filenames:
-            os.remove(os.path.join(mods_dir, filename))
-        
-        # Extract new mods
-        print(f"Updating mods ({len(new_mods_filenames)})...")
-        with zipfile.ZipFile(new_mods_zip) as zip:
-            for item in zip.infolist():
-                print("  Installing", item.filename)
-                zip.extract(item, mods_dir)
-        print("Successfully updated mods")
+        mods_dir = get_mods_dir()
+        cache = BlobCache(PATH_BLOBS, CACHE_MAX_BYTES)
 
-        # Delete downloaded zip
-        # os.remove(new_mods_zip_abspath)
+        # Save the index even if we stop early, or the files added so far are never evicted
+        try:
+            # Keep the jars we are about to replace or remove, so rolling back is offline
+            local_hashes = _init_mod_hash_table()
+            with _profiler.phase("cache old mods"):
+                for filename in [mod["filename"] for mod in updated] + deleted:
+                    filename = os.path.basename(filename)
+                    if filename in local_hashes:
+                        cache.add(local_hashes[filename], os.path.join(mods_dir, filename))
+
+            # Download only the jars that changed and are not cached yet, several at a time
+            changed = added + updated
+            missing = {mod["filehash"] for mod in changed if cache.get(mod["filehash"]) is None}
+            if len(missing) < len(changed):
+                print(f"Using {len(changed) - len(missing)} cached mods")
+
+            # Updated jars we still have locally can be rebuilt from a patch of the changed entries
+            patchable = [(local_hashes[os.path.basename(mod["filename"])], mod["filehash"]) for mod in updated
+                         if mod["filehash"] in missing and os.path.basename(mod["filename"]) in local_hashes]
+            missing -= _patch_cached_mods(cache, patchable)
+
+            names = {mod["filehash"]: os.path.basename(mod["filename"]) for mod in changed}
+            jars = download_files([(API_SERVER_ADDR + BLOB_DOWNLOAD_ENDPOINT + h, h + ".jar") for h in sorted(missing)],
+                                  phase="download mods", labels=[names[h] for h in sorted(missing)], hashes=sorted(missing))
+            for filehash, jar in zip(sorted(missing), jars):
+                cache.add(filehash, jar, move=True)
+
+            # Stage them next to the mods folder straight out of the cache, then swap everything in at once
+            print(f"Updating mods ({len(changed)})...")
+            install = StagedInstall(mods_dir)
+            with _profiler.phase("stage mods", mods=len(changed)):
+                for mod in changed:
+                    install.stage(os.path.basename(mod["filename"]), cache.path(mod["filehash"]))
+                for filename in deleted:
+                    install.delete(filename)
+            with _profiler.phase("install mods"):
+                install.commit()
+
+            with _profiler.phase("evict cache"):
+                cache.evict(keep={mod["filehash"] for mod in changed})
+        finally:
+            cache.save()
+
+        print("Successfully updated mods")
 
 def update_client_shaders():
     # Download shaderpack
@@ -325,7 +779,9 @@ def update_client_shaders():
     shaderpacks_dir = os.path.join(get_minecraft_dir(), "shaderpacks")
     dest = os.path.join(shaderpacks_dir, SHADER_PACK_ENDPOINT)
     if ask_user_replace_file(dest):
-        shutil.copyfile(shaderpack, dest)
+        with _profiler.phase("install shaders") as span:
+            shutil.copyfile(shaderpack, dest)
+            span.add_bytes(os.path.getsize(dest))
         print("Successfully installed shaderpack")
     
 def clear_cache():
@@ -335,7 +791,20 @@ def clear_cache():
 
 ### MAIN PROGRAM ###
 
+def _report_timings(trace_path: str | None):
+    print()
+    print(_profiler.summary())
+
+    if trace_path is not None:
+        try:
+            _profiler.write_trace(trace_path)
+            print("Wrote trace to", os.path.relpath(trace_path))
+        except OSError as e:
+            print(red(f"Could not write trace: {e}"))
+
 def main():
+    global DOWNLOAD_WORKERS, MAX_CONCURRENT_TRANSFERS, CACHE_MAX_BYTES, MODS_ROLE, MODS_DIR
+
     # Init command line parser
     parser = argparse.ArgumentParser(prog=__file__.rsplit(os.sep, maxsplit=1)[-1],
                                      add_help=False,
@@ -353,18 +822,68 @@ def main():
                         nargs=2,
                         metavar=("DIR", "FILE"),
                         help="Compress all mods in DIR to a zip file FILE.")
+    parser.add_argument("-j", "--jobs",
+                        type=int,
+                        metavar="N",
+                        help=f"Download up to N files in parallel (default {DOWNLOAD_WORKERS}).")
+    parser.add_argument("--cache-size",
+                        type=int,
+                        metavar="MB",
+                        help=f"Keep at most MB megabytes of cached mods (default {CACHE_MAX_BYTES // 1024 ** 2}).")
+    parser.add_argument("--role",
+                        choices=("client", "server"),
+                        help=f"Sync the mods a client or the game server runs (default {MODS_ROLE}).")
+    parser.add_argument("--mods-dir",
+                        metavar="DIR",
+                        help="Sync the mods in DIR instead of the .minecraft mods folder.")
     parser.add_argument("--clear-cache",
                         action="store_true",
                         help="Clear your local cache.")
+    parser.add_argument("--timings",
+                        action="store_true",
+                        help="Print how long each step and file took when done.")
+    parser.add_argument("--profile",
+                        metavar="FILE",
+                        help="Like --timings, and also write a trace of the run to FILE (Chrome trace JSON).")
+
+    trace_path = None
 
     try:
         # Parse args and setup
         args = vars(parser.parse_args())
-        if not any(args.values()) or args["help"]:
+        if not any(v for k, v in args.items() if k not in ("jobs", "cache_size", "role", "mods_dir", "timings", "profile")) or args["help"]:
             parser.print_help()
             return
 
-        setup()
+        if args["jobs"] is not None:
+            if args["jobs"] < 1:
+                raise argparse.ArgumentError(None, "--jobs must be at least 1")
+            DOWNLOAD_WORKERS = MAX_CONCURRENT_TRANSFERS = args["jobs"]
+
+        if args["cache_size"] is not None:
+            if args["cache_size"] < 0:
+                raise argparse.ArgumentError(None, "--cache-size must not be negative")
+            CACHE_MAX_BYTES = args["cache_size"] * 1024 ** 2
+
+        if args["role"] is not None:
+            MODS_ROLE = args["role"]
+
+        if args["mods_dir"] is not None:
+            # setup() changes directory, so resolve DIR first
+            MODS_DIR = os.path.abspath(args["mods_dir"])
+            if not os.path.isdir(MODS_DIR):
+                raise argparse.ArgumentError(None, f"--mods-dir is not a directory: {args['mods_dir']}")
+
+        if args["timings"] or args["profile"]:
+            # setup() changes directory, so pin FILE to where it was given
+            trace_path = args["profile"] and os.path.abspath(args["profile"])
+            _profiler.enabled = True
+            _profiler.meta.update(args={k: v for k, v in args.items() if v},
+                                  download_workers=DOWNLOAD_WORKERS,
+                                  hash_workers=HASH_WORKERS)
+
+        with _profiler.phase("setup"):
+            setup()
 
         # Run specified tasks then quit
         if args["update_mods"]:
@@ -385,6 +904,9 @@ def main():
     except Exception as e:
         print(red(e))
         # raise e
+    finally:
+        if _profiler.enabled:
+            _report_timings(trace_path)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,144 @@
+import os
+import json
+import shutil
+
+
+class StagedInstall:
+    """Apply a set of jar changes to a directory as one roll-back-able step
+
+    Everything happens in sibling directories on the same filesystem, so each
+    step is a single os.replace:
+
+        mods.staging/       new jars, written before mods/ is touched
+        mods.backup/        jars displaced from mods/, restored on rollback
+        mods.journal        one JSON line per step, written before the step
+
+    Jars that did not change are never touched. If the program dies halfway,
+    recover() rolls the directory back to exactly how it was.
+    """
+
+    def __init__(self, target_dir: str):
+        if not isinstance(target_dir, str):
+            raise TypeError("target_dir must be a str")
+
+        self.target_dir = os.path.abspath(target_dir)
+        self.staging_dir = self.target_dir + ".staging"
+        self.backup_dir = self.target_dir + ".backup"
+        self.journal_path = self.target_dir + ".journal"
+
+        self.staged: list[str] = []
+        self.deleted: list[str] = []
+
+    def _target(self, name: str):
+        return os.path.join(self.target_dir, name)
+
+    def _staged(self, name: str):
+        return os.path.join(self.staging_dir, name)
+
+    def _backup(self, name: str):
+        return os.path.join(self.backup_dir, name)
+
+    def staging_path(self, name: str):
+        """Where a new jar should be written so that commit() installs it"""
+        name = os.path.basename(name)
+        os.makedirs(self.staging_dir, exist_ok=True)
+        if name not in self.staged:
+            self.staged.append(name)
+        return self._staged(name)
+
+    def stage(self, name: str, src: str):
+        """Stage a copy of src, hardlinked when possible"""
+        dest = self.staging_path(name)
+        if os.path.exists(dest):
+            os.remove(dest)
+        try:
+            os.link(src, dest)
+        except OSError:
+            shutil.copyfile(src, dest)
+
+    def delete(self, name: str):
+        """Remove name from the target directory on commit"""
+        self.deleted.append(os.path.basename(name))
+
+    def _log(self, journal, op: str, name: str | None = None):
+        journal.write(json.dumps({"op": op, "name": name}) + "\n")
+        journal.flush()
+        os.fsync(journal.fileno())
+
+    def commit(self):
+        """Install staged jars, then delete removed ones; roll back on any error"""
+        if os.path.exists(self.journal_path):
+            raise Exception("A previous install was interrupted, run recover() first")
+
+        os.makedirs(self.backup_dir, exist_ok=True)
+
+        try:
+            with open(self.journal_path, "w") as journal:
+                # Additions and updates first, so a failure never leaves mods missing
+                for name in self.staged:
+                    if os.path.exists(self._target(name)):
+                        self._log(journal, "backup", name)
+                        os.replace(self._target(name), self._backup(name))
+
+                    self._log(journal, "install", name)
+                    os.replace(self._staged(name), self._target(name))
+
+                # Deletions last
+                for name in self.deleted:
+                    if os.path.exists(self._target(name)):
+                        self._log(journal, "backup", name)
+                        os.replace(self._target(name), self._backup(name))
+
+                self._log(journal, "done")
+        except BaseException:
+            StagedInstall.recover(self.target_dir)
+            raise
+
+        self._cleanup()
+
+    def _cleanup(self):
+        shutil.rmtree(self.staging_dir, ignore_errors=True)
+        shutil.rmtree(self.backup_dir, ignore_errors=True)
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+
+    @staticmethod
+    def _read_journal(path: str):
+        steps = []
+        with open(path, "r") as journal:
+            for line in journal:
+                try:
+                    steps.append(json.loads(line))
+                except ValueError:
+                    # A torn final line means its step never started
+                    break
+        return steps
+
+    @classmethod
+    def recover(cls, target_dir: str):
+        """Finish or undo an interrupted commit. Returns True if there was one."""
+        install = cls(target_dir)
+        if not os.path.exists(install.journal_path):
+            return False
+
+        steps = cls._read_journal(install.journal_path)
+
+        # Every step was applied, only the cleanup is missing
+        if steps and steps[-1]["op"] == "done":
+            install._cleanup()
+            return True
+
+        # Undo in reverse. Each undo checks the filesystem first, so it is
+        # safe whether or not the logged step actually happened, and safe to
+        # run again if we crash while rolling back.
+        for step in reversed(steps):
+            name = step["name"]
+            if step["op"] == "install":
+                if os.path.exists(install._target(name)) and not os.path.exists(install._staged(name)):
+                    os.replace(install._target(name), install._staged(name))
+            elif step["op"] == "backup":
+                if os.path.exists(install._backup(name)) and not os.path.exists(install._target(name)):
+                    os.replace(install._backup(name), install._target(name))
+
+        install._cleanup()
+        return True
@@ -0,0 +1,52 @@
+import json
+import hashlib
+
+
+# Patch ops, as written by the server: [COPY, old_offset, length] or [DATA, length]
+COPY = 0
+DATA = 1
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class PatchMismatch(Exception):
+    """The rebuilt jar does not hash to what the patch promised"""
+    def __init__(self, *args):
+        super().__init__(*args)
+
+
+def _copy(src, dst, length: int, digest):
+    while length > 0:
+        data = src.read(min(length, CHUNK_SIZE))
+        if not data:
+            raise PatchMismatch("Patch or old jar is truncated")
+        dst.write(data)
+        digest.update(data)
+        length -= len(data)
+
+
+def apply_patch(old_path: str, patch_path: str, dest: str):
+    """Rebuild a jar from its old version and a patch, and verify its sha256
+
+    The patch is one JSON header line followed by the raw bytes of every
+    DATA op, in order. Returns the sha256 of the rebuilt jar.
+    """
+    digest = hashlib.sha256()
+
+    with open(patch_path, "rb") as patch, open(old_path, "rb") as old, open(dest, "wb") as out:
+        header = json.loads(patch.readline())
+
+        for op in header["ops"]:
+            if op[0] == COPY:
+                old.seek(op[1])
+                _copy(old, out, op[2], digest)
+            elif op[0] == DATA:
+                _copy(patch, out, op[1], digest)
+            else:
+                raise PatchMismatch(f"Unknown patch op {op[0]}")
+
+    filehash = digest.hexdigest()
+    if filehash != header["new"]:
+        raise PatchMismatch(f"Rebuilt jar hashes to {filehash}, expected {header['new']}")
+
+    return filehash
@@ -0,0 +1,204 @@
+import os
+import sys
+import json
+import time
+import platform
+import threading
+import contextlib
+
+
+class Span:
+    """One timed piece of work, with the bytes it moved"""
+
+    __slots__ = ("name", "category", "args", "depth", "tid", "start", "end", "bytes")
+
+    def __init__(self, name: str, category: str, args: dict, depth: int, tid: int):
+        self.name = name
+        self.category = category
+        self.args = args
+        self.depth = depth
+        self.tid = tid
+        self.start = time.perf_counter()
+        self.end = None
+        self.bytes = 0
+
+    def add_bytes(self, n: int):
+        self.bytes += n
+
+    @property
+    def seconds(self):
+        return (self.end if self.end is not None else time.perf_counter()) - self.start
+
+
+class _NullSpan:
+    """Stands in for a Span while profiling is off"""
+
+    __slots__ = ()
+
+    @property
+    def args(self):
+        # A fresh dict every time, so updates made while disabled go nowhere
+        return {}
+
+    def add_bytes(self, n: int):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def _format_bytes(n: int):
+    if not n:
+        return ""
+    for unit in ("B", "KiB", "MiB"):
+        if n < 1024:
+            return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+        n /= 1024
+    return f"{n:.2f} GiB"
+
+def _format_rate(n: int, seconds: float):
+    if not n or seconds <= 0:
+        return ""
+    return f"{n / seconds / 1024 ** 2:.1f}"
+
+
+class Profiler:
+    """Records wall time and bytes of each phase of a run and each file in it
+
+    Phases are the steps of a run (hashing, the client check, downloads,
+    installing); files are the single transfers, hashes and patches inside
+    them, often on worker threads. While disabled, phase() and file() hand
+    out a shared no-op span, so call sites can stay in place for free.
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.meta = {}
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()
+        self._spans: list[Span] = []
+        self._threads: dict[int, tuple[int, str]] = {}
+        self._local = threading.local()
+
+    def _tid(self):
+        # Small stable thread numbers read better in a trace viewer than idents
+        ident = threading.get_ident()
+        with self._lock:
+            if ident not in self._threads:
+                self._threads[ident] = (len(self._threads) + 1, threading.current_thread().name)
+            return self._threads[ident][0]
+
+    @contextlib.contextmanager
+    def _span(self, name: str, category: str, args: dict):
+        if not self.enabled:
+            yield _NULL_SPAN
+            return
+
+        depth = getattr(self._local, "depth", 0)
+        self._local.depth = depth + 1
+        span = Span(name, category, args, depth, self._tid())
+        try:
+            yield span
+        except BaseException as e:
+            span.args["error"] = e.__class__.__name__
+            raise
+        finally:
+            span.end = time.perf_counter()
+            self._local.depth = depth
+            with self._lock:
+                self._spans.append(span)
+
+    def phase(self, name: str, **args):
+        """Time one step of the run, e.g. `with profiler.phase("hash mods") as span:`"""
+        return self._span(name, "phase", args)
+
+    def file(self, kind: str, name: str, **args):
+        """Time one file of a given kind (download, hash, patch...)"""
+        return self._span(kind, "file", {"file": name, **args})
+
+    def spans(self):
+        with self._lock:
+            return sorted(self._spans, key=lambda s: s.start)
+
+    def summary(self, slowest: int = 5):
+        """Table of every phase, totals per kind of file and the slowest files"""
+        spans = self.spans()
+        phases = [s for s in spans if s.category == "phase"]
+        files = [s for s in spans if s.category == "file"]
+        lines = []
+
+        row = "{:<32} {:>9} {:>12} {:>9}"
+        lines.append(row.format("Phase", "Wall (s)", "Bytes", "MiB/s"))
+        for s in phases:
+            name = "  " * s.depth + s.name + (" (failed)" if "error" in s.args else "")
+            lines.append(row.format(name, f"{s.seconds:.3f}", _format_bytes(s.bytes), _format_rate(s.bytes, s.seconds)))
+        lines.append(row.format("total", f"{time.perf_counter() - self._origin:.3f}", "", ""))
+
+        if files:
+            # Files overlap on worker threads, so throughput is over the wall time they span
+            kinds = {}
+            for s in files:
+                kinds.setdefault(s.name, []).append(s)
+
+            row = "{:<16} {:>6} {:>9} {:>9} {:>12} {:>9}"
+            lines.append("")
+            lines.append(row.format("Files", "Count", "Wall (s)", "Busy (s)", "Bytes", "MiB/s"))
+            for kind, group in kinds.items():
+                wall = max(s.end for s in group) - min(s.start for s in group)
+                n_bytes = sum(s.bytes for s in group)
+                lines.append(row.format(kind, len(group), f"{wall:.3f}", f"{sum(s.seconds for s in group):.3f}",
+                                        _format_bytes(n_bytes), _format_rate(n_bytes, wall)))
+
+            row = "{:<10} {:<40} {:>9} {:>12} {:>9}"
+            lines.append("")
+            lines.append(row.format("Slowest", "File", "Time (s)", "Bytes", "MiB/s"))
+            for s in sorted(files, key=lambda s: s.seconds, reverse=True)[:slowest]:
+                lines.append(row.format(s.name, str(s.args["file"])[:40], f"{s.seconds:.3f}",
+                                        _format_bytes(s.bytes), _format_rate(s.bytes, s.seconds)))
+
+        return "\n".join(lines)
+
+    def trace(self):
+        """Everything recorded, in the Chrome trace event format (chrome://tracing, Perfetto)"""
+        pid = os.getpid()
+        events = []
+
+        with self._lock:
+            threads = list(self._threads.values())
+        for tid, name in threads:
+            events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}})
+
+        for s in self.spans():
+            args = dict(s.args)
+            if s.bytes:
+                args["bytes"] = s.bytes
+                args["mib_per_s"] = round(s.bytes / max(s.seconds, 1e-9) / 1024 ** 2, 3)
+
+            events.append({
+                "name": s.name,
+                "cat": s.category,
+                "ph": "X",
+                "ts": round((s.start - self._origin) * 1e6, 1),
+                "dur": round(s.seconds * 1e6, 1),
+                "pid": pid,
+                "tid": s.tid,
+                "args": args,
+            })
+
+        return {
+            "traceEvents": events,
+            "displayTimeUnit": "ms",
+            "otherData": {
+                "platform": platform.platform(),
+                "python": sys.version.split()[0],
+                "cpus": os.cpu_count(),
+                "started": time.strftime("%Y-%m-%dT%H:%M:%S%z", time.localtime(time.time() - (time.perf_counter() - self._origin))),
+                **self.meta,
+            },
+        }
+
+    def write_trace(self, path: str):
+        tmp = path + ".tmp"
+        with open(tmp, "w") as file:
+            json.dump(self.trace(), file)
+        os.replace(tmp, path)
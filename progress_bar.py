@@ -1,7 +1,98 @@
+import sys
+import time
+import shutil
+import threading
 
 
-class ProgressBar:
-    """Naive progress bar which assumes unique access to stdout on a single line"""
+def _format_bytes(n: float):
+    for unit in ("B", "KiB", "MiB"):
+        if n < 1024:
+            return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+        n /= 1024
+    return f"{n:.2f} GiB"
+
+def _format_duration(seconds: float):
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+    return f"{seconds // 60}:{seconds % 60:02d}"
+
+
+class Task:
+    """Progress of one transfer (unit "B") or of a count of items (unit "")
+
+    total may be None while the size is unknown; the bar then shows a
+    spinner and a running count instead of a percentage and ETA.
+    """
+
+    # weight of the newest sample in the smoothed rate
+    RATE_SMOOTHING = 0.3
+
+    def __init__(self, renderer: "ProgressRenderer", label: str, total: int | None, unit: str, transient: bool):
+        self.renderer = renderer
+        self.label = label
+        self.total = total
+        self.unit = unit
+        self.transient = transient
+        self.value = 0
+        self.finished = False
+
+        self.started = time.monotonic()
+        self.rate = None
+        self._rate_value = 0
+        self._rate_time = self.started
+        self._logged_step = 0
+
+    def update(self, value: int):
+        """Set the amount done so far; cheap enough to call for every chunk"""
+        self.value = value
+        self.renderer._changed(self)
+
+    def advance(self, n: int = 1):
+        self.update(self.value + n)
+
+    def set_total(self, total: int | None):
+        self.total = total
+        self.renderer._changed(self)
+
+    def finish(self):
+        if self.finished:
+            return
+        if self.total is None:
+            self.total = self.value
+        self.finished = True
+        self.renderer._finished(self)
+
+    def _sample_rate(self, now: float):
+        elapsed = now - self._rate_time
+        if elapsed < 0.05:
+            return
+
+        current = (self.value - self._rate_value) / elapsed
+        if self.rate is None or current < 0:
+            self.rate = max(current, 0)
+        else:
+            self.rate = self.RATE_SMOOTHING * current + (1 - self.RATE_SMOOTHING) * self.rate
+
+        self._rate_value = self.value
+        self._rate_time = now
+
+
+class ProgressRenderer:
+    """Draws progress bars for one or more concurrent tasks
+
+    Tasks can be updated from any thread as often as data arrives; the
+    terminal is only redrawn every `interval` seconds (and whenever a task
+    starts or ends), all bars in one write. When the stream is not a TTY
+    nothing is redrawn and no escape codes are written: each task prints a
+    plain line every `log_step` of its total and when it finishes, except
+    transient tasks, which only ever show on a live terminal.
+
+        with ProgressRenderer() as progress:
+            task = progress.add("mod.jar", total=size)
+            task.update(n_read)
+            task.finish()
+    """
 
     BLOCKS = (
         "\u258F",
@@ -13,101 +104,223 @@ class ProgressBar:
         "\u2589",
         "\u2588")
 
+    LABEL_WIDTH = 24
+
     @staticmethod
     def _hex_to_rgb_ansi(hex: int):
         if not isinstance(hex, int):
             raise TypeError("hex must be an integer")
-        
+
         s = "{:06x}".format(hex)
-        
+
         b = int(s[-2:], base=16)
         g = int(s[-4:-2], base=16)
         r = int(s[-6:-4], base=16)
 
         return f"\x1b[38;2;{r};{g};{b}m"
 
-    def __init__(self, size_bytes: int, width: int, color_hex: int = None):
-        if not isinstance(size_bytes, int):
-            raise TypeError("size_bytes must be an integer")
+    def __init__(self, width: int = 30, *,
+                 color_hex: int | None = None,
+                 interval: float = 0.1,
+                 log_step: float = 0.25,
+                 stream=None):
         if not isinstance(width, int):
             raise TypeError("width must be an integer")
-        if not isinstance(color_hex, int):
+        if color_hex is not None and not isinstance(color_hex, int):
             raise TypeError("color_hex must be an integer")
-        
-        if size_bytes < 1:
-            raise ValueError("size_bytes must be positive")
         if width < 1:
             raise ValueError("width must be positive")
-        
-        self.size_bytes = size_bytes
+        if interval < 0:
+            raise ValueError("interval must not be negative")
+        if not 0 < log_step <= 1:
+            raise ValueError("log_step must be in (0, 1]")
+
         self.width = width
-        self.color_ansi = None if color_hex is None else ProgressBar._hex_to_rgb_ansi(color_hex)
+        self.interval = interval
+        self.log_step = log_step
+        self.stream = stream if stream is not None else sys.stdout
+
+        try:
+            self.ansi = self.stream.isatty()
+        except (AttributeError, ValueError):
+            self.ansi = False
+        self.color_ansi = None if color_hex is None or not self.ansi else ProgressRenderer._hex_to_rgb_ansi(color_hex)
 
-        # import shutil
-        # terminal_size = shutil.get_terminal_size((-1,-1))
-        # print(f"{terminal_size=}")
+        self._lock = threading.RLock()
+        self._tasks: list[Task] = []
+        self._lines = 0
+        self._next_draw = 0.0
+        self._open = False
 
     def __enter__(self):
-        print("\x1b[?25l", end="", flush=True) # hide cursor
+        self._open = True
+        if self.ansi:
+            self._write("\x1b[?25l") # hide cursor
         return self
 
     def __exit__(self, exc_type, exc, tb):
-        print("\x1b[?25h") # show cursor and print newline
-    
-    def _make_bar(self, progress: float):
-        n_full_blocks = int(progress * self.width)
-        blocks = ProgressBar.BLOCKS[7] * n_full_blocks
-        partial_block_size = int(progress * self.width * 8) % 8
-        if partial_block_size > 0:
-            blocks += ProgressBar.BLOCKS[partial_block_size - 1]
-
-        bar = ""
-        if self.color_ansi is not None:
-            bar += self.color_ansi
-        
-        bar += "{:{width}s}".format(blocks, width=self.width)
-        
-        if self.color_ansi is not None:
-            bar += "\x1b[0m"
+        with self._lock:
+            if self.ansi:
+                self._draw(time.monotonic())
+                self._write("\n" if self._lines else "")
+                self._write("\x1b[?25h") # show cursor
+            self._open = False
+            self._lines = 0
+
+    def add(self, label: str, total: int | None = None, *, unit: str = "B", transient: bool = False):
+        """Start showing a new task; transient ones disappear once finished"""
+        task = Task(self, label, total, unit, transient)
+        with self._lock:
+            self._tasks.append(task)
+            self._redraw()
+        return task
+
+    def log(self, message: str):
+        """Print a line above the bars without garbling them"""
+        with self._lock:
+            if self.ansi and self._lines:
+                self._write(self._clear() + message + "\n")
+                self._lines = 0
+                self._redraw()
+            else:
+                self._write(message + "\n")
+
+    def _write(self, s: str):
+        self.stream.write(s)
+        self.stream.flush()
+
+    def _changed(self, task: Task):
+        if not self._open:
+            return
+
+        if self.ansi:
+            now = time.monotonic()
+            if now >= self._next_draw:
+                with self._lock:
+                    if now >= self._next_draw:
+                        self._draw(now)
+        elif task.total and not task.transient:
+            step = int(task.value / task.total / self.log_step)
+            if step > task._logged_step and task.value < task.total:
+                task._logged_step = step
+                with self._lock:
+                    self._write(self._plain_line(task) + "\n")
+
+    def _finished(self, task: Task):
+        with self._lock:
+            if not self._open:
+                return
+            if self.ansi:
+                if task.transient:
+                    self._tasks.remove(task)
+                self._redraw()
+            elif not task.transient:
+                self._write(self._plain_line(task) + "\n")
+
+    def _redraw(self):
+        if self._open and self.ansi:
+            self._draw(time.monotonic())
+
+    def _clear(self):
+        # Back to the start of the first bar drawn last time, then wipe below
+        up = f"\x1b[{self._lines - 1}A" if self._lines > 1 else ""
+        return "\r" + up + "\x1b[J"
+
+    def _draw(self, now: float):
+        columns, rows = shutil.get_terminal_size()
+
+        tasks = self._tasks
+        hidden = 0
+        if len(tasks) > max(rows - 2, 1):
+            # Keep unfinished work in view when there isn't room for everything
+            shown = max(rows - 3, 1)
+            tasks = [t for t in tasks if not t.finished][:shown] or tasks[:shown]
+            hidden = len(self._tasks) - len(tasks)
 
+        lines = []
+        for task in tasks:
+            task._sample_rate(now)
+            lines.append(self._bar_line(task, now, columns - 1))
+        if hidden:
+            lines.append(f"  ... and {hidden} more")
+
+        self._write(self._clear() + "\n".join(lines))
+        self._lines = len(lines)
+        self._next_draw = now + self.interval
+
+    def _stats(self, task: Task, now: float):
+        fmt = _format_bytes if task.unit == "B" else str
+        parts = []
+
+        if task.total:
+            parts.append(f"{100 * min(task.value / task.total, 1):5.1f}%")
+            parts.append(f"{fmt(task.value)}/{fmt(task.total)}")
+        else:
+            parts.append(fmt(task.value))
+
+        if task.finished:
+            parts.append(f"in {_format_duration(now - task.started)}")
+        elif task.rate:
+            parts.append(f"{_format_bytes(task.rate)}/s" if task.unit == "B" else f"{task.rate:.1f} {task.unit}/s".replace("  ", " "))
+            if task.total:
+                parts.append(f"ETA {_format_duration(max(task.total - task.value, 0) / task.rate)}")
+
+        return "  ".join(parts)
+
+    def _make_bar(self, task: Task, width: int, now: float):
+        if task.total:
+            progress = min(task.value / task.total, 1)
+            n_full_blocks = int(progress * width)
+            blocks = ProgressRenderer.BLOCKS[7] * n_full_blocks
+            partial_block_size = int(progress * width * 8) % 8
+            if partial_block_size > 0:
+                blocks += ProgressRenderer.BLOCKS[partial_block_size - 1]
+        elif task.finished:
+            blocks = ProgressRenderer.BLOCKS[7] * width
+        else:
+            # Unknown size, bounce a short block back and forth
+            size = min(3, width)
+            span = max(width - size, 1)
+            pos = int(now * 10) % (2 * span)
+            pos = pos if pos < span else 2 * span - pos
+            blocks = " " * pos + ProgressRenderer.BLOCKS[7] * size
+
+        bar = "{:{width}s}".format(blocks, width=width)
+        if self.color_ansi is not None:
+            bar = self.color_ansi + bar + "\x1b[0m"
         return bar
 
-    def update(self, n_bytes: int):
-        if not isinstance(n_bytes, int):
-            raise TypeError("n_bytes must be an integer")
-        if n_bytes < 1:
-            raise ValueError("n_bytes must be positive")
-        
-        progress = n_bytes / self.size_bytes
-        display = "\r|{}| {:.2f}%".format(self._make_bar(progress), 100 * progress)
+    def _bar_line(self, task: Task, now: float, columns: int):
+        label = task.label[:self.LABEL_WIDTH].ljust(self.LABEL_WIDTH) if task.label else ""
+        stats = self._stats(task, now)
+
+        # Never wrap, or the cursor math for the next redraw is off
+        width = min(self.width, columns - len(label) - len(stats) - 5)
+        if width < 5:
+            return (label + " " + stats)[:columns]
+        return f"{label} |{self._make_bar(task, width, now)}| {stats}".lstrip()
 
-        print(display, end="", flush=True)
+    def _plain_line(self, task: Task):
+        label = f"{task.label}: " if task.label else ""
+        return label + self._stats(task, time.monotonic())
 
 
 
 if __name__ == "__main__":
-    import time
-    
-    bar = ProgressBar(255, 30, color_hex=0xffff00)
-    print("EXAMPLE:\x1b[?25l")
-    for i in range(1, 256):
-        bar.update(i)
-        time.sleep(0.02)
-    print("\x1b[?25h")
-
-    # print(ProgressBar._hex_to_rgb_ansi(0x000000) + "hello" + "\x1b[0m")
-    # print(ProgressBar._hex_to_rgb_ansi(0x110000) + "hello" + "\x1b[0m")
-    # print(ProgressBar._hex_to_rgb_ansi(0x220000) + "hello" + "\x1b[0m")
-    # print(ProgressBar._hex_to_rgb_ansi(0x330000) + "hello" + "\x1b[0m")
-    # print(ProgressBar._hex_to_rgb_ansi(0x440000) + "hello" + "\x1b[0m")
-    # print(ProgressBar._hex_to_rgb_ansi(0x550000) + "hello" + "\x1b[0m")
-    # print(ProgressBar._hex_to_rgb_ansi(0x660000) + "hello" + "\x1b[0m")
-    # print(ProgressBar._hex_to_rgb_ansi(0x770000) + "hello" + "\x1b[0m")
-    # print(ProgressBar._hex_to_rgb_ansi(0x880000) + "hello" + "\x1b[0m")
-    # print(ProgressBar._hex_to_rgb_ansi(0x990000) + "hello" + "\x1b[0m")
-    # print(ProgressBar._hex_to_rgb_ansi(0xaa0000) + "hello" + "\x1b[0m")
-    # print(ProgressBar._hex_to_rgb_ansi(0xbb0000) + "hello" + "\x1b[0m")
-    # print(ProgressBar._hex_to_rgb_ansi(0xcc0000) + "hello" + "\x1b[0m")
-    # print(ProgressBar._hex_to_rgb_ansi(0xdd0000) + "hello" + "\x1b[0m")
-    # print(ProgressBar._hex_to_rgb_ansi(0xee0000) + "hello" + "\x1b[0m")
-    # print(ProgressBar._hex_to_rgb_ansi(0xff0000) + "hello" + "\x1b[0m")
+    import random
+
+    with ProgressRenderer(color_hex=0xffff00) as progress:
+        progress.log("EXAMPLE:")
+        overall = progress.add("Total", 4, unit="files")
+        sizes = [random.randint(1, 20) * 1024 ** 2 for _ in range(3)] + [None]
+        tasks = [progress.add(f"file-{i}.jar", size, transient=True) for i, size in enumerate(sizes)]
+
+        while tasks:
+            time.sleep(0.01)
+            for task in list(tasks):
+                task.advance(random.randint(0, 256) * 1024)
+                if task.value >= (task.total or 12 * 1024 ** 2):
+                    task.finish()
+                    tasks.remove(task)
+                    overall.advance()
+        overall.finish()
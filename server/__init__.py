@@ -1,5 +1,9 @@
 from flask import Flask
-from .config import check_config
+from .config import check_config, INDEXER_ENABLED
+from .database.db import init_db
+from .uploads import UploadRequest
+from .assets import init_assets
+from .metrics import init_metrics
 
 
 def create_app() -> Flask:
@@ -7,6 +11,9 @@ def create_app() -> Flask:
     # check that config is valid
     check_config()
 
+    # create tables once, not on every request
+    init_db()
+
     # create Flask app object
     app = Flask(
         __name__,
@@ -14,6 +21,15 @@ def create_app() -> Flask:
         static_folder='static'
     )
 
+    # hash uploads while they are written to disk instead of re-reading them
+    app.request_class = UploadRequest
+
+    # request timings and /metrics, registered first so they see the final response
+    init_metrics(app)
+
+    # fingerprinted, precompressed static files and gzipped JSON
+    init_assets(app)
+
     # import route blueprints
     from server.routes import api_bp, web_bp
 
@@ -21,5 +37,14 @@ def create_app() -> Flask:
     app.register_blueprint(web_bp)
     app.register_blueprint(api_bp, url_prefix='/api')
 
+    # `flask --app server import-mods` registers jars already on disk
+    from server.reconcile import import_mods_command
+    app.cli.add_command(import_mods_command)
+
+    # keep the Mods table in sync with jars dropped into or removed from the mods directories
+    if INDEXER_ENABLED:
+        from server.indexer import start_indexer
+        app.extensions['mods_indexer'] = start_indexer()
+
     # return Flask app object
     return app
\ No newline at end of file
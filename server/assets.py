@@ -0,0 +1,182 @@
+from dataclasses import dataclass
+from gzip import compress
+from hashlib import sha256
+from mimetypes import guess_type
+from os import stat, walk
+from os.path import join, relpath, splitext
+from threading import Lock
+from flask import Flask, Request, Response, abort, request
+from server.config import JSON_GZIP_MIN_BYTES
+
+# listed in server-requirements.txt, without it only gzip variants are built
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# only text compresses, images and archives are already as small as they get
+COMPRESSIBLE_EXTENSIONS = {'.css', '.js', '.json', '.svg', '.html', '.txt', '.map'}
+
+# fingerprinted URLs never change content, so browsers may keep them for a year
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+@dataclass(frozen=True)
+class Asset:
+    '''One static file with its fingerprint and precompressed variants'''
+    path: str
+    url_path: str
+    mimetype: str
+    fingerprint: str
+    mtime_ns: int
+    variants: dict[str, bytes]
+
+
+def _fingerprinted(rel_path: str, fingerprint: str) -> str:
+    '''css/home.css -> css/home.<fingerprint>.css'''
+    stem, ext = splitext(rel_path)
+    return f'{stem}.{fingerprint}{ext}'
+
+
+def _build_asset(root: str, rel_path: str, mtime_ns: int) -> Asset:
+    path = join(root, rel_path)
+    with open(path, 'rb') as f:
+        body = f.read()
+
+    fingerprint = sha256(body).hexdigest()[:12]
+    variants = {'identity': body}
+
+    # compressed once here, never per request
+    if splitext(rel_path)[1] in COMPRESSIBLE_EXTENSIONS:
+        variants['gzip'] = compress(body, compresslevel=9, mtime=0)
+        if brotli is not None:
+            variants['br'] = brotli.compress(body, quality=11)
+
+    mimetype = guess_type(rel_path)[0] or 'application/octet-stream'
+
+    return Asset(path, _fingerprinted(rel_path, fingerprint), mimetype, fingerprint, mtime_ns, variants)
+
+
+class AssetStore:
+    '''Fingerprints and precompresses everything under the static folder
+
+    Assets are built at startup. With check_changes (debug mode) files are
+    re-stat'ed on each lookup and rebuilt when their mtime moves.
+    '''
+
+    def __init__(self, root: str, check_changes: bool = False):
+        self.root = root
+        self.check_changes = check_changes
+        self._lock = Lock()
+        self._by_path: dict[str, Asset] = {}
+        self._by_url: dict[str, Asset] = {}
+        self.build()
+
+    def build(self):
+        by_path = {}
+
+        for dirpath, _, filenames in walk(self.root):
+            for filename in filenames:
+                rel_path = relpath(join(dirpath, filename), self.root).replace('\\', '/')
+                mtime_ns = self._mtime(rel_path)
+
+                old = self._by_path.get(rel_path)
+                if old is not None and old.mtime_ns == mtime_ns:
+                    by_path[rel_path] = old
+                else:
+                    by_path[rel_path] = _build_asset(self.root, rel_path, mtime_ns)
+
+        with self._lock:
+            self._by_path = by_path
+            self._by_url = {asset.url_path: asset for asset in by_path.values()}
+
+    def _mtime(self, rel_path: str) -> int:
+        return stat(join(self.root, rel_path)).st_mtime_ns
+
+    def _changed(self) -> bool:
+        try:
+            return any(self._mtime(p) != a.mtime_ns for p, a in self._by_path.items())
+        except FileNotFoundError:
+            return True
+
+    def url_for(self, rel_path: str) -> str:
+        '''Fingerprinted URL of a static file, or its plain /static URL if it is unknown'''
+        if self.check_changes and self._changed():
+            self.build()
+
+        asset = self._by_path.get(rel_path)
+        if asset is None:
+            return f'/static/{rel_path}'
+
+        return f'/assets/{asset.url_path}'
+
+    def get(self, url_path: str) -> Asset | None:
+        return self._by_url.get(url_path)
+
+
+def pick_encoding(variants: dict[str, bytes], req: Request) -> str:
+    '''Best encoding this client accepts among those we have, brotli first'''
+    for encoding in ('br', 'gzip'):
+        if encoding in variants and req.accept_encodings[encoding] > 0:
+            return encoding
+    return 'identity'
+
+
+def asset_response(asset: Asset, req: Request) -> Response:
+    encoding = pick_encoding(asset.variants, req)
+
+    etag = asset.fingerprint if encoding == 'identity' else f'{asset.fingerprint}-{encoding}'
+
+    if req.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(asset.variants[encoding], mimetype=asset.mimetype)
+        if encoding != 'identity':
+            response.content_encoding = encoding
+
+    response.set_etag(etag)
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.max_age = IMMUTABLE_MAX_AGE
+    response.cache_control.immutable = True
+
+    return response
+
+
+def compress_json(response: Response) -> Response:
+    '''Gzip JSON API responses that weren't compressed when they were built'''
+    if (response.mimetype != 'application/json'
+            or response.direct_passthrough
+            or response.is_streamed
+            or response.content_encoding
+            or request.accept_encodings['gzip'] <= 0):
+        return response
+
+    body = response.get_data()
+    if len(body) < JSON_GZIP_MIN_BYTES:
+        return response
+
+    response.set_data(compress(body, compresslevel=5))
+    response.content_encoding = 'gzip'
+    response.vary.add('Accept-Encoding')
+
+    return response
+
+
+def init_assets(app: Flask):
+    '''Serve the static folder at fingerprinted URLs and compress JSON responses'''
+    store = AssetStore(app.static_folder, check_changes=app.debug)
+    app.extensions['assets'] = store
+
+    # templates use {{ asset_url('css/home.css') }} instead of hard-coded /static paths
+    app.jinja_env.globals['asset_url'] = store.url_for
+
+    @app.route('/assets/<path:url_path>')
+    def send_asset(url_path: str):
+        asset = store.get(url_path)
+        if asset is None:
+            abort(404)
+        return asset_response(asset, request)
+
+    app.after_request(compress_json)
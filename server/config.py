@@ -1,24 +1,41 @@
+from os import environ
+from os.path import dirname
+
+
+# every path below can be overridden with an MCMM_<NAME> environment variable,
+# which lets benchmarks and tests point the app at a scratch directory
+
+
 ############ SERVER DIRECTORY PATHS ############
 
 
 # mods directory for the server 
-SERVER_MODS_DIR = '/home/msch/Projects/Minecraft-Mods-Manager/sandbox/mods'
+SERVER_MODS_DIR = environ.get('MCMM_SERVER_MODS_DIR', '/home/msch/Projects/Minecraft-Mods-Manager/sandbox/mods')
 
 # directory for holding client-specific mods
-CLIENT_MODS_DIR = '/home/msch/Projects/Minecraft-Mods-Manager/sandbox/client_mods'
+CLIENT_MODS_DIR = environ.get('MCMM_CLIENT_MODS_DIR', '/home/msch/Projects/Minecraft-Mods-Manager/sandbox/client_mods')
 
 # directory for holding temp files
-TEMP_DIR = None
+TEMP_DIR = environ.get('MCMM_TEMP_DIR')
+
+# content-addressed store of every uploaded jar, laid out as <ab>/<cdef...>
+BLOB_DIR = environ.get('MCMM_BLOB_DIR', '/home/msch/Projects/Minecraft-Mods-Manager/sandbox/blobs')
+
+# modpack zips built on the fly, cached per role and manifest generation
+PACK_CACHE_DIR = environ.get('MCMM_PACK_CACHE_DIR', '/home/msch/Projects/Minecraft-Mods-Manager/sandbox/packs')
+
+# per-jar entry manifests and the jar-to-jar patches built from them
+PATCH_CACHE_DIR = environ.get('MCMM_PATCH_CACHE_DIR', '/home/msch/Projects/Minecraft-Mods-Manager/sandbox/patches')
 
 
 ############ SERVER FILEPATHS (MUST BE ABSOLUTE) ############
 
 
 # path to where sqlite database file should be located
-DB_PATH = '/home/msch/Projects/Minecraft-Mods-Manager/sandbox/db/database.sqlite'
+DB_PATH = environ.get('MCMM_DB_PATH', '/home/msch/Projects/Minecraft-Mods-Manager/sandbox/db/database.sqlite')
 
 # path to minecraft installer
-MOD_LOADER_PATH = None
+MOD_LOADER_PATH = environ.get('MCMM_MOD_LOADER_PATH')
 
 
 ############ SERVER CONSTANTS ############
@@ -38,8 +55,72 @@ MC_DIFFICULTY = None
 MC_MODLOADER = None
 
 
+############ DATABASE TUNING ############
+
+
+# how long a connection waits on a locked database before raising (milliseconds)
+DB_BUSY_TIMEOUT_MS = 5000
+
+# how often a worker re-reads the manifest generation written by other processes (seconds)
+MANIFEST_CHECK_INTERVAL = 1.0
+
+
+############ FILE DOWNLOADS ############
+
+
+# how jars, packs and the installer are sent:
+#   'flask'      - send_file, the worker streams the file itself
+#   'sendfile'   - send_file, with byte ranges handed to the WSGI server's os.sendfile path too
+#   'x-accel'    - nginx sends the file from an internal location (X-Accel-Redirect)
+#   'x-sendfile' - Apache/lighttpd send the file from its path (X-Sendfile)
+SENDFILE_BACKEND = environ.get('MCMM_SENDFILE_BACKEND', 'sendfile')
+
+# internal nginx locations serving each directory, for the 'x-accel' backend
+X_ACCEL_LOCATIONS = {
+    BLOB_DIR: '/internal/blobs/',
+    SERVER_MODS_DIR: '/internal/mods/',
+    CLIENT_MODS_DIR: '/internal/client_mods/',
+    PACK_CACHE_DIR: '/internal/packs/',
+    PATCH_CACHE_DIR: '/internal/patches/',
+}
+
+if MOD_LOADER_PATH is not None:
+    X_ACCEL_LOCATIONS[dirname(MOD_LOADER_PATH)] = '/internal/loader/'
+
+
+############ METRICS ############
+
+
+# request, database and download metrics in the Prometheus text format at /metrics
+METRICS_ENABLED = environ.get('MCMM_METRICS', '1') != '0'
+
+# IP's allowed to scrape /metrics (None lets anyone)
+METRICS_IPS = ADMIN_IPS
+
+
+############ RESPONSE COMPRESSION ############
+
+
+# JSON responses smaller than this go out uncompressed (bytes)
+JSON_GZIP_MIN_BYTES = 1024
+
+
+############ MODS DIRECTORY INDEXER ############
+
+
+# keep the Mods table in sync with jars added to or removed from the mods directories
+INDEXER_ENABLED = environ.get('MCMM_INDEXER', '1') != '0'
+
+# how often to stat the mods directories when inotify is unavailable (seconds)
+INDEXER_SCAN_INTERVAL = 30.0
+
+# wait for a burst of file events to go quiet before indexing it (seconds)
+INDEXER_SETTLE = 1.0
+
+
 ############ SERVER CONFIG CHECK FUNCTION ############
 
 
 def check_config():
-    pass
\ No newline at end of file
+    if SENDFILE_BACKEND not in ('flask', 'sendfile', 'x-accel', 'x-sendfile'):
+        raise ValueError(f'Unknown SENDFILE_BACKEND \'{SENDFILE_BACKEND}\'')
\ No newline at end of file
@@ -1,2 +1,2 @@
 from .sql import FOREIGN_KEYS, INIT_TABLES
-from .schemas import ModsTable
\ No newline at end of file
+from .schemas import ModsTable
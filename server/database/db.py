@@ -1,29 +1,123 @@
+from json import dumps
+from os import getpid, makedirs
+from os.path import dirname
 from sqlite3 import connect, Connection, Row
-from server.config import DB_PATH
+from threading import local, Lock
+from urllib.request import pathname2url
+from server.config import DB_PATH, DB_BUSY_TIMEOUT_MS
 from server.database import FOREIGN_KEYS, INIT_TABLES
-from server.database.sql import INSERT_MOD, SELECT_MODS_INFO
+from server.database.sql import JOURNAL_WAL, SYNCHRONOUS_NORMAL, QUERY_ONLY, BUSY_TIMEOUT
+from server.database.sql import MODS_ADDED_COLUMNS, TABLE_COLUMNS, ADD_COLUMN, INIT_INDEXES
+from server.database.sql import TABLE_EXISTS, INIT_SEARCH, REBUILD_SEARCH, SEARCH_MODS, SEARCH_JOIN, SEARCH_MATCH, SEARCH_RANK
+from server.database.sql import SEARCH_ROLE, SEARCH_TYPE, SEARCH_ORDERS, SELECT_DEPENDANCY_NAMES_FOR
+from server.database.sql import INSERT_DECLARED_DEPENDANCY, RESOLVE_DECLARED_DEPENDANCIES, SELECT_MODS_BY_MODID, SELECT_MC_RANGES, SELECT_MODS_BY_MC_RANGES
+from server.database.sql import SELECT_GENERATION, INSERT_DEPENDANCY, SELECT_DEPENDANCY_NAMES, SELECT_DEPENDANCY_EDGES, SELECT_MOD_NODES, SELECT_TARGET_MODS
+from server.database.sql import BEGIN_IMMEDIATE, DELETE_MODS_BY_FILENAMES
+from server.database.sql import SELECT_MOD_FILES, SELECT_MOD_IDS_BY_FILENAMES, UPDATE_MOD_FILE, DELETE_DECLARED_DEPENDANCIES
+from server.database.sql import INSERT_MOD, SELECT_MODS_INFO, SELECT_MOD_BY_FILENAME, SELECT_MOD_BY_FILEHASH
 from server.database.params import ModInsert
+from server.database.graph import DependencyGraph
+from server.database.schemas import ModsTable, ModsSearchTable, SortValues
+from server.metadata import JarMetadata, version_in_range
+from server.metrics import instrument_queries
 
 
+# connections are cached per thread (and per process, so forked workers reconnect)
+_pool = local()
 
+# bumped whenever this process commits a change, so caches can notice local writes at once
+_write_count = 0
+_write_count_lock = Lock()
+
+
+def local_write_count() -> int:
+    '''Number of committed write transactions made by this process'''
+    return _write_count
+
+
+def init_db():
+    '''Create the tables and enable WAL, once per app rather than per request'''
+    makedirs(dirname(DB_PATH), exist_ok=True)
+
+    conn = connect(DB_PATH)
+    try:
+        # WAL is stored in the database file, so it sticks for every later connection
+        conn.execute(JOURNAL_WAL)
+        conn.executescript(INIT_TABLES)
+        _add_missing_columns(conn)
+        conn.executescript(INIT_INDEXES)
+        _init_search(conn)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _add_missing_columns(conn: Connection):
+    '''Bring a Mods table created by an older release up to the current columns'''
+    existing = {row[1] for row in conn.execute(TABLE_COLUMNS.format(ModsTable.TABLE_NAME))}
+
+    for column, column_type in MODS_ADDED_COLUMNS.items():
+        if column not in existing:
+            conn.execute(ADD_COLUMN.format(ModsTable.TABLE_NAME, column, column_type))
+
+
+def _init_search(conn: Connection):
+    '''Create the full text index, filling it from existing rows the first time'''
+    existed = conn.execute(TABLE_EXISTS, (ModsSearchTable.TABLE_NAME,)).fetchone() is not None
+
+    conn.executescript(INIT_SEARCH)
+
+    if not existed:
+        conn.execute(REBUILD_SEARCH)
+
+
+def _open_connection(readonly: bool) -> Connection:
+    '''Open a tuned connection, read-only ones cannot take the write lock'''
+    if readonly:
+        conn = connect(f'file:{pathname2url(DB_PATH)}?mode=ro', uri=True)
+        conn.execute(QUERY_ONLY)
+    else:
+        conn = connect(DB_PATH)
+        conn.execute(SYNCHRONOUS_NORMAL)
+
+    conn.execute(BUSY_TIMEOUT.format(DB_BUSY_TIMEOUT_MS))
+    conn.execute(FOREIGN_KEYS)
+
+    return conn
+
+
+def _get_connection(readonly: bool) -> Connection:
+    '''Return this thread's pooled reader or writer connection'''
+    if getattr(_pool, 'pid', None) != getpid():
+        _pool.pid = getpid()
+        _pool.conns = {}
+
+    conn = _pool.conns.get(readonly)
+    if conn is None:
+        conn = _open_connection(readonly)
+        _pool.conns[readonly] = conn
+
+    return conn
+
+
+# every query method is timed for /metrics
+@instrument_queries
 class DBConnection:
-    def __init__(self):
-        # set connection to None so that context manager handles creating connection
+    def __init__(self, readonly: bool = False, immediate: bool = False):
+        # set connection to None so that context manager handles fetching a connection
         self.conn: Connection | None = None
+        self.readonly = readonly
+        self.immediate = immediate
 
 
     def __enter__(self):
-        # connect to database
-        self.conn = connect(DB_PATH)
-
-        # activate foreign keys constraint
-        self.conn.execute(FOREIGN_KEYS)
+        # reuse this thread's connection instead of opening a new one
+        self.conn = _get_connection(self.readonly)
+        self.changes = self.conn.total_changes
 
-        # initialize tables if they do not exist
-        self.conn.executescript(INIT_TABLES)
-
-        # commit changes
-        self.conn.commit()
+        # read-then-write transactions wait for other writers before reading
+        if self.immediate:
+            self.conn.execute(BEGIN_IMMEDIATE)
 
         # return DBConnection object
         return self
@@ -34,30 +128,100 @@ class DBConnection:
         if exc_type is None:
             # if no exceptions, commit 
             self.conn.commit()
+
+            # let manifest caches in this process know the data changed
+            if self.conn.total_changes != self.changes:
+                global _write_count
+                with _write_count_lock:
+                    _write_count += 1
         else:
             # if exception occurred, rollback changes
             self.conn.rollback()
-        # close connection and set to None
-        self.conn.close()
+        # hand the connection back to the pool
         self.conn = None
 
 
-    def add_mod(self, mod_insert: ModInsert):
+    def get_generation(self) -> int:
+        '''Manifest generation, bumped by triggers on every change to the mods'''
+        return self.conn.execute(SELECT_GENERATION).fetchone()[0]
+
+
+    def add_mod(self, mod_insert: ModInsert) -> int:
+
+        cursor = self.conn.cursor()
+
+        cursor.execute(INSERT_MOD, mod_insert.params())
+
+        mod_id = cursor.lastrowid
+
+        cursor.close()
+
+        return mod_id
+
+
+    def add_mods(self, mod_inserts: list[ModInsert]) -> dict[str, int]:
+        '''Insert many mods at once and return their ids keyed by filename'''
+
+        cursor = self.conn.cursor()
+
+        cursor.executemany(INSERT_MOD, (mod_insert.params() for mod_insert in mod_inserts))
+
+        cursor.execute(SELECT_MOD_IDS_BY_FILENAMES, (dumps([m.filename for m in mod_inserts]),))
+
+        mod_ids = dict(cursor.fetchall())
+
+        cursor.close()
+
+        return mod_ids
 
-        params = (
-            mod_insert.name,
-            mod_insert.description,
-            mod_insert.version,
-            mod_insert.filename,
-            mod_insert.filehash,
-            mod_insert.link,
-            mod_insert.type,
-            mod_insert.role
-        )
+
+    def update_mod_files(self, mod_inserts: list[ModInsert]):
+        '''Point existing rows at the new contents of their jars'''
+
+        params = [
+            (m.version, m.filehash, m.modid, m.loader, m.loader_range, m.mc_range, m.filename)
+            for m in mod_inserts
+        ]
+
+        cursor = self.conn.cursor()
+
+        cursor.executemany(UPDATE_MOD_FILE, params)
+
+        cursor.close()
+
+
+    def add_dependancies(self, mod_id: int, dep_ids: list[int]):
 
         cursor = self.conn.cursor()
 
-        cursor.execute(INSERT_MOD, params)
+        cursor.executemany(INSERT_DEPENDANCY, ((mod_id, dep_id) for dep_id in dep_ids))
+
+        cursor.close()
+
+
+    def add_declared_dependancies(self, mod_id: int, metadata: JarMetadata):
+        '''Record what the jar says it needs, then link it to any mods that provide it'''
+        self.set_declared_dependancies([(mod_id, metadata)], replace=False)
+
+
+    def set_declared_dependancies(self, mods: list[tuple[int, JarMetadata]], replace: bool = True):
+        '''Record the declared dependencies of many jars, dropping older declarations if replace'''
+
+        params = [
+            (mod_id, dep.modid, dep.version_range, int(dep.mandatory))
+            for mod_id, metadata in mods
+            for dep in metadata.dependancies
+        ]
+
+        cursor = self.conn.cursor()
+
+        if replace:
+            cursor.executemany(DELETE_DECLARED_DEPENDANCIES, ((mod_id,) for mod_id, _ in mods))
+
+        cursor.executemany(INSERT_DECLARED_DEPENDANCY, params)
+
+        # also links earlier mods that were waiting on these mods' modids
+        cursor.execute(RESOLVE_DECLARED_DEPENDANCIES)
 
         cursor.close()
 
@@ -71,10 +235,212 @@ class DBConnection:
 
         mods = [dict(row) for row in cursor.fetchall()]
 
+        # all dependency names in one query rather than one per mod
+        cursor.execute(SELECT_DEPENDANCY_NAMES)
+
+        deps = {mod['id']: [] for mod in mods}
+        for mod_id, dep_name in cursor.fetchall():
+            deps[mod_id].append(dep_name)
+
+        cursor.close()
+
         for mod in mods:
-            mod['dependancies'] = []
+            mod['dependancies'] = deps[mod['id']]
 
         info_list = {'mod-list': mods}
 
         return info_list
-        
\ No newline at end of file
+
+
+    def search_mods(self, role: str | None = None, mod_type: str | None = None, query: str | None = None,
+                    sort: str = SortValues.NAME, after: list | None = None, limit: int = 50) -> tuple[list[dict], list | None]:
+        '''One page of mods matching the filters, and the cursor values for the page after it'''
+
+        joins, where, params = [], [], []
+
+        if query:
+            joins.append(SEARCH_JOIN)
+            where.append(SEARCH_MATCH)
+            params.append(query)
+
+        if role:
+            where.append(SEARCH_ROLE)
+            params.append(role)
+
+        if mod_type:
+            where.append(SEARCH_TYPE)
+            params.append(mod_type)
+
+        order, resume = SEARCH_ORDERS[sort]
+        if after is not None:
+            where.append(resume)
+            params.extend(after)
+
+        sql = SEARCH_MODS.format(
+            rank=SEARCH_RANK if query else '0',
+            join=' '.join(joins),
+            where=' AND '.join(where) or '1',
+            order=order
+        )
+
+        self.conn.row_factory = Row
+        cursor = self.conn.cursor()
+
+        # one extra row tells us whether another page exists
+        cursor.execute(sql, (*params, limit + 1))
+
+        mods = [dict(row) for row in cursor.fetchall()]
+
+        more = len(mods) > limit
+        mods = mods[:limit]
+        ranks = [mod.pop('rank') for mod in mods]
+
+        cursor.execute(SELECT_DEPENDANCY_NAMES_FOR, (dumps([mod['id'] for mod in mods]),))
+
+        deps = {mod['id']: [] for mod in mods}
+        for mod_id, dep_name in cursor.fetchall():
+            deps[mod_id].append(dep_name)
+
+        cursor.close()
+
+        for mod in mods:
+            mod['dependancies'] = deps[mod['id']]
+
+        if not more:
+            return mods, None
+
+        last = mods[-1]
+        next_after = {
+            SortValues.NAME: [last[ModsTable.NAME], last[ModsTable.ID]],
+            SortValues.NEWEST: [last[ModsTable.ID]],
+            SortValues.RELEVANCE: [ranks[-1], last[ModsTable.ID]],
+        }[sort]
+
+        return mods, next_after
+
+
+    def get_mod_by_filename(self, filename: str) -> dict | None:
+
+        self.conn.row_factory = Row
+        cursor = self.conn.cursor()
+
+        cursor.execute(SELECT_MOD_BY_FILENAME, (filename,))
+
+        row = cursor.fetchone()
+
+        cursor.close()
+
+        return None if row is None else dict(row)
+
+
+    def get_mod_files(self) -> list[dict]:
+        '''Every mod's id, name, file and role, for reconciling against the mods directories'''
+
+        self.conn.row_factory = Row
+        cursor = self.conn.cursor()
+
+        cursor.execute(SELECT_MOD_FILES)
+
+        rows = [dict(row) for row in cursor.fetchall()]
+
+        cursor.close()
+
+        return rows
+
+
+    def delete_mods(self, filenames: list[str]) -> int:
+        '''Drop the rows of jars that were removed, their dependency edges cascade'''
+
+        cursor = self.conn.cursor()
+
+        cursor.execute(DELETE_MODS_BY_FILENAMES, (dumps(filenames),))
+
+        deleted = cursor.rowcount
+
+        cursor.close()
+
+        return deleted
+
+
+    def get_mod_by_filehash(self, filehash: str) -> dict | None:
+
+        self.conn.row_factory = Row
+        cursor = self.conn.cursor()
+
+        cursor.execute(SELECT_MOD_BY_FILEHASH, (filehash,))
+
+        row = cursor.fetchone()
+
+        cursor.close()
+
+        return None if row is None else dict(row)
+
+
+    def get_dependency_graph(self) -> DependencyGraph:
+
+        self.conn.row_factory = Row
+        cursor = self.conn.cursor()
+
+        cursor.execute(SELECT_MOD_NODES)
+        nodes = [dict(row) for row in cursor.fetchall()]
+
+        cursor.execute(SELECT_DEPENDANCY_EDGES)
+        edges = [tuple(row) for row in cursor.fetchall()]
+
+        cursor.close()
+
+        return DependencyGraph(nodes, edges)
+
+
+    def get_target_mods(self, roles: tuple[str, str], loader: str | None = None, mc_version: str | None = None) -> list[dict]:
+        '''The jars an install running roles needs, optionally only those for a loader and Minecraft version'''
+
+        self.conn.row_factory = Row
+        cursor = self.conn.cursor()
+
+        mc_ranges = None
+        if mc_version is not None:
+            cursor.execute(SELECT_MC_RANGES)
+            mc_ranges = dumps([row[0] for row in cursor.fetchall() if version_in_range(mc_version, row[0])])
+
+        role, both = roles
+        cursor.execute(SELECT_TARGET_MODS, {'role': role, 'both': both, 'loader': loader, 'mc_ranges': mc_ranges})
+
+        mods = [dict(row) for row in cursor.fetchall()]
+
+        cursor.close()
+
+        return mods
+
+
+    def get_mods_by_modid(self, modid: str) -> list[dict]:
+
+        self.conn.row_factory = Row
+        cursor = self.conn.cursor()
+
+        cursor.execute(SELECT_MODS_BY_MODID, (modid,))
+
+        mods = [dict(row) for row in cursor.fetchall()]
+
+        cursor.close()
+
+        return mods
+
+
+    def get_mods_for_mc(self, mc_version: str) -> list[dict]:
+        '''Mods whose declared Minecraft range includes mc_version (or that declare none)'''
+
+        self.conn.row_factory = Row
+        cursor = self.conn.cursor()
+
+        # only the few distinct ranges are evaluated in python, the rows come from the index
+        cursor.execute(SELECT_MC_RANGES)
+        ranges = [row[0] for row in cursor.fetchall() if version_in_range(mc_version, row[0])]
+
+        cursor.execute(SELECT_MODS_BY_MC_RANGES, (dumps(ranges),))
+
+        mods = [dict(row) for row in cursor.fetchall()]
+
+        cursor.close()
+
+        return mods
@@ -0,0 +1,82 @@
+from collections import deque
+
+
+class DependencyGraph:
+    '''In-memory mod dependency graph, built once per manifest generation
+
+    Transitive lookups are computed on first use and memoized, so repeated
+    questions about the same mod are dictionary hits.
+    '''
+
+    def __init__(self, nodes: list[dict], edges: list[tuple[int, int]]):
+        # nodes are {'id', 'name', 'filename'} rows, edges are (mod_id, dep_id)
+        self.nodes = {node['id']: node for node in nodes}
+        self.deps: dict[int, set[int]] = {mod_id: set() for mod_id in self.nodes}
+        self.rdeps: dict[int, set[int]] = {mod_id: set() for mod_id in self.nodes}
+
+        for mod_id, dep_id in edges:
+            self.deps[mod_id].add(dep_id)
+            self.rdeps[dep_id].add(mod_id)
+
+        self._requires: dict[int, frozenset[int]] = {}
+        self._required_by: dict[int, frozenset[int]] = {}
+        self.order, self.cycles = self._topological_order()
+
+
+    def __contains__(self, mod_id: int) -> bool:
+        return mod_id in self.nodes
+
+
+    @staticmethod
+    def _closure(start: int, adjacency: dict[int, set[int]]) -> frozenset[int]:
+        seen = set()
+        queue = deque(adjacency[start])
+        while queue:
+            mod_id = queue.popleft()
+            if mod_id not in seen:
+                seen.add(mod_id)
+                queue.extend(adjacency[mod_id])
+        seen.discard(start)
+        return frozenset(seen)
+
+
+    def requires(self, mod_id: int) -> frozenset[int]:
+        '''Every mod that mod_id needs, directly or transitively'''
+        if mod_id not in self._requires:
+            self._requires[mod_id] = self._closure(mod_id, self.deps)
+        return self._requires[mod_id]
+
+
+    def required_by(self, mod_id: int) -> frozenset[int]:
+        '''Every mod that breaks if mod_id is removed'''
+        if mod_id not in self._required_by:
+            self._required_by[mod_id] = self._closure(mod_id, self.rdeps)
+        return self._required_by[mod_id]
+
+
+    def _topological_order(self) -> tuple[list[int], list[int]]:
+        '''Kahn's algorithm, dependencies first; mods stuck in a cycle are returned separately'''
+        remaining = {mod_id: len(deps) for mod_id, deps in self.deps.items()}
+        ready = deque(sorted(mod_id for mod_id, n in remaining.items() if n == 0))
+        order = []
+
+        while ready:
+            mod_id = ready.popleft()
+            order.append(mod_id)
+            for dependent in sorted(self.rdeps[mod_id]):
+                remaining[dependent] -= 1
+                if remaining[dependent] == 0:
+                    ready.append(dependent)
+
+        placed = set(order)
+        cycles = [mod_id for mod_id in self.nodes if mod_id not in placed]
+
+        return order, cycles
+
+
+    def install_order(self, mod_ids: set[int] | None = None) -> list[int]:
+        '''Topological order restricted to mod_ids (default every mod), cycles last'''
+        order = self.order + self.cycles
+        if mod_ids is None:
+            return order
+        return [mod_id for mod_id in order if mod_id in mod_ids]
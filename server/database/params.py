@@ -1,5 +1,6 @@
 from dataclasses import dataclass
 from .schemas import ModsTable
+from server.metadata import JarMetadata
 
 
 @dataclass
@@ -12,8 +13,12 @@ class ModInsert:
     link: str
     type: str
     role: str
+    modid: str | None
+    loader: str | None
+    loader_range: str | None
+    mc_range: str | None
 
-    def __init__(self, str_values: dict[str, str], filename: str, filehash:str):
+    def __init__(self, str_values: dict[str, str], filename: str, filehash:str, metadata: JarMetadata | None = None):
         self.name = str_values[ModsTable.NAME]
         self.description = str_values[ModsTable.DESCRIPTION]
         self.version = str_values[ModsTable.VERSION]
@@ -23,7 +28,26 @@ class ModInsert:
         self.type = str_values[ModsTable.TYPE]
         self.role = str_values[ModsTable.ROLE]
 
-
-
-
-
+        # indexed facts read from the jar itself
+        metadata = metadata or JarMetadata()
+        self.modid = metadata.modid
+        self.loader = metadata.loader
+        self.loader_range = metadata.loader_range
+        self.mc_range = metadata.mc_range
+
+    def params(self) -> tuple:
+        '''Values in INSERT_MOD column order'''
+        return (
+            self.name,
+            self.description,
+            self.version,
+            self.filename,
+            self.filehash,
+            self.link,
+            self.type,
+            self.role,
+            self.modid,
+            self.loader,
+            self.loader_range,
+            self.mc_range
+        )
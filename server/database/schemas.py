@@ -16,6 +16,22 @@ class ModsTable(StrEnum):
     LINK = 'link'
     TYPE = 'type'
     ROLE = 'role'
+    MODID = 'modid'
+    LOADER = 'loader'
+    LOADER_RANGE = 'loader_range'
+    MC_RANGE = 'mc_range'
+
+
+class ModsSearchTable(StrEnum):
+    '''\'ModsSearch\' FTS5 index over the name and description of \'Mods\' rows'''
+    TABLE_NAME = 'ModsSearch'
+
+
+class SortValues(StrEnum):
+    '''Orderings accepted by the mod search API'''
+    NAME = 'name'
+    NEWEST = 'newest'
+    RELEVANCE = 'relevance'
 
 
 class TypeValues(StrEnum):
@@ -41,3 +57,30 @@ class DepsTable(StrEnum):
     MOD_ID = 'mod_id'
     DEP_ID = 'dep_id'
 
+
+############ Declared Dependancies Table ############
+
+
+class DeclaredDepsTable(StrEnum):
+    '''\'DeclaredDependancies\' Table Information, dependencies as the jar names them'''
+    TABLE_NAME = 'DeclaredDependancies'
+    ID = 'id'
+    MOD_ID = 'mod_id'
+    DEP_MODID = 'dep_modid'
+    VERSION_RANGE = 'version_range'
+    MANDATORY = 'mandatory'
+
+
+############ Meta Table ############
+
+
+class MetaTable(StrEnum):
+    '''\'Meta\' Table Information'''
+    TABLE_NAME = 'Meta'
+    KEY = 'key'
+    VALUE = 'value'
+
+
+class MetaKeys(StrEnum):
+    '''Keys stored in the \'Meta\' table'''
+    GENERATION = 'generation'
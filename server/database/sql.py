@@ -1,8 +1,28 @@
-from .schemas import ModsTable
+from .schemas import ModsTable, DepsTable, DeclaredDepsTable, MetaTable, MetaKeys, ModsSearchTable
 
 # enforce foreign keys
 FOREIGN_KEYS = 'PRAGMA foreign_keys = ON;'
 
+# let readers run alongside the single writer
+JOURNAL_WAL = 'PRAGMA journal_mode = WAL;'
+
+# fsync only at checkpoints, which is durable enough under WAL
+SYNCHRONOUS_NORMAL = 'PRAGMA synchronous = NORMAL;'
+
+# refuse writes on connections handed out for reads
+QUERY_ONLY = 'PRAGMA query_only = ON;'
+
+# wait this many milliseconds on a locked database before failing
+BUSY_TIMEOUT = 'PRAGMA busy_timeout = {};'
+
+# take the write lock up front, so rows read in the transaction can't change under it
+BEGIN_IMMEDIATE = 'BEGIN IMMEDIATE;'
+
+# any change to the mods bumps the manifest generation (used inside triggers)
+BUMP_GENERATION = f'''UPDATE {MetaTable.TABLE_NAME}
+    SET {MetaTable.VALUE} = {MetaTable.VALUE} + 1
+    WHERE {MetaTable.KEY} = '{MetaKeys.GENERATION}';'''
+
 # sql script to create tables if they do not exist
 INIT_TABLES = f'''
 CREATE TABLE IF NOT EXISTS {ModsTable.TABLE_NAME} (
@@ -14,13 +34,151 @@ CREATE TABLE IF NOT EXISTS {ModsTable.TABLE_NAME} (
     {ModsTable.FILEHASH} TEXT NOT NULL UNIQUE,
     {ModsTable.LINK} TEXT NOT NULL,
     {ModsTable.TYPE} TEXT NOT NULL CHECK (type IN ('Feature', 'Library')),
-    {ModsTable.ROLE} TEXT NOT NULL CHECK (role IN ('Server', 'Client', 'Client/Server'))
+    {ModsTable.ROLE} TEXT NOT NULL CHECK (role IN ('Server', 'Client', 'Client/Server')),
+    {ModsTable.MODID} TEXT,
+    {ModsTable.LOADER} TEXT,
+    {ModsTable.LOADER_RANGE} TEXT,
+    {ModsTable.MC_RANGE} TEXT
 ) STRICT; 
+
+CREATE TABLE IF NOT EXISTS {DepsTable.TABLE_NAME} (
+    {DepsTable.ID} INTEGER PRIMARY KEY,
+    {DepsTable.MOD_ID} INTEGER NOT NULL REFERENCES {ModsTable.TABLE_NAME}({ModsTable.ID}) ON DELETE CASCADE,
+    {DepsTable.DEP_ID} INTEGER NOT NULL REFERENCES {ModsTable.TABLE_NAME}({ModsTable.ID}) ON DELETE CASCADE,
+    UNIQUE ({DepsTable.MOD_ID}, {DepsTable.DEP_ID}),
+    CHECK ({DepsTable.MOD_ID} != {DepsTable.DEP_ID})
+) STRICT;
+
+-- the UNIQUE constraint already indexes mod_id, reverse lookups need dep_id
+CREATE INDEX IF NOT EXISTS {DepsTable.TABLE_NAME}_{DepsTable.DEP_ID}
+ON {DepsTable.TABLE_NAME} ({DepsTable.DEP_ID});
+
+CREATE TABLE IF NOT EXISTS {DeclaredDepsTable.TABLE_NAME} (
+    {DeclaredDepsTable.ID} INTEGER PRIMARY KEY,
+    {DeclaredDepsTable.MOD_ID} INTEGER NOT NULL REFERENCES {ModsTable.TABLE_NAME}({ModsTable.ID}) ON DELETE CASCADE,
+    {DeclaredDepsTable.DEP_MODID} TEXT NOT NULL,
+    {DeclaredDepsTable.VERSION_RANGE} TEXT,
+    {DeclaredDepsTable.MANDATORY} INTEGER NOT NULL,
+    UNIQUE ({DeclaredDepsTable.MOD_ID}, {DeclaredDepsTable.DEP_MODID})
+) STRICT;
+
+CREATE INDEX IF NOT EXISTS {DeclaredDepsTable.TABLE_NAME}_{DeclaredDepsTable.DEP_MODID}
+ON {DeclaredDepsTable.TABLE_NAME} ({DeclaredDepsTable.DEP_MODID});
+
+CREATE TABLE IF NOT EXISTS {MetaTable.TABLE_NAME} (
+    {MetaTable.KEY} TEXT PRIMARY KEY,
+    {MetaTable.VALUE} INTEGER NOT NULL
+) STRICT;
+
+INSERT OR IGNORE INTO {MetaTable.TABLE_NAME} ({MetaTable.KEY}, {MetaTable.VALUE})
+VALUES ('{MetaKeys.GENERATION}', 0);
+
+CREATE TRIGGER IF NOT EXISTS {ModsTable.TABLE_NAME}_insert_generation
+AFTER INSERT ON {ModsTable.TABLE_NAME}
+BEGIN
+    {BUMP_GENERATION}
+END;
+
+CREATE TRIGGER IF NOT EXISTS {ModsTable.TABLE_NAME}_update_generation
+AFTER UPDATE ON {ModsTable.TABLE_NAME}
+BEGIN
+    {BUMP_GENERATION}
+END;
+
+CREATE TRIGGER IF NOT EXISTS {ModsTable.TABLE_NAME}_delete_generation
+AFTER DELETE ON {ModsTable.TABLE_NAME}
+BEGIN
+    {BUMP_GENERATION}
+END;
+
+CREATE TRIGGER IF NOT EXISTS {DepsTable.TABLE_NAME}_insert_generation
+AFTER INSERT ON {DepsTable.TABLE_NAME}
+BEGIN
+    {BUMP_GENERATION}
+END;
+
+CREATE TRIGGER IF NOT EXISTS {DepsTable.TABLE_NAME}_delete_generation
+AFTER DELETE ON {DepsTable.TABLE_NAME}
+BEGIN
+    {BUMP_GENERATION}
+END;
 '''
 
 
 
 
+# columns added to the Mods table after its first release, with their types
+MODS_ADDED_COLUMNS = {
+    ModsTable.MODID: 'TEXT',
+    ModsTable.LOADER: 'TEXT',
+    ModsTable.LOADER_RANGE: 'TEXT',
+    ModsTable.MC_RANGE: 'TEXT',
+}
+
+TABLE_COLUMNS = 'PRAGMA table_info({});'
+
+ADD_COLUMN = 'ALTER TABLE {} ADD COLUMN {} {};'
+
+# indexes on columns that older databases only get after ADD_COLUMN
+INIT_INDEXES = f'''
+CREATE INDEX IF NOT EXISTS {ModsTable.TABLE_NAME}_{ModsTable.MODID}
+ON {ModsTable.TABLE_NAME} ({ModsTable.MODID});
+
+CREATE INDEX IF NOT EXISTS {ModsTable.TABLE_NAME}_{ModsTable.MC_RANGE}
+ON {ModsTable.TABLE_NAME} ({ModsTable.MC_RANGE});
+
+-- filtered listings are ordered by name, so the filter and the order share one index
+CREATE INDEX IF NOT EXISTS {ModsTable.TABLE_NAME}_{ModsTable.ROLE}
+ON {ModsTable.TABLE_NAME} ({ModsTable.ROLE}, {ModsTable.NAME});
+
+CREATE INDEX IF NOT EXISTS {ModsTable.TABLE_NAME}_{ModsTable.TYPE}
+ON {ModsTable.TABLE_NAME} ({ModsTable.TYPE}, {ModsTable.NAME});
+'''
+
+
+TABLE_EXISTS = 'SELECT 1 FROM sqlite_master WHERE name = ?;'
+
+
+# full text index over Mods, storing no text of its own and kept in step by triggers
+INIT_SEARCH = f'''
+CREATE VIRTUAL TABLE IF NOT EXISTS {ModsSearchTable.TABLE_NAME} USING fts5(
+    {ModsTable.NAME},
+    {ModsTable.DESCRIPTION},
+    content='{ModsTable.TABLE_NAME}',
+    content_rowid='{ModsTable.ID}',
+    tokenize='unicode61 remove_diacritics 2'
+);
+
+CREATE TRIGGER IF NOT EXISTS {ModsTable.TABLE_NAME}_insert_search
+AFTER INSERT ON {ModsTable.TABLE_NAME}
+BEGIN
+    INSERT INTO {ModsSearchTable.TABLE_NAME} (rowid, {ModsTable.NAME}, {ModsTable.DESCRIPTION})
+    VALUES (new.{ModsTable.ID}, new.{ModsTable.NAME}, new.{ModsTable.DESCRIPTION});
+END;
+
+CREATE TRIGGER IF NOT EXISTS {ModsTable.TABLE_NAME}_delete_search
+AFTER DELETE ON {ModsTable.TABLE_NAME}
+BEGIN
+    INSERT INTO {ModsSearchTable.TABLE_NAME} ({ModsSearchTable.TABLE_NAME}, rowid, {ModsTable.NAME}, {ModsTable.DESCRIPTION})
+    VALUES ('delete', old.{ModsTable.ID}, old.{ModsTable.NAME}, old.{ModsTable.DESCRIPTION});
+END;
+
+CREATE TRIGGER IF NOT EXISTS {ModsTable.TABLE_NAME}_update_search
+AFTER UPDATE OF {ModsTable.NAME}, {ModsTable.DESCRIPTION} ON {ModsTable.TABLE_NAME}
+BEGIN
+    INSERT INTO {ModsSearchTable.TABLE_NAME} ({ModsSearchTable.TABLE_NAME}, rowid, {ModsTable.NAME}, {ModsTable.DESCRIPTION})
+    VALUES ('delete', old.{ModsTable.ID}, old.{ModsTable.NAME}, old.{ModsTable.DESCRIPTION});
+    INSERT INTO {ModsSearchTable.TABLE_NAME} (rowid, {ModsTable.NAME}, {ModsTable.DESCRIPTION})
+    VALUES (new.{ModsTable.ID}, new.{ModsTable.NAME}, new.{ModsTable.DESCRIPTION});
+END;
+'''
+
+# fills the index from rows that existed before it did
+REBUILD_SEARCH = f'''
+INSERT INTO {ModsSearchTable.TABLE_NAME} ({ModsSearchTable.TABLE_NAME}) VALUES ('rebuild');
+'''
+
+
 INSERT_MOD = f'''
 INSERT INTO {ModsTable.TABLE_NAME}
 ({ModsTable.NAME}, 
@@ -30,8 +188,34 @@ INSERT INTO {ModsTable.TABLE_NAME}
 {ModsTable.FILEHASH}, 
 {ModsTable.LINK}, 
 {ModsTable.TYPE}, 
-{ModsTable.ROLE})
-VALUES (?, ?, ?, ?, ?, ?, ?, ?);
+{ModsTable.ROLE},
+{ModsTable.MODID},
+{ModsTable.LOADER},
+{ModsTable.LOADER_RANGE},
+{ModsTable.MC_RANGE})
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);
+'''
+
+
+INSERT_DECLARED_DEPENDANCY = f'''
+INSERT OR IGNORE INTO {DeclaredDepsTable.TABLE_NAME}
+({DeclaredDepsTable.MOD_ID},
+{DeclaredDepsTable.DEP_MODID},
+{DeclaredDepsTable.VERSION_RANGE},
+{DeclaredDepsTable.MANDATORY})
+VALUES (?, ?, ?, ?);
+'''
+
+
+# turn every required dependency a jar declared into an edge once a jar provides it
+RESOLVE_DECLARED_DEPENDANCIES = f'''
+INSERT OR IGNORE INTO {DepsTable.TABLE_NAME}
+({DepsTable.MOD_ID},
+{DepsTable.DEP_ID})
+SELECT d.{DeclaredDepsTable.MOD_ID}, m.{ModsTable.ID}
+FROM {DeclaredDepsTable.TABLE_NAME} AS d
+JOIN {ModsTable.TABLE_NAME} AS m ON m.{ModsTable.MODID} = d.{DeclaredDepsTable.DEP_MODID}
+WHERE d.{DeclaredDepsTable.MANDATORY} = 1 AND d.{DeclaredDepsTable.MOD_ID} != m.{ModsTable.ID};
 '''
 
 
@@ -45,4 +229,213 @@ SELECT
 {ModsTable.TYPE}, 
 {ModsTable.ROLE}
 FROM {ModsTable.TABLE_NAME};
-'''
\ No newline at end of file
+'''
+
+SELECT_MOD_BY_FILENAME = f'''
+SELECT
+{ModsTable.FILENAME},
+{ModsTable.FILEHASH},
+{ModsTable.ROLE}
+FROM {ModsTable.TABLE_NAME}
+WHERE {ModsTable.FILENAME} = ?;
+'''
+
+
+SELECT_MOD_BY_FILEHASH = f'''
+SELECT
+{ModsTable.FILENAME},
+{ModsTable.FILEHASH},
+{ModsTable.ROLE}
+FROM {ModsTable.TABLE_NAME}
+WHERE {ModsTable.FILEHASH} = ?;
+'''
+
+
+SELECT_MOD_FILES = f'''
+SELECT
+{ModsTable.ID},
+{ModsTable.NAME},
+{ModsTable.FILENAME},
+{ModsTable.FILEHASH},
+{ModsTable.ROLE}
+FROM {ModsTable.TABLE_NAME};
+'''
+
+
+DELETE_MODS_BY_FILENAMES = f'''
+DELETE FROM {ModsTable.TABLE_NAME}
+WHERE {ModsTable.FILENAME} IN (SELECT value FROM json_each(?));
+'''
+
+
+SELECT_MOD_IDS_BY_FILENAMES = f'''
+SELECT {ModsTable.FILENAME}, {ModsTable.ID}
+FROM {ModsTable.TABLE_NAME}
+WHERE {ModsTable.FILENAME} IN (SELECT value FROM json_each(?));
+'''
+
+
+# a jar replaced on disk keeps its row, only what was read from the file changes
+UPDATE_MOD_FILE = f'''
+UPDATE {ModsTable.TABLE_NAME} SET
+{ModsTable.VERSION} = ?,
+{ModsTable.FILEHASH} = ?,
+{ModsTable.MODID} = ?,
+{ModsTable.LOADER} = ?,
+{ModsTable.LOADER_RANGE} = ?,
+{ModsTable.MC_RANGE} = ?
+WHERE {ModsTable.FILENAME} = ?;
+'''
+
+
+DELETE_DECLARED_DEPENDANCIES = f'''
+DELETE FROM {DeclaredDepsTable.TABLE_NAME}
+WHERE {DeclaredDepsTable.MOD_ID} = ?;
+'''
+
+
+SELECT_GENERATION = f'''
+SELECT {MetaTable.VALUE}
+FROM {MetaTable.TABLE_NAME}
+WHERE {MetaTable.KEY} = '{MetaKeys.GENERATION}';
+'''
+
+
+INSERT_DEPENDANCY = f'''
+INSERT OR IGNORE INTO {DepsTable.TABLE_NAME}
+({DepsTable.MOD_ID},
+{DepsTable.DEP_ID})
+VALUES (?, ?);
+'''
+
+
+# every edge with the dependency's name, loaded in one pass for the whole manifest
+SELECT_DEPENDANCY_NAMES = f'''
+SELECT
+d.{DepsTable.MOD_ID},
+m.{ModsTable.NAME}
+FROM {DepsTable.TABLE_NAME} AS d
+JOIN {ModsTable.TABLE_NAME} AS m ON m.{ModsTable.ID} = d.{DepsTable.DEP_ID}
+ORDER BY m.{ModsTable.NAME};
+'''
+
+
+SELECT_DEPENDANCY_NAMES_FOR = f'''
+SELECT
+d.{DepsTable.MOD_ID},
+m.{ModsTable.NAME}
+FROM {DepsTable.TABLE_NAME} AS d
+JOIN {ModsTable.TABLE_NAME} AS m ON m.{ModsTable.ID} = d.{DepsTable.DEP_ID}
+WHERE d.{DepsTable.MOD_ID} IN (SELECT value FROM json_each(?))
+ORDER BY m.{ModsTable.NAME};
+'''
+
+
+# one page of the mod list, filled in by DBConnection.search_mods
+SEARCH_MODS = f'''
+SELECT
+m.{ModsTable.ID},
+m.{ModsTable.NAME},
+m.{ModsTable.DESCRIPTION},
+m.{ModsTable.VERSION},
+m.{ModsTable.LINK},
+m.{ModsTable.TYPE},
+m.{ModsTable.ROLE},
+{{rank}} AS rank
+FROM {ModsTable.TABLE_NAME} AS m
+{{join}}
+WHERE {{where}}
+ORDER BY {{order}}
+LIMIT ?;
+'''
+
+SEARCH_JOIN = f'JOIN {ModsSearchTable.TABLE_NAME} ON {ModsSearchTable.TABLE_NAME}.rowid = m.{ModsTable.ID}'
+
+SEARCH_MATCH = f'{ModsSearchTable.TABLE_NAME} MATCH ?'
+
+SEARCH_RANK = f'bm25({ModsSearchTable.TABLE_NAME})'
+
+SEARCH_ROLE = f'm.{ModsTable.ROLE} = ?'
+
+SEARCH_TYPE = f'm.{ModsTable.TYPE} = ?'
+
+# keyset pagination: (order, condition that resumes after the cursor's values)
+SEARCH_ORDERS = {
+    'name': (f'm.{ModsTable.NAME}, m.{ModsTable.ID}', f'(m.{ModsTable.NAME}, m.{ModsTable.ID}) > (?, ?)'),
+    'newest': (f'm.{ModsTable.ID} DESC', f'm.{ModsTable.ID} < ?'),
+    'relevance': (f'rank, m.{ModsTable.ID}', f'(rank, m.{ModsTable.ID}) > (?, ?)'),
+}
+
+
+SELECT_DEPENDANCY_EDGES = f'''
+SELECT
+{DepsTable.MOD_ID},
+{DepsTable.DEP_ID}
+FROM {DepsTable.TABLE_NAME};
+'''
+
+
+SELECT_MOD_NODES = f'''
+SELECT
+{ModsTable.ID},
+{ModsTable.NAME},
+{ModsTable.FILENAME}
+FROM {ModsTable.TABLE_NAME}
+ORDER BY {ModsTable.ID};
+'''
+
+
+# the jars one kind of install runs, found through the role index; a NULL
+# :loader or :mc_ranges (a json array of ranges) leaves that filter off, and
+# mods that declare no loader or range are always kept
+SELECT_TARGET_MODS = f'''
+SELECT
+{ModsTable.FILENAME},
+{ModsTable.FILEHASH},
+{ModsTable.NAME},
+{ModsTable.VERSION},
+{ModsTable.ROLE}
+FROM {ModsTable.TABLE_NAME}
+WHERE {ModsTable.ROLE} IN (:role, :both)
+AND (:loader IS NULL OR {ModsTable.LOADER} IS NULL OR {ModsTable.LOADER} = :loader)
+AND (:mc_ranges IS NULL OR {ModsTable.MC_RANGE} IS NULL OR {ModsTable.MC_RANGE} IN (SELECT value FROM json_each(:mc_ranges)))
+ORDER BY {ModsTable.FILENAME};
+'''
+
+
+SELECT_MODS_BY_MODID = f'''
+SELECT
+{ModsTable.ID},
+{ModsTable.NAME},
+{ModsTable.VERSION},
+{ModsTable.FILENAME},
+{ModsTable.FILEHASH},
+{ModsTable.LOADER},
+{ModsTable.MC_RANGE}
+FROM {ModsTable.TABLE_NAME}
+WHERE {ModsTable.MODID} = ?;
+'''
+
+
+SELECT_MC_RANGES = f'''
+SELECT DISTINCT {ModsTable.MC_RANGE}
+FROM {ModsTable.TABLE_NAME}
+WHERE {ModsTable.MC_RANGE} IS NOT NULL;
+'''
+
+
+# mods whose range is in a json array of ranges, or that declare none at all
+SELECT_MODS_BY_MC_RANGES = f'''
+SELECT
+{ModsTable.ID},
+{ModsTable.NAME},
+{ModsTable.VERSION},
+{ModsTable.FILENAME},
+{ModsTable.FILEHASH},
+{ModsTable.LOADER},
+{ModsTable.MC_RANGE}
+FROM {ModsTable.TABLE_NAME}
+WHERE {ModsTable.MC_RANGE} IS NULL
+OR {ModsTable.MC_RANGE} IN (SELECT value FROM json_each(?))
+ORDER BY {ModsTable.NAME};
+'''
@@ -0,0 +1,296 @@
+from concurrent.futures import ThreadPoolExecutor
+from ctypes import CDLL, get_errno
+from dataclasses import fields
+from ctypes.util import find_library
+from fcntl import LOCK_EX, LOCK_NB, flock
+from json import dump, load
+from os import O_CLOEXEC, O_NONBLOCK, close, read, replace, stat
+from os.path import dirname, join
+from select import select
+from sqlite3 import OperationalError
+from struct import calcsize, unpack_from
+from threading import Event, Thread
+from time import monotonic
+import logging
+from server.config import DB_PATH, SERVER_MODS_DIR, CLIENT_MODS_DIR, INDEXER_SCAN_INTERVAL, INDEXER_SETTLE
+from server.database.db import DBConnection
+from server.database.schemas import ModsTable
+from server.reconcile import ReconcileReport, ScannedJar, apply_changes, list_jars, mods_dir_for, plan_changes, scan_jar
+
+
+log = logging.getLogger(__name__)
+
+# last seen (size, mtime_ns) of every jar, so restarts don't rehash unchanged files
+STATE_PATH = join(dirname(DB_PATH), 'mods-index.json')
+
+# held by whichever process runs the indexer, the other workers stand by
+LOCK_PATH = join(dirname(DB_PATH), 'mods-indexer.lock')
+
+INDEX_WORKERS = 4
+
+# inotify(7) event bits
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ONLYDIR = 0x01000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+RESCAN_MASK = IN_Q_OVERFLOW | IN_IGNORED | IN_DELETE_SELF | IN_MOVE_SELF
+
+EVENT_HEADER = 'iIII'
+EVENT_HEADER_SIZE = calcsize(EVENT_HEADER)
+
+
+class Inotify:
+    '''Minimal ctypes binding for watching a few directories'''
+
+    def __init__(self, directories: list[str]):
+        libc = CDLL(find_library('c') or 'libc.so.6', use_errno=True)
+
+        self.fd = libc.inotify_init1(O_NONBLOCK | O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(get_errno(), 'inotify_init1 failed')
+
+        self.dirs = {}
+        for directory in directories:
+            wd = libc.inotify_add_watch(self.fd, directory.encode(), WATCH_MASK)
+            if wd < 0:
+                close(self.fd)
+                raise OSError(get_errno(), f'inotify_add_watch failed for {directory}')
+            self.dirs[wd] = directory
+
+    def wait(self, timeout: float | None) -> tuple[set[tuple[str, str]], bool]:
+        '''Return the (directory, filename) pairs touched, and whether a full rescan is needed'''
+        touched = set()
+        rescan = False
+
+        if not select([self.fd], [], [], timeout)[0]:
+            return touched, rescan
+
+        try:
+            buf = read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return touched, rescan
+
+        offset = 0
+        while offset < len(buf):
+            wd, mask, _, length = unpack_from(EVENT_HEADER, buf, offset)
+            name = buf[offset + EVENT_HEADER_SIZE:offset + EVENT_HEADER_SIZE + length].rstrip(b'\0').decode()
+            offset += EVENT_HEADER_SIZE + length
+
+            if mask & RESCAN_MASK:
+                rescan = True
+            elif wd in self.dirs and name.endswith('.jar'):
+                touched.add((self.dirs[wd], name))
+
+        return touched, rescan
+
+    def close(self):
+        close(self.fd)
+
+
+class ModsIndexer(Thread):
+    '''Keeps the Mods table in step with the jars in the mods directories'''
+
+    def __init__(self):
+        super().__init__(name='mods-indexer', daemon=True)
+        self.dirs = [SERVER_MODS_DIR, CLIENT_MODS_DIR]
+        self.stopped = Event()
+        self.state: dict[str, list] = {}
+        # jars whose last pass failed, retried every INDEXER_SCAN_INTERVAL even if untouched
+        self.failed: set[tuple[str, str]] = set()
+        self.retry_at = 0.0
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self):
+        # only one process indexes, the rest keep trying in case it exits
+        with open(LOCK_PATH, 'a') as lock_file:
+            while not self.stopped.is_set():
+                try:
+                    flock(lock_file, LOCK_EX | LOCK_NB)
+                    break
+                except BlockingIOError:
+                    self.stopped.wait(INDEXER_SCAN_INTERVAL)
+            else:
+                return
+
+            self._load_state()
+
+            try:
+                watcher = Inotify(self.dirs)
+            except (OSError, AttributeError) as e:
+                log.info('inotify unavailable (%s), scanning every %ss', e, INDEXER_SCAN_INTERVAL)
+                watcher = None
+
+            try:
+                self._loop(watcher)
+            finally:
+                if watcher is not None:
+                    watcher.close()
+
+    def _loop(self, watcher: Inotify | None):
+        # catch up with whatever changed while the server was down
+        self._guarded(self.scan)
+
+        while not self.stopped.is_set():
+            if watcher is None:
+                self.stopped.wait(INDEXER_SCAN_INTERVAL)
+                self._guarded(self.scan)
+                continue
+
+            touched, rescan = watcher.wait(1.0)
+            if not touched and not rescan:
+                if self.failed and monotonic() >= self.retry_at:
+                    self._guarded(self.index, set(self.failed))
+                continue
+
+            # let a copy or a burst of changes finish before indexing it
+            deadline = monotonic() + INDEXER_SETTLE
+            while (remaining := deadline - monotonic()) > 0:
+                more, more_rescan = watcher.wait(remaining)
+                touched |= more
+                rescan |= more_rescan
+
+            if rescan:
+                self._guarded(self.scan)
+            else:
+                self._guarded(self.index, touched)
+
+    def _guarded(self, func, *args):
+        # a bad jar or a locked database must not kill the thread
+        try:
+            func(*args)
+        except Exception:
+            log.exception('mods indexer pass failed')
+
+    def scan(self):
+        '''Stat every jar and index the ones that appeared, vanished or changed size or mtime'''
+        on_disk = {(directory, name) for directory in self.dirs for name in list_jars(directory)}
+        known = {tuple(key.split('\0')) for key in self.state}
+        self.index(on_disk | known)
+
+    def index(self, touched: set[tuple[str, str]]):
+        '''Rehash and write only the touched jars whose (size, mtime) differ from last time
+
+        A pass is written in one transaction. If a jar makes it fail, every
+        jar is written in a transaction of its own so one bad jar doesn't hold
+        back the rest. Jars that still fail, or whose pass found the database
+        locked, are kept out of the state and retried every INDEXER_SCAN_INTERVAL.
+        '''
+        stale, gone, seen = [], [], {}
+        self.failed -= touched
+
+        for directory, name in touched:
+            key = f'{directory}\0{name}'
+            try:
+                st = stat(join(directory, name))
+            except FileNotFoundError:
+                if key in self.state:
+                    gone.append((directory, name))
+                continue
+
+            if self.state.get(key) != [st.st_size, st.st_mtime_ns]:
+                seen[key] = [st.st_size, st.st_mtime_ns]
+                stale.append((directory, name))
+
+        if not stale and not gone:
+            return
+
+        with ThreadPoolExecutor(max_workers=INDEX_WORKERS) as pool:
+            scanned = list(pool.map(lambda jar: self._scan(*jar), stale))
+        failed = {jar for jar, scanned_jar in zip(stale, scanned) if scanned_jar is None}
+        jars = [jar for jar in scanned if jar is not None]
+
+        try:
+            report, removed = self._write(jars, gone)
+        except OperationalError:
+            # locked or busy, every jar would wait out the timeout again, retry them all later
+            log.exception('mods indexer pass failed')
+            report, removed = ReconcileReport(), []
+            failed |= set(stale) | set(gone)
+        except Exception:
+            log.exception('mods indexer pass failed, indexing its jars one at a time')
+            report, removed = ReconcileReport(), []
+            for jar, part, part_gone in [((j.directory, j.filename), [j], []) for j in jars] + [(g, [], [g]) for g in gone]:
+                try:
+                    part_report, part_removed = self._write(part, part_gone)
+                except Exception:
+                    log.exception('mods indexer could not index %s', join(*jar))
+                    failed.add(jar)
+                    continue
+                for report_field in fields(report):
+                    getattr(report, report_field.name).extend(getattr(part_report, report_field.name))
+                removed += part_removed
+
+        # only remember what made it into the database, the rest is retried
+        for directory, name in failed:
+            seen.pop(f'{directory}\0{name}', None)
+        self.state.update(seen)
+        for directory, name in gone:
+            if (directory, name) not in failed:
+                del self.state[f'{directory}\0{name}']
+        self._save_state()
+
+        if failed:
+            self.failed |= failed
+            self.retry_at = monotonic() + INDEXER_SCAN_INTERVAL
+
+        if report.added or report.changed or removed or report.misplaced or report.duplicates or failed:
+            log.info('mods indexer: %d added, %d changed, %d removed, %d misplaced, %d duplicates, %d failed',
+                     len(report.added), len(report.changed), len(removed), len(report.misplaced),
+                     len(report.duplicates), len(failed))
+
+    def _scan(self, directory: str, filename: str) -> ScannedJar | None:
+        try:
+            return scan_jar(directory, filename)
+        except Exception:
+            log.exception('mods indexer could not read %s', join(directory, filename))
+            return None
+
+    def _write(self, jars: list[ScannedJar], gone: list[tuple[str, str]]) -> tuple[ReconcileReport, list[str]]:
+        '''Write scanned and vanished jars in one transaction'''
+        report = ReconcileReport()
+
+        with DBConnection(immediate=True) as db:
+            # every row, so a jar whose content is registered under another filename is skipped as a duplicate
+            rows = {row[ModsTable.FILENAME]: row for row in db.get_mod_files()}
+
+            # only drop rows whose jar left the directory its role lives in
+            removed = [f for d, f in gone if f in rows and mods_dir_for(rows[f][ModsTable.ROLE]) == d]
+
+            taken = {row[ModsTable.NAME] for row in rows.values()}
+            added, changed = plan_changes(jars, rows, taken, report)
+
+            if removed:
+                db.delete_mods(removed)
+            apply_changes(db, rows, added, changed)
+
+        return report, removed
+
+    def _load_state(self):
+        try:
+            with open(STATE_PATH) as f:
+                self.state = load(f)
+        except (FileNotFoundError, ValueError):
+            self.state = {}
+
+    def _save_state(self):
+        tmp = f'{STATE_PATH}.tmp'
+        with open(tmp, 'w') as f:
+            dump(self.state, f)
+        replace(tmp, STATE_PATH)
+
+
+def start_indexer() -> ModsIndexer:
+    '''Start the background indexer for this process'''
+    indexer = ModsIndexer()
+    indexer.start()
+    return indexer
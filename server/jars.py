@@ -0,0 +1,147 @@
+from hashlib import sha256
+from json import dumps, load
+from os import makedirs, remove, replace
+from os.path import dirname, exists, getsize, join
+from tempfile import NamedTemporaryFile
+from zipfile import ZipFile
+from server.config import PATCH_CACHE_DIR
+from server.storage import blob_path
+
+
+# patch ops, stored as [COPY, old_offset, length] or [DATA, length]
+COPY = 0
+DATA = 1
+
+# a patch is only worth sending if it is at most this fraction of the full jar
+MAX_PATCH_RATIO = 0.8
+
+
+def _entries_path(filehash: str) -> str:
+    return join(PATCH_CACHE_DIR, 'entries', f'{filehash}.json')
+
+
+def patch_path(old_hash: str, new_hash: str) -> str:
+    return join(PATCH_CACHE_DIR, f'{old_hash}-{new_hash}.patch')
+
+
+def _write_atomic(path: str, write):
+    '''Write a cache file next to its final path, then rename it into place'''
+    directory = dirname(path)
+    makedirs(directory, exist_ok=True)
+
+    with NamedTemporaryFile(dir=directory, delete=False) as tmp:
+        try:
+            write(tmp)
+        except BaseException:
+            tmp.close()
+            remove(tmp.name)
+            raise
+    replace(tmp.name, path)
+
+
+def jar_entries(filehash: str) -> dict:
+    '''Per-entry manifest of a stored jar, built once and cached on disk
+
+    Each entry records its name, CRC and sizes, plus the byte range of its
+    raw local record (header + compressed data) and that range's sha256, so
+    identical records in two jars can be matched byte for byte.
+    '''
+    cache = _entries_path(filehash)
+    if exists(cache):
+        with open(cache, 'r') as file:
+            return load(file)
+
+    path = blob_path(filehash)
+
+    with ZipFile(path) as jar:
+        infos = sorted(jar.infolist(), key=lambda info: info.header_offset)
+        central_directory = jar.start_dir
+
+    entries = []
+    with open(path, 'rb') as file:
+        for i, info in enumerate(infos):
+            # a record runs until the next one starts, or the central directory does
+            end = infos[i + 1].header_offset if i + 1 < len(infos) else central_directory
+
+            file.seek(info.header_offset)
+            raw = file.read(end - info.header_offset)
+
+            entries.append({
+                'name': info.filename,
+                'crc': info.CRC,
+                'size': info.file_size,
+                'compress_size': info.compress_size,
+                'offset': info.header_offset,
+                'length': len(raw),
+                'hash': sha256(raw).hexdigest(),
+            })
+
+    manifest = {
+        'size': getsize(path),
+        'head': infos[0].header_offset if infos else central_directory,
+        'central_directory': central_directory,
+        'entries': entries,
+    }
+
+    _write_atomic(cache, lambda tmp: tmp.write(dumps(manifest).encode()))
+
+    return manifest
+
+
+def build_patch(old_hash: str, new_hash: str) -> str | None:
+    '''Build (or reuse) a patch turning the old jar into the new one
+
+    Records that are byte-identical in the old jar become copy ops, everything
+    else is shipped as data. Returns None when the patch would not be
+    meaningfully smaller than the new jar itself.
+    '''
+    path = patch_path(old_hash, new_hash)
+    if exists(path):
+        return path
+
+    old = jar_entries(old_hash)
+    new = jar_entries(new_hash)
+
+    old_records = {entry['hash']: entry for entry in old['entries']}
+
+    # (new_offset, length, old_offset or None) for every byte range of the new jar
+    ranges = [(0, new['head'], None)]
+    for entry in new['entries']:
+        match = old_records.get(entry['hash'])
+        ranges.append((entry['offset'], entry['length'], None if match is None else match['offset']))
+    ranges.append((new['central_directory'], new['size'] - new['central_directory'], None))
+
+    ops = []
+    data_ranges = []
+    for new_offset, length, old_offset in ranges:
+        if length == 0:
+            continue
+
+        if old_offset is None:
+            # merge neighbouring data into one op
+            if ops and ops[-1][0] == DATA:
+                ops[-1][1] += length
+            else:
+                ops.append([DATA, length])
+            data_ranges.append((new_offset, length))
+        elif ops and ops[-1][0] == COPY and ops[-1][1] + ops[-1][2] == old_offset:
+            # contiguous in the old jar too
+            ops[-1][2] += length
+        else:
+            ops.append([COPY, old_offset, length])
+
+    if sum(length for _, length in data_ranges) > MAX_PATCH_RATIO * new['size']:
+        return None
+
+    header = dumps({'old': old_hash, 'new': new_hash, 'size': new['size'], 'ops': ops}, separators=(',', ':'))
+
+    def write(tmp):
+        tmp.write(header.encode() + b'\n')
+        with open(blob_path(new_hash), 'rb') as src:
+            for offset, length in data_ranges:
+                src.seek(offset)
+                tmp.write(src.read(length))
+
+    _write_atomic(path, write)
+
+    return path
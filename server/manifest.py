@@ -0,0 +1,118 @@
+from dataclasses import dataclass
+from gzip import compress
+from hashlib import sha256
+from json import dumps
+from threading import Lock
+from time import monotonic
+from typing import Any, Callable, Hashable
+from server.config import MANIFEST_CHECK_INTERVAL
+from server.database.db import DBConnection, local_write_count
+from server.metrics import record_cache_lookup
+
+
+@dataclass(frozen=True)
+class Manifest:
+    '''One generation of a manifest, already serialized and compressed'''
+    generation: int
+    data: Any
+    etag: str | None = None
+    body: bytes | None = None
+    gzip_body: bytes | None = None
+
+
+class ManifestCache:
+    '''Caches the output of build(db) until the manifest generation changes
+
+    Writes from this process are noticed immediately. Writes from other
+    processes (other gunicorn workers, the import command) are noticed within
+    MANIFEST_CHECK_INTERVAL seconds. In between, get() never touches the database.
+
+    With serialize=False only the built object is kept, for in-memory
+    structures like the dependency graph that are never sent as-is.
+    '''
+
+    def __init__(self, build: Callable[[DBConnection], Any], serialize: bool = True, name: str = 'manifest'):
+        self.name = name
+        self._build = build
+        self._serialize_data = serialize
+        self._lock = Lock()
+        self._manifest: Manifest | None = None
+        self._checked_at = 0.0
+        self._write_count = -1
+
+
+    def _is_fresh(self) -> bool:
+        return (self._manifest is not None
+                and self._write_count == local_write_count()
+                and monotonic() - self._checked_at < MANIFEST_CHECK_INTERVAL)
+
+
+    def get(self) -> Manifest:
+        if self._is_fresh():
+            record_cache_lookup(self.name, 'hit')
+            return self._manifest
+
+        with self._lock:
+            # another thread may have refreshed it while we waited
+            if self._is_fresh():
+                record_cache_lookup(self.name, 'hit')
+                return self._manifest
+
+            write_count = local_write_count()
+
+            with DBConnection(readonly=True) as db:
+                generation = db.get_generation()
+
+                if self._manifest is None or self._manifest.generation != generation:
+                    record_cache_lookup(self.name, 'rebuilt')
+                    data = self._build(db)
+                    if self._serialize_data:
+                        self._manifest = self._serialize(generation, data)
+                    else:
+                        self._manifest = Manifest(generation, data)
+                else:
+                    record_cache_lookup(self.name, 'revalidated')
+
+            self._checked_at = monotonic()
+            self._write_count = write_count
+
+            return self._manifest
+
+
+    @staticmethod
+    def _serialize(generation: int, data: Any) -> Manifest:
+        body = dumps(data, separators=(',', ':'), sort_keys=True).encode()
+
+        # content hash rather than generation, so a recreated database can't reuse old tags
+        etag = sha256(body).hexdigest()[:32]
+
+        return Manifest(generation, data, etag, body, compress(body, mtime=0))
+
+
+class KeyedManifestCache:
+    '''One ManifestCache per key, e.g. per (role, loader, mc), each built on first use
+
+    Keys come from request arguments, so only the max_keys most recently used
+    are kept; a dropped key just gets rebuilt when it is asked for again.
+    '''
+
+    def __init__(self, build: Callable[[DBConnection, Hashable], Any], max_keys: int = 16, name: str = 'manifest'):
+        self.name = name
+        self.max_keys = max_keys
+        self._build = build
+        self._lock = Lock()
+        self._caches: dict[Hashable, ManifestCache] = {}
+
+
+    def get(self, key: Hashable) -> Manifest:
+        with self._lock:
+            cache = self._caches.pop(key, None)
+            if cache is None:
+                cache = ManifestCache(lambda db: self._build(db, key), name=self.name)
+                if len(self._caches) >= self.max_keys:
+                    del self._caches[next(iter(self._caches))]
+
+            # dicts keep insertion order, so the first key is the least recently used
+            self._caches[key] = cache
+
+        return cache.get()
@@ -0,0 +1,237 @@
+from dataclasses import dataclass, field
+from json import loads
+from re import fullmatch, split
+from tomllib import loads as toml_loads
+from typing import BinaryIO
+from zipfile import BadZipFile, ZipFile
+
+
+# metadata files, in the order they are preferred
+NEOFORGE_TOML = 'META-INF/neoforge.mods.toml'
+FORGE_TOML = 'META-INF/mods.toml'
+FABRIC_JSON = 'fabric.mod.json'
+MANIFEST = 'META-INF/MANIFEST.MF'
+
+# dependency ids that describe the platform rather than another mod
+MINECRAFT_IDS = {'minecraft'}
+LOADER_IDS = {'neoforge', 'forge', 'fabricloader', 'fabric-loader'}
+IGNORED_DEP_IDS = MINECRAFT_IDS | LOADER_IDS | {'java', 'fabric', 'fabric-api-base'}
+
+
+@dataclass
+class DeclaredDependancy:
+    modid: str
+    version_range: str | None
+    mandatory: bool
+
+
+@dataclass
+class JarMetadata:
+    '''What a jar says about itself, every field may be missing'''
+    modid: str | None = None
+    name: str | None = None
+    version: str | None = None
+    description: str | None = None
+    loader: str | None = None
+    loader_range: str | None = None
+    mc_range: str | None = None
+    dependancies: list[DeclaredDependancy] = field(default_factory=list)
+
+
+def _read_manifest(jar: ZipFile) -> dict[str, str]:
+    '''Main section of META-INF/MANIFEST.MF as a dict (continuation lines joined)'''
+    try:
+        text = jar.read(MANIFEST).decode('utf-8', errors='replace')
+    except KeyError:
+        return {}
+
+    attributes = {}
+    last_key = None
+    for line in text.splitlines():
+        # a blank line ends the main section
+        if not line.strip():
+            break
+        if line.startswith(' ') and last_key is not None:
+            attributes[last_key] += line[1:]
+        elif ':' in line:
+            last_key, _, value = line.partition(':')
+            attributes[last_key] = value.strip()
+
+    return attributes
+
+
+def _from_mods_toml(text: str, loader: str, manifest: dict[str, str]) -> JarMetadata:
+    data = toml_loads(text)
+    mods = data.get('mods') or [{}]
+    mod = mods[0]
+
+    meta = JarMetadata(loader=loader)
+    meta.modid = mod.get('modId')
+    meta.name = mod.get('displayName')
+    meta.description = (mod.get('description') or '').strip() or None
+
+    # ${file.jarVersion} is filled in from the manifest at build time
+    version = mod.get('version')
+    if version is None or '${' in version:
+        version = manifest.get('Implementation-Version')
+    meta.version = version
+
+    for dep in data.get('dependencies', {}).get(meta.modid, []):
+        dep_id = dep.get('modId')
+        version_range = dep.get('versionRange')
+
+        if dep_id in MINECRAFT_IDS:
+            meta.mc_range = version_range
+        elif dep_id in LOADER_IDS:
+            meta.loader_range = version_range
+        elif dep_id is not None:
+            # neoforge uses type = "required", forge uses mandatory = true
+            dep_type = str(dep.get('type', 'required' if dep.get('mandatory', True) else 'optional')).lower()
+            if dep_type in ('incompatible', 'discouraged'):
+                continue
+            meta.dependancies.append(DeclaredDependancy(dep_id, version_range, dep_type == 'required'))
+
+    return meta
+
+
+def _from_fabric_json(text: str) -> JarMetadata:
+    data = loads(text)
+
+    meta = JarMetadata(loader='fabric')
+    meta.modid = data.get('id')
+    meta.name = data.get('name')
+    meta.version = data.get('version')
+    meta.description = data.get('description') or None
+
+    def as_range(value) -> str:
+        # fabric allows a list of alternatives
+        return ' || '.join(value) if isinstance(value, list) else str(value)
+
+    for dep_id, version_range in data.get('depends', {}).items():
+        if dep_id in MINECRAFT_IDS:
+            meta.mc_range = as_range(version_range)
+        elif dep_id in LOADER_IDS:
+            meta.loader_range = as_range(version_range)
+        elif dep_id not in IGNORED_DEP_IDS:
+            meta.dependancies.append(DeclaredDependancy(dep_id, as_range(version_range), True))
+
+    for dep_id, version_range in data.get('recommends', {}).items():
+        if dep_id not in IGNORED_DEP_IDS:
+            meta.dependancies.append(DeclaredDependancy(dep_id, as_range(version_range), False))
+
+    return meta
+
+
+def read_jar_metadata(stream: BinaryIO) -> JarMetadata:
+    '''Read mod metadata straight out of a jar stream, without extracting it
+
+    Only the central directory and the few metadata entries are read. The
+    stream is rewound afterwards so it can still be saved.
+    '''
+    try:
+        with ZipFile(stream) as jar:
+            names = set(jar.namelist())
+            manifest = _read_manifest(jar)
+
+            if NEOFORGE_TOML in names:
+                meta = _from_mods_toml(jar.read(NEOFORGE_TOML).decode(), 'neoforge', manifest)
+            elif FORGE_TOML in names:
+                meta = _from_mods_toml(jar.read(FORGE_TOML).decode(), 'forge', manifest)
+            elif FABRIC_JSON in names:
+                meta = _from_fabric_json(jar.read(FABRIC_JSON).decode())
+            else:
+                meta = JarMetadata()
+    except (BadZipFile, ValueError, UnicodeDecodeError):
+        # not a readable jar or broken metadata, the admin fills it in by hand
+        meta, manifest = JarMetadata(), {}
+    finally:
+        stream.seek(0)
+
+    # plain library jars often only have a manifest
+    meta.name = meta.name or manifest.get('Implementation-Title') or manifest.get('Specification-Title')
+    meta.version = meta.version or manifest.get('Implementation-Version') or manifest.get('Specification-Version')
+    meta.modid = meta.modid or manifest.get('Automatic-Module-Name')
+
+    return meta
+
+
+############ VERSION RANGES ############
+
+
+def _version_key(version: str) -> tuple:
+    '''Sort key for dotted versions, numbers compare as numbers'''
+    parts = split(r'[.\-+]', version.strip())
+    return tuple((0, int(p), '') if p.isdigit() else (1, 0, p) for p in parts if p)
+
+
+def _compare(a: str, b: str) -> int:
+    ka, kb = _version_key(a), _version_key(b)
+    return (ka > kb) - (ka < kb)
+
+
+def _in_maven_range(version: str, spec: str) -> bool:
+    '''Maven ranges as used by (neo)forge: [1.21,1.22) or [1.21.1] or a list of them'''
+    for lower_inc, lower, upper, upper_inc in _maven_ranges(spec):
+        if lower and (_compare(version, lower) < 0 or (_compare(version, lower) == 0 and not lower_inc)):
+            continue
+        if upper and (_compare(version, upper) > 0 or (_compare(version, upper) == 0 and not upper_inc)):
+            continue
+        return True
+    return False
+
+
+def _maven_ranges(spec: str):
+    for match in split(r'(?<=[\])]),', spec.replace(' ', '')):
+        m = fullmatch(r'([\[(])([^,]*)(,?)([^,]*)([\])])', match)
+        if m is None:
+            continue
+        lower_inc, lower, comma, upper, upper_inc = m.groups()
+        if not comma:
+            # [1.21.1] pins a single version
+            upper = lower
+        yield lower_inc == '[', lower, upper, upper_inc == ']'
+
+
+def _in_fabric_range(version: str, spec: str) -> bool:
+    '''Fabric/semver style: ">=1.21 <1.22", "~1.21.1", "1.21.x", "*", alternatives split by ||'''
+    for alternative in spec.split('||'):
+        if all(_matches_predicate(version, p) for p in alternative.split()):
+            return True
+    return False
+
+
+def _matches_predicate(version: str, predicate: str) -> bool:
+    if predicate in ('*', ''):
+        return True
+
+    m = fullmatch(r'(>=|<=|>|<|=|~|\^)?(.+)', predicate)
+    op, target = m.groups()
+
+    if target.endswith(('.x', '.X', '.*')):
+        prefix = target[:-2]
+        return version == prefix or version.startswith(prefix + '.')
+
+    cmp = _compare(version, target)
+    if op == '>=':
+        return cmp >= 0
+    if op == '<=':
+        return cmp <= 0
+    if op == '>':
+        return cmp > 0
+    if op == '<':
+        return cmp < 0
+    if op in ('~', '^'):
+        # same minor (~) or same major (^), and not older
+        width = 2 if op == '~' else 1
+        return cmp >= 0 and _version_key(version)[:width] == _version_key(target)[:width]
+    return cmp == 0
+
+
+def version_in_range(version: str, spec: str | None) -> bool:
+    '''True if version satisfies a (neo)forge or fabric version range; no range means any'''
+    if not spec:
+        return True
+    spec = spec.strip()
+    if spec[0] in '[(':
+        return _in_maven_range(version, spec)
+    return _in_fabric_range(version, spec)
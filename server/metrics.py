@@ -0,0 +1,210 @@
+from bisect import bisect_left
+from functools import wraps
+from os import getpid
+from threading import Lock
+from time import perf_counter
+from flask import Flask, Response, g, request
+from server.config import METRICS_ENABLED, METRICS_IPS
+
+
+# upper bounds in seconds, from a cached manifest hit up to a slow jar download
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# SQLite queries against a warm page cache mostly finish well under a millisecond
+DB_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    # full precision, byte counters outgrow the six digits of :g quickly
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _labels(names: tuple[str, ...], values: tuple, extra: str = '') -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class _Metric:
+    type = ''
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self._lock = Lock()
+        self._values: dict[tuple, float] = {}
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            lines.append(f'{self.name}{_labels(self.label_names, key)} {_number(value)}')
+        return lines
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(_Metric):
+    type = 'gauge'
+
+    def add(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+        # per label set: [count per bucket (+Inf last), sum]
+        self._series: dict[tuple, list] = {}
+
+    def observe(self, value: float, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+        with self._lock:
+            series = {key: (list(counts), total) for key, (counts, total) in self._series.items()}
+
+        for key, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, '+Inf'), counts):
+                cumulative += count
+                le = 'le="{}"'.format(bound if bound == '+Inf' else f'{bound:g}')
+                lines.append(f'{self.name}_bucket{_labels(self.label_names, key, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.label_names, key)} {_number(total)}')
+            lines.append(f'{self.name}_count{_labels(self.label_names, key)} {cumulative}')
+
+        return lines
+
+
+REQUEST_DURATION = Histogram('mcmm_http_request_duration_seconds', 'Time spent handling a request.', ('route', 'method', 'status'))
+REQUESTS_IN_FLIGHT = Gauge('mcmm_http_requests_in_flight', 'Requests being handled right now.')
+RESPONSE_BYTES = Counter('mcmm_http_response_bytes_total', 'Response body bytes sent by the app, by route.', ('route',))
+FILE_SENDS = Counter('mcmm_file_sends_total', 'Files sent, by how they were sent.', ('backend',))
+FILE_SEND_BYTES = Counter('mcmm_file_send_bytes_total', 'File bytes sent, including those handed to a front proxy.', ('backend',))
+MANIFEST_CACHE = Counter('mcmm_manifest_cache_requests_total', 'Manifest cache lookups: hit, revalidated or rebuilt.', ('cache', 'result'))
+DB_QUERY_DURATION = Histogram('mcmm_db_query_duration_seconds', 'Time spent in DBConnection methods.', ('query',), DB_BUCKETS)
+
+REGISTRY = (REQUEST_DURATION, REQUESTS_IN_FLIGHT, RESPONSE_BYTES, FILE_SENDS, FILE_SEND_BYTES, MANIFEST_CACHE, DB_QUERY_DURATION)
+
+
+def render_metrics() -> str:
+    '''All metrics of this process in the Prometheus text format'''
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def instrument_queries(cls):
+    '''Class decorator timing every public method of a DBConnection-like class'''
+    if not METRICS_ENABLED:
+        return cls
+
+    def timed(name, method):
+        @wraps(method)
+        def wrapper(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                DB_QUERY_DURATION.observe(perf_counter() - start, name)
+        return wrapper
+
+    for name, method in list(vars(cls).items()):
+        if callable(method) and not name.startswith('_'):
+            setattr(cls, name, timed(name, method))
+
+    return cls
+
+
+def record_file_send(backend: str, size: int):
+    if METRICS_ENABLED:
+        FILE_SENDS.inc(backend)
+        FILE_SEND_BYTES.inc(backend, amount=size)
+
+
+def record_cache_lookup(cache: str, result: str):
+    if METRICS_ENABLED:
+        MANIFEST_CACHE.inc(cache, result)
+
+
+def _route() -> str:
+    # the URL rule, not the path, so /download/blob/<filehash> is one series
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+
+def _count_streamed(chunks, route: str):
+    '''Count the bytes of a streamed body as they are sent'''
+    try:
+        for chunk in chunks:
+            RESPONSE_BYTES.inc(route, amount=len(chunk))
+            yield chunk
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+def _before_request():
+    g.metrics_start = perf_counter()
+    REQUESTS_IN_FLIGHT.add(amount=1)
+
+
+def _after_request(response: Response) -> Response:
+    route = _route()
+    REQUEST_DURATION.observe(perf_counter() - g.metrics_start, route, request.method, response.status_code)
+
+    if response.content_length is not None:
+        RESPONSE_BYTES.inc(route, amount=response.content_length)
+    elif response.is_streamed and not response.direct_passthrough:
+        response.response = _count_streamed(response.response, route)
+
+    return response
+
+
+def _teardown_request(_):
+    if 'metrics_start' in g:
+        REQUESTS_IN_FLIGHT.add(amount=-1)
+
+
+def init_metrics(app: Flask):
+    '''Time every request and serve the metrics at /metrics'''
+    if not METRICS_ENABLED:
+        return
+
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+
+    @app.route('/metrics')
+    def metrics():
+        if METRICS_IPS is not None and request.remote_addr not in METRICS_IPS:
+            return Response('IP not authorized\n', status=403, mimetype='text/plain')
+
+        # each gunicorn worker keeps its own numbers, the header says which one answered
+        response = Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+        response.headers['X-Worker-Pid'] = str(getpid())
+        return response
@@ -0,0 +1,123 @@
+from glob import glob
+from os import makedirs, remove
+from os.path import exists, join
+from os import replace
+from tempfile import NamedTemporaryFile
+from typing import Iterator
+from zipfile import ZipFile, ZipInfo, ZIP_STORED
+from server.config import PACK_CACHE_DIR
+from server.database.schemas import ModsTable
+from server.storage import blob_path
+
+
+# bytes read from a jar per zip write, also the rough size of each streamed chunk
+PACK_CHUNK_SIZE = 1024 * 1024
+
+# fixed entry timestamp, so the same mods always produce the same archive
+PACK_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+
+class _ChunkSink:
+    '''Write-only, unseekable file for ZipFile that buffers output until drained
+
+    Having tell() but no seek() makes ZipFile stream entries with data
+    descriptors instead of seeking back to patch their headers.
+    '''
+
+    def __init__(self):
+        self.chunks: list[bytes] = []
+        self.offset = 0
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        self.offset += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.offset
+
+    def flush(self):
+        pass
+
+    def drain(self) -> list[bytes]:
+        chunks, self.chunks = self.chunks, []
+        return chunks
+
+
+def pack_name(role: str, loader: str | None = None, mc_version: str | None = None) -> str:
+    '''client, or client-neoforge-1.21.1 for a pack narrowed to a loader and Minecraft version'''
+    return '-'.join(part for part in (role, loader, mc_version) if part)
+
+
+def pack_path(name: str, etag: str) -> str:
+    '''Cached archive for a pack name at the manifest version identified by etag'''
+    return join(PACK_CACHE_DIR, f'pack-{name}-{etag}.zip')
+
+
+def cached_pack(name: str, etag: str) -> str | None:
+    path = pack_path(name, etag)
+    return path if exists(path) else None
+
+
+def _remove_stale_packs(name: str, keep: str):
+    # match the etag exactly, so client-* never sweeps up the client-neoforge-* packs
+    for path in glob(join(PACK_CACHE_DIR, f'pack-{name}-' + '[0-9a-f]' * 32 + '.zip')):
+        if path != keep:
+            try:
+                remove(path)
+            except OSError:
+                pass
+
+
+def stream_pack(mods: list[dict], name: str, etag: str, source_path) -> Iterator[bytes]:
+    '''Yield a STORED zip of the mods while teeing it to the pack cache
+
+    Jars are already deflated, so they are stored as-is. Nothing is held in
+    memory beyond one chunk, and the cache file is only renamed into place
+    once the archive is complete, so an aborted download leaves no trace.
+    '''
+    makedirs(PACK_CACHE_DIR, exist_ok=True)
+
+    path = pack_path(name, etag)
+    tmp = NamedTemporaryFile(dir=PACK_CACHE_DIR, prefix='.pack-', delete=False)
+    complete = False
+
+    sink = _ChunkSink()
+
+    def flush() -> Iterator[bytes]:
+        for chunk in sink.drain():
+            tmp.write(chunk)
+            yield chunk
+
+    try:
+        with ZipFile(sink, 'w', ZIP_STORED) as pack:
+            for mod in mods:
+                filehash = mod[ModsTable.FILEHASH]
+                src_path = blob_path(filehash)
+                if not exists(src_path):
+                    src_path = source_path(mod)
+
+                info = ZipInfo(mod[ModsTable.FILENAME], date_time=PACK_DATE_TIME)
+                info.compress_type = ZIP_STORED
+                info.external_attr = 0o644 << 16
+
+                with open(src_path, 'rb') as src, pack.open(info, 'w') as dst:
+                    while chunk := src.read(PACK_CHUNK_SIZE):
+                        dst.write(chunk)
+                        yield from flush()
+
+                yield from flush()
+
+        # central directory
+        yield from flush()
+
+        tmp.close()
+        replace(tmp.name, path)
+        complete = True
+
+        _remove_stale_packs(name, path)
+
+    finally:
+        if not complete:
+            tmp.close()
+            remove(tmp.name)
@@ -0,0 +1,186 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from hashlib import file_digest, sha256
+from os import cpu_count, scandir
+from os.path import join, splitext
+import click
+from server.config import SERVER_MODS_DIR, CLIENT_MODS_DIR
+from server.database.db import DBConnection
+from server.database.params import ModInsert
+from server.database.schemas import ModsTable, TypeValues, RoleValues
+from server.metadata import JarMetadata, read_jar_metadata
+from server.storage import adopt_blob
+
+
+@dataclass
+class ScannedJar:
+    directory: str
+    filename: str
+    filehash: str
+    metadata: JarMetadata
+
+    @property
+    def path(self) -> str:
+        return join(self.directory, self.filename)
+
+
+@dataclass
+class ReconcileReport:
+    added: list[str] = field(default_factory=list)
+    changed: list[str] = field(default_factory=list)
+    orphaned: list[str] = field(default_factory=list)
+    # jars whose filename is registered with a role that lives in the other directory
+    misplaced: list[str] = field(default_factory=list)
+    # jars skipped because their content or filename is already registered or earlier in the batch
+    duplicates: list[str] = field(default_factory=list)
+
+
+def mods_dir_for(role: str) -> str:
+    return CLIENT_MODS_DIR if role == RoleValues.CLIENT else SERVER_MODS_DIR
+
+
+def scan_jar(directory: str, filename: str) -> ScannedJar:
+    '''Hash a jar and read its metadata in one open'''
+    with open(join(directory, filename), 'rb') as f:
+        filehash = file_digest(f, sha256).hexdigest()
+        metadata = read_jar_metadata(f)
+
+    return ScannedJar(directory, filename, filehash, metadata)
+
+
+def scan_jars(jars: list[tuple[str, str]], workers: int) -> list[ScannedJar]:
+    '''Hash (directory, filename) jars on a thread pool'''
+    # file_digest releases the GIL, so threads hash in parallel
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(lambda jar: scan_jar(*jar), jars))
+
+
+def list_jars(directory: str) -> list[str]:
+    with scandir(directory) as entries:
+        return [e.name for e in entries if e.is_file() and e.name.endswith('.jar')]
+
+
+def unique_name(name: str, filename: str, taken: set[str]) -> str:
+    '''Mod names are unique, fall back to the filename when two jars share a display name'''
+    if name in taken:
+        name = f'{name} ({filename})'
+    taken.add(name)
+    return name
+
+
+def plan_changes(jars: list[ScannedJar], rows: dict[str, dict], taken: set[str], report: ReconcileReport,
+                 server_role: str = RoleValues.BOTH, mod_type: str = TypeValues.FEATURE, link: str = ''):
+    '''Sort scanned jars into new mods and changed files, given the rows registered under their filenames
+
+    Filenames and hashes are unique in Mods, so a jar whose content is already
+    registered or planned, or a new filename present in both directories, is
+    left out and reported as a duplicate rather than failing the whole batch.
+    '''
+    added: list[tuple[ScannedJar, ModInsert]] = []
+    changed: list[tuple[ScannedJar, ModInsert]] = []
+
+    hashes = {row[ModsTable.FILEHASH] for row in rows.values()}
+    new_filenames = set()
+
+    for jar in jars:
+        row = rows.get(jar.filename)
+
+        if row is not None and mods_dir_for(row[ModsTable.ROLE]) != jar.directory:
+            report.misplaced.append(jar.path)
+            continue
+
+        if row is not None and row[ModsTable.FILEHASH] == jar.filehash:
+            continue
+
+        if jar.filehash in hashes or (row is None and jar.filename in new_filenames):
+            report.duplicates.append(jar.path)
+            continue
+
+        hashes.add(jar.filehash)
+        if row is None:
+            new_filenames.add(jar.filename)
+            name = unique_name(jar.metadata.name or splitext(jar.filename)[0], jar.filename, taken)
+            role = RoleValues.CLIENT if jar.directory == CLIENT_MODS_DIR else server_role
+        else:
+            name, role = row[ModsTable.NAME], row[ModsTable.ROLE]
+
+        str_values = {
+            ModsTable.NAME: name,
+            ModsTable.DESCRIPTION: jar.metadata.description or '',
+            ModsTable.VERSION: jar.metadata.version or '',
+            ModsTable.LINK: link,
+            ModsTable.TYPE: mod_type,
+            ModsTable.ROLE: role,
+        }
+        mod_insert = ModInsert(str_values, jar.filename, jar.filehash, jar.metadata)
+
+        if row is None:
+            added.append((jar, mod_insert))
+            report.added.append(jar.path)
+        else:
+            changed.append((jar, mod_insert))
+            report.changed.append(jar.path)
+
+    return added, changed
+
+
+def apply_changes(db: DBConnection, rows: dict[str, dict], added, changed):
+    '''Write planned changes with one executemany per statement'''
+    mod_ids = db.add_mods([m for _, m in added])
+    db.update_mod_files([m for _, m in changed])
+
+    declared = [(mod_ids[m.filename], jar.metadata) for jar, m in added]
+    declared += [(rows[m.filename][ModsTable.ID], jar.metadata) for jar, m in changed]
+    db.set_declared_dependancies(declared)
+
+    # the jars are already in place, copy them into the blob store
+    for jar, _ in added + changed:
+        adopt_blob(jar.path, jar.filehash)
+
+
+def reconcile(server_role: str = RoleValues.BOTH, mod_type: str = TypeValues.FEATURE, link: str = '',
+              workers: int | None = None, dry_run: bool = False) -> ReconcileReport:
+    '''Register the jars sitting in the mods directories and report how they differ from the database'''
+    on_disk = {directory: set(list_jars(directory)) for directory in (SERVER_MODS_DIR, CLIENT_MODS_DIR)}
+    jars = scan_jars(sorted((d, f) for d, names in on_disk.items() for f in names), workers or cpu_count() or 4)
+
+    report = ReconcileReport()
+
+    with DBConnection(immediate=True) as db:
+        rows = {row[ModsTable.FILENAME]: row for row in db.get_mod_files()}
+        taken = {row[ModsTable.NAME] for row in rows.values()}
+
+        added, changed = plan_changes(jars, rows, taken, report, server_role, mod_type, link)
+
+        # rows whose jar is no longer where its role says it should be
+        for filename, row in sorted(rows.items()):
+            if filename not in on_disk[mods_dir_for(row[ModsTable.ROLE])]:
+                report.orphaned.append(filename)
+
+        if not dry_run:
+            apply_changes(db, rows, added, changed)
+
+    return report
+
+
+@click.command('import-mods')
+@click.option('--server-role', type=click.Choice([RoleValues.BOTH, RoleValues.SERVER]), default=RoleValues.BOTH,
+              help='Role given to new jars found in the server mods directory.')
+@click.option('--type', 'mod_type', type=click.Choice([TypeValues.FEATURE, TypeValues.LIBRARY]), default=TypeValues.FEATURE,
+              help='Type given to new jars.')
+@click.option('--link', default='', help='Link given to new jars.')
+@click.option('-j', '--workers', type=int, default=None, help='Hashing threads (default: one per CPU).')
+@click.option('--dry-run', is_flag=True, help='Report differences without writing anything.')
+def import_mods_command(server_role, mod_type, link, workers, dry_run):
+    '''Register jars already in the mods directories and report added, changed and orphaned mods'''
+    report = reconcile(server_role, mod_type, link, workers, dry_run)
+
+    for label, paths in (('added', report.added), ('changed', report.changed),
+                         ('orphaned', report.orphaned), ('misplaced', report.misplaced),
+                         ('duplicates', report.duplicates)):
+        click.echo(f'{label}: {len(paths)}')
+        for path in paths:
+            click.echo(f'  {path}')
+
+    if dry_run:
+        click.echo('dry run, nothing was written')
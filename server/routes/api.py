@@ -1,14 +1,34 @@
-from flask import Blueprint, jsonify, send_file, request
-from server.config import MOD_LOADER_PATH
+from flask import Blueprint, Response, jsonify, request
+from server.config import MOD_LOADER_PATH, MC_VERSION
 from json import load
-from .utils import check_remote_ip, check_upload_file, check_form_data, get_file_path
+from os.path import splitext
+from sqlite3 import IntegrityError
+from zipfile import BadZipFile
+from .utils import check_remote_ip, check_upload_file, check_upload_files, check_form_data, check_dependancies, get_file_path, diff_mod_hashes, manifest_response
+from .utils import save_upload, remove_saved, check_search_args, check_target_args, encode_cursor
+from .utils import PACK_ROLES
 from server.database.params import ModInsert
 from server.database.db import DBConnection
+from server.database.schemas import ModsTable
+from server.manifest import ManifestCache, KeyedManifestCache
+from server.jars import build_patch
+from server.metadata import read_jar_metadata
+from server.packs import cached_pack, pack_name, stream_pack
+from server.reconcile import unique_name
+from server.sendfile import send_download
+from server.storage import blob_path, has_blob, is_valid_hash, adopt_blob
 
 
 # api blueprint
 api_bp = Blueprint('api', __name__)
 
+# serialized manifests, rebuilt only when the mods change
+mod_display_list = ManifestCache(lambda db: db.get_mods_info(), name='mod_display_list')
+dependency_graph = ManifestCache(lambda db: db.get_dependency_graph(), serialize=False, name='dependency_graph')
+
+# the jars each kind of install runs, keyed by (role, loader, mc) from check_target_args
+target_mods = KeyedManifestCache(lambda db, target: db.get_target_mods(PACK_ROLES[target[0]], *target[1:]), name='target_mods')
+
 
 ### API DOWNLOAD ROUTES ###
 
@@ -17,7 +37,120 @@ api_bp = Blueprint('api', __name__)
 @api_bp.route('/download/mod-loader', methods=['GET'])
 def send_mod_loader():
     '''Send the mod loader file to the client'''
-    return send_file(MOD_LOADER_PATH, as_attachment=True)
+    if MOD_LOADER_PATH is None:
+        return jsonify({'error': 'No mod loader configured'}), 404
+
+    # answers Range/If-Range with 206 and 416, or leaves them to the front proxy
+    return send_download(MOD_LOADER_PATH, as_attachment=True)
+
+
+# route for sending a single mod jar to the user
+@api_bp.route('/download/mod/<filename>', methods=['GET'])
+def send_mod(filename: str):
+    '''Send a single mod jar to the client'''
+
+    with DBConnection(readonly=True) as db:
+        mod = db.get_mod_by_filename(filename)
+
+    if mod is None:
+        return jsonify({'error': 'Mod not found'}), 404
+
+    save_path = get_file_path(mod[ModsTable.FILENAME], mod[ModsTable.ROLE])
+    return send_download(save_path, as_attachment=True)
+
+
+def ensure_blob(filehash: str) -> bool:
+    '''Return True if the blob exists, adopting it from a role directory if needed'''
+    if has_blob(filehash):
+        return True
+
+    with DBConnection(readonly=True) as db:
+        mod = db.get_mod_by_filehash(filehash)
+
+    if mod is None:
+        return False
+
+    # mods added before the blob store existed only live in the role directories,
+    # where the jar may since have been overwritten with other content
+    try:
+        adopt_blob(get_file_path(mod[ModsTable.FILENAME], mod[ModsTable.ROLE]), filehash)
+    except (OSError, ValueError):
+        return False
+
+    return True
+
+
+def send_immutable(path: str, etag: str, mimetype: str):
+    '''Send content that never changes for its URL, cacheable forever'''
+    response = send_download(path, mimetype=mimetype, etag=etag, max_age=31536000)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+
+    return response
+
+
+# route for sending any stored jar by its sha256
+@api_bp.route('/download/blob/<filehash>', methods=['GET'])
+def send_blob(filehash: str):
+    '''Send the content with the given sha256, cacheable forever'''
+    if not is_valid_hash(filehash):
+        return jsonify({'error': 'Invalid sha256'}), 400
+
+    if not ensure_blob(filehash):
+        return jsonify({'error': 'Blob not found'}), 404
+
+    # content never changes for a given hash, so the hash is a strong ETag
+    return send_immutable(blob_path(filehash), filehash, 'application/java-archive')
+
+
+# route for sending only the entries that changed between two versions of a jar
+@api_bp.route('/download/patch/<old_hash>/<new_hash>', methods=['GET'])
+def send_patch(old_hash: str, new_hash: str):
+    '''Send a patch that rebuilds the new jar from the old one'''
+    if not (is_valid_hash(old_hash) and is_valid_hash(new_hash)):
+        return jsonify({'error': 'Invalid sha256'}), 400
+
+    if not (ensure_blob(old_hash) and ensure_blob(new_hash)):
+        return jsonify({'error': 'Blob not found'}), 404
+
+    try:
+        path = build_patch(old_hash, new_hash)
+    except BadZipFile:
+        path = None
+
+    # the client falls back to downloading the whole jar
+    if path is None:
+        return jsonify({'error': 'No patch smaller than the full jar'}), 404
+
+    return send_immutable(path, f'{old_hash}-{new_hash}', 'application/octet-stream')
+
+
+# route for downloading every mod a client or server runs as one zip
+@api_bp.route('/download/pack', methods=['GET'])
+def send_pack():
+    '''Send a zip of the mods for ?role=client|server (and ?loader=&mc=), built on the fly'''
+    try:
+        target = check_target_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    manifest = target_mods.get(target)
+    name = pack_name(*target)
+    download_name = f'ModPack-{name}.zip'
+
+    # after the first build, repeat requests are a plain file send
+    path = cached_pack(name, manifest.etag)
+    if path is not None:
+        return send_download(path, as_attachment=True, download_name=download_name, etag=manifest.etag)
+
+    def source_path(mod: dict) -> str:
+        return get_file_path(mod[ModsTable.FILENAME], mod[ModsTable.ROLE])
+
+    # no Content-Length, so the archive goes out with chunked transfer encoding
+    response = Response(stream_pack(manifest.data, name, manifest.etag, source_path), mimetype='application/zip')
+    response.headers['Content-Disposition'] = f'attachment; filename={download_name}'
+
+    return response
 
 
 ### API INFO ROUTES ###
@@ -27,22 +160,111 @@ def send_mod_loader():
 @api_bp.route('/info/mod-display-list', methods=['GET'])
 def get_mod_list():
     '''Send json display info about the currently installed mods'''
-    
-    with DBConnection() as db:
-        mods_info = db.get_mods_info()
+    return manifest_response(mod_display_list.get(), request)
+
+
+# route for the jars one kind of install runs, what client-check diffs against
+@api_bp.route('/info/manifest', methods=['GET'])
+def get_target_manifest():
+    '''Send the filename and sha256 of every mod for ?role=client|server, optionally only ?loader=&mc='''
+    try:
+        target = check_target_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
-    return jsonify(mods_info)
+    return manifest_response(target_mods.get(target), request)
+
+
+# route for one filtered, searched and sorted page of the mod list
+@api_bp.route('/info/mods', methods=['GET'])
+def search_mods():
+    '''Send a page of mods filtered by ?role=&type=&q=, ordered by ?sort=, paged with ?cursor=&limit='''
+    try:
+        search = check_search_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    with DBConnection(readonly=True) as db:
+        mods, after = db.search_mods(**search)
+
+    next_cursor = None if after is None else encode_cursor(search['sort'], after)
+
+    return jsonify({'mods': mods, 'next': next_cursor})
+
+
+# route for the transitive dependencies and dependents of one mod
+@api_bp.route('/info/dependencies/<int:mod_id>', methods=['GET'])
+def get_mod_dependencies(mod_id: int):
+    '''Send what a mod needs (in install order) and what breaks without it'''
+    graph = dependency_graph.get().data
+
+    if mod_id not in graph:
+        return jsonify({'error': 'Mod not found'}), 404
+
+    requires = graph.requires(mod_id)
+
+    return jsonify({
+        'id': mod_id,
+        'requires': graph.install_order(requires),
+        'required-by': sorted(graph.required_by(mod_id)),
+    })
+
+
+# route for the order in which mods can be installed, dependencies first
+@api_bp.route('/info/install-order', methods=['GET'])
+def get_install_order():
+    '''Send every mod in dependency order'''
+    graph = dependency_graph.get().data
+
+    return jsonify({
+        'install-order': [graph.nodes[mod_id] for mod_id in graph.order],
+        'cycles': [graph.nodes[mod_id] for mod_id in graph.cycles],
+    })
+
+
+# route for finding the jars that provide a mod id
+@api_bp.route('/info/provides/<modid>', methods=['GET'])
+def get_mods_by_modid(modid: str):
+    '''Send every mod whose jar declares the given mod id'''
+    with DBConnection(readonly=True) as db:
+        mods = db.get_mods_by_modid(modid)
+
+    return jsonify({'modid': modid, 'mods': mods})
+
+
+# route for finding the mods that run on a Minecraft version (default: the server's)
+@api_bp.route('/info/targets', methods=['GET'])
+def get_mods_for_mc():
+    '''Send every mod whose declared Minecraft range includes ?mc='''
+    mc_version = request.args.get('mc', MC_VERSION)
+
+    if not mc_version:
+        return jsonify({'error': 'No Minecraft version given or configured'}), 400
+
+    with DBConnection(readonly=True) as db:
+        mods = db.get_mods_for_mc(mc_version)
+
+    return jsonify({'mc': mc_version, 'mods': mods})
 
 
 @api_bp.route('/client-check', methods=['POST'])
 def client_check():
-    '''Check the mods on the client and their content for updates'''
-    # get json list from client
-    # check which mods do not exist on the server
+    '''Check the mods of a ?role=client|server install (and ?loader=&mc=) for updates'''
+    try:
+        target = check_target_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
+    # get {filename: sha256} table from client
+    client_hashes = request.get_json(silent=True)
 
+    if not isinstance(client_hashes, dict):
+        return jsonify({'error': 'Expected a json object of filename to sha256'}), 400
 
+    server_mods = target_mods.get(target).data
 
+    # tell the client which jars to add, update and delete
+    return jsonify(diff_mod_hashes(client_hashes, server_mods))
 
 
 @api_bp.route('/admin/add-mod', methods=['POST'])
@@ -50,16 +272,91 @@ def add_mod():
     if check_remote_ip(request.remote_addr):
         return jsonify({'error': "IP not authorized"}), 403
     
-    str_values = check_form_data(request.form)
+    try:
+        file, filename, filehash = check_upload_file(request.files)
+
+        # read mods.toml / fabric.mod.json straight from the upload
+        metadata = read_jar_metadata(file.stream)
+
+        str_values = check_form_data(request.form, metadata)
+
+        dep_ids = check_dependancies(request.form, dependency_graph.get().data.nodes)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    new_mod = ModInsert(str_values, filename, filehash, metadata)
+
+    # the row only commits once the jar is in place, and the jar is unlinked if it doesn't
+    saved = []
+    try:
+        with DBConnection() as db:
+            mod_id = db.add_mod(new_mod)
+            db.add_dependancies(mod_id, dep_ids)
+            db.add_declared_dependancies(mod_id, metadata)
+
+            save_path = get_file_path(filename, new_mod.role)
+            save_upload(file, filehash, save_path)
+            saved.append(save_path)
+    except (ValueError, IntegrityError) as e:
+        remove_saved(saved)
+        return jsonify({'error': str(e)}), 400
+    except BaseException:
+        remove_saved(saved)
+        raise
+
+    return jsonify({"message": "Mod added successfully"}), 200
+
+
+@api_bp.route('/admin/add-mods', methods=['POST'])
+def add_mods():
+    '''Add every jar in a multipart upload in one transaction, reading names from the jars'''
+    if check_remote_ip(request.remote_addr):
+        return jsonify({'error': "IP not authorized"}), 403
+
+    try:
+        uploads = check_upload_files(request.files)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # type, role and link apply to the whole batch, but a form name or version only to a
+    # single jar: in a batch each jar's own, with the form version filling in for jars without
+    form = request.form.copy()
+    batch = len(uploads) > 1
+    if batch:
+        form.pop(ModsTable.NAME, None)
+        batch_version = form.pop(ModsTable.VERSION, '')
+
+    saved = []
+    try:
+        with DBConnection(immediate=True) as db:
+            taken = {row[ModsTable.NAME] for row in db.get_mod_files()}
+
+            for file, filename, filehash in uploads:
+                metadata = read_jar_metadata(file.stream)
 
-    file, filename, filehash = check_upload_file(request.files)
+                # jars without a readable name are named after their file
+                if batch or not form.get(ModsTable.NAME, '').strip():
+                    form[ModsTable.NAME] = unique_name(metadata.name or splitext(filename)[0], filename, taken)
+                if batch:
+                    form[ModsTable.VERSION] = metadata.version or batch_version
 
-    new_mod = ModInsert(str_values, filename, filehash)
+                try:
+                    str_values = check_form_data(form, metadata)
+                except ValueError as e:
+                    raise ValueError(f'{filename}: {e}') from e
 
-    with DBConnection() as db:
-        db.add_mod(new_mod)
+                new_mod = ModInsert(str_values, filename, filehash, metadata)
+                mod_id = db.add_mod(new_mod)
+                db.add_declared_dependancies(mod_id, metadata)
 
-    save_path = get_file_path(filename, new_mod.role)
-    file.save(save_path)
+                save_path = get_file_path(filename, new_mod.role)
+                save_upload(file, filehash, save_path)
+                saved.append(save_path)
+    except (ValueError, IntegrityError) as e:
+        remove_saved(saved)
+        return jsonify({'error': str(e)}), 400
+    except BaseException:
+        remove_saved(saved)
+        raise
 
-    return jsonify({"message": "Mod added successfully"}), 200
\ No newline at end of file
+    return jsonify({"message": f"{len(uploads)} mods added successfully"}), 200
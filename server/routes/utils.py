@@ -1,10 +1,20 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
 from hashlib import file_digest, sha256
+from json import dumps, loads
+from re import findall, fullmatch
 from server.config import ADMIN_IPS, SERVER_MODS_DIR, CLIENT_MODS_DIR
 from typing import BinaryIO
 from werkzeug.datastructures import FileStorage, ImmutableMultiDict
 from werkzeug.utils import secure_filename
-from server.database.schemas import ModsTable, TypeValues, RoleValues
-from os.path import join
+from server.database.schemas import ModsTable, TypeValues, RoleValues, SortValues
+from server.database.sql import SEARCH_ORDERS
+from os import remove
+from os.path import basename, join, lexists
+from flask import Request, Response
+from server.manifest import Manifest
+from server.metadata import JarMetadata
+from server.storage import commit_upload, copy_blob, store_blob
+from server.uploads import UploadSpool
 
 
 FORM_STR_KEYS = [
@@ -14,10 +24,36 @@ FORM_STR_KEYS = [
     ModsTable.LINK,
 ]
 
+# form fields that fall back to the jar's own metadata when left blank
+METADATA_FORM_KEYS = {
+    ModsTable.NAME: 'name',
+    ModsTable.DESCRIPTION: 'description',
+    ModsTable.VERSION: 'version',
+}
+
 VALID_TYPE_VALUES = {TypeValues.FEATURE, TypeValues.LIBRARY}
 
 VALID_ROLE_VALUES = {RoleValues.BOTH, RoleValues.SERVER, RoleValues.CLIENT}
 
+# which mod roles each kind of install runs
+PACK_ROLES = {
+    'client': (RoleValues.CLIENT, RoleValues.BOTH),
+    'server': (RoleValues.SERVER, RoleValues.BOTH),
+}
+
+# loaders a manifest can be narrowed to, as read from jar metadata
+VALID_LOADER_VALUES = {'neoforge', 'forge', 'fabric'}
+
+# Minecraft versions end up in pack file names, so only plain version characters
+MC_VERSION_PATTERN = r'[0-9A-Za-z.+_-]{1,32}'
+
+# multi-select field holding the ids of the mods a new mod depends on
+DEPS_FORM_KEY = 'dependancies'
+
+# page sizes for /api/info/mods
+SEARCH_LIMIT_DEFAULT = 50
+SEARCH_LIMIT_MAX = 200
+
 
 def calc_hash(stream: BinaryIO) -> str:
     '''Hash the contents of a file and return its hex digest using HASH_FUNCTION'''
@@ -36,44 +72,130 @@ def check_remote_ip(remote_ip:str) -> str:
     return remote_ip not in ADMIN_IPS
 
 
-def check_upload_file(filesContainer: ImmutableMultiDict[str, FileStorage]) -> tuple[FileStorage, str, str]:
+def check_upload_files(filesContainer: ImmutableMultiDict[str, FileStorage]) -> list[tuple[FileStorage, str, str]]:
     
     files = filesContainer.getlist('file_upload')
     
     if (len(files) == 0):
         raise ValueError('No File Uploaded')
     
-    if (len(files) > 1):
+    uploads = []
+    for file in files:
+        if not file.filename.endswith('.jar'):
+            raise ValueError('Only .jar files are allowed')
+        
+        if ' ' in file.filename:
+            raise ValueError('Filename cannot have any spaces')
+
+        # spooled uploads were hashed as they arrived
+        if isinstance(file.stream, UploadSpool):
+            filehash = file.stream.hexdigest()
+        else:
+            filehash = calc_hash(file.stream)
+
+        uploads.append((file, secure_filename(file.filename), filehash))
+
+    if len({filename for _, filename, _ in uploads}) < len(uploads):
+        raise ValueError('Duplicate filenames in upload')
+
+    return uploads
+
+
+def check_upload_file(filesContainer: ImmutableMultiDict[str, FileStorage]) -> tuple[FileStorage, str, str]:
+    
+    uploads = check_upload_files(filesContainer)
+    
+    if (len(uploads) > 1):
         raise ValueError('Only one file per upload allowed')
     
-    file = files[0]
+    return uploads[0]
 
-    if not file.filename.endswith('.jar'):
-        raise ValueError('Only .jar files are allowed')
-    
-    if ' ' in file.filename:
-        raise ValueError('Filename cannot have any spaces')
 
-    filehash = calc_hash(file.stream)
-    
-    return file, secure_filename(file.filename), filehash
+def save_upload(file: FileStorage, filehash: str, dest: str):
+    '''Put an uploaded jar in the blob store and expose it at dest, which must not exist yet'''
+    if isinstance(file.stream, UploadSpool):
+        commit_upload(file.stream, filehash)
+    else:
+        store_blob(file.stream, filehash)
+
+    # a jar already sitting there isn't ours to replace, or to remove on rollback
+    try:
+        copy_blob(filehash, dest, overwrite=False)
+    except FileExistsError:
+        raise ValueError(f'{basename(dest)} already exists in the mods directory')
 
 
-def check_form_data(formData: ImmutableMultiDict[str, str]) -> dict[str, str]:
+def remove_saved(paths: list[str]):
+    '''Undo the save_upload copies whose database rows were rolled back'''
+    for path in paths:
+        if lexists(path):
+            remove(path)
+
+
+def check_form_data(formData: ImmutableMultiDict[str, str], metadata: JarMetadata | None = None) -> dict[str, str]:
     
+    values = formData.to_dict(flat=True)
+
+    # fill blank fields from what the jar says about itself
+    if metadata is not None:
+        for k, attr in METADATA_FORM_KEYS.items():
+            if not values.get(k, '').strip() and getattr(metadata, attr):
+                values[k] = getattr(metadata, attr)
+
     for k in FORM_STR_KEYS:
-        if formData[k] is None:
+        if values.get(k) is None:
             raise ValueError(f'No string provided for {k}')
 
-    if formData[ModsTable.TYPE] not in VALID_TYPE_VALUES:
+    for k in (ModsTable.NAME, ModsTable.VERSION):
+        if not values[k].strip():
+            raise ValueError(f'{k} is empty and could not be read from the jar')
+
+    if values.get(ModsTable.TYPE) not in VALID_TYPE_VALUES:
         raise ValueError(f'{ModsTable.TYPE} value must be in {VALID_TYPE_VALUES}')
     
-    if formData[ModsTable.ROLE] not in VALID_ROLE_VALUES:
+    if values.get(ModsTable.ROLE) not in VALID_ROLE_VALUES:
         raise ValueError(f'{ModsTable.ROLE} value must be in {VALID_ROLE_VALUES}')
     
-    return formData.to_dict(flat=True)
+    return values
         
 
+def check_dependancies(formData: ImmutableMultiDict[str, str], known_ids) -> list[int]:
+    '''Return the dependency ids in the form, which must all be existing mods'''
+    dep_ids = []
+
+    for value in formData.getlist(DEPS_FORM_KEY):
+        if not value.isdigit() or int(value) not in known_ids:
+            raise ValueError(f'\'{value}\' is not the id of an existing mod')
+        dep_ids.append(int(value))
+
+    return dep_ids
+
+
+def diff_mod_hashes(client_hashes: dict[str, str], server_mods: list[dict]) -> dict[str, list]:
+    '''Split the server mods into the jars a client must add, update and delete'''
+    add = []
+    update = []
+
+    for mod in server_mods:
+        client_hash = client_hashes.get(mod[ModsTable.FILENAME])
+
+        # client already has this exact jar
+        if client_hash == mod[ModsTable.FILEHASH]:
+            continue
+
+        # client has a jar with the same name but different content
+        if client_hash is not None:
+            update.append(mod)
+        else:
+            add.append(mod)
+
+    # any jar on the client that the server does not know about gets removed
+    server_filenames = {mod[ModsTable.FILENAME] for mod in server_mods}
+    delete = sorted(f for f in client_hashes if f not in server_filenames)
+
+    return {'add': add, 'update': update, 'delete': delete}
+
+
 def get_file_path(filename: str, role: str):
     if role == RoleValues.BOTH or role == RoleValues.SERVER:
         return join(SERVER_MODS_DIR, filename)
@@ -82,4 +204,100 @@ def get_file_path(filename: str, role: str):
         return join(CLIENT_MODS_DIR, filename)
     
     else:
-        raise ValueError(f'Unable to get path, \'{role}\' is not a valid role')
\ No newline at end of file
+        raise ValueError(f'Unable to get path, \'{role}\' is not a valid role')
+
+
+def manifest_response(manifest: Manifest, req: Request) -> Response:
+    '''Answer with 304 if the client has this manifest already, else its cached bytes'''
+    use_gzip = req.accept_encodings['gzip'] > 0
+
+    # each encoding is its own representation, so give each its own tag
+    etag = manifest.etag + '-gzip' if use_gzip else manifest.etag
+
+    if req.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(manifest.gzip_body if use_gzip else manifest.body, mimetype='application/json')
+        if use_gzip:
+            response.content_encoding = 'gzip'
+
+    response.set_etag(etag)
+    response.vary.add('Accept-Encoding')
+
+    # clients may keep it, but must revalidate with If-None-Match before use
+    response.cache_control.no_cache = True
+
+    return response
+
+
+def encode_cursor(sort: str, after: list) -> str:
+    return urlsafe_b64encode(dumps([sort, *after]).encode()).decode()
+
+
+def search_query(text: str) -> str | None:
+    '''Turn free text into an FTS5 query matching every word as a prefix'''
+    words = findall(r'\w+', text)
+    return ' '.join(f'"{word}"*' for word in words) or None
+
+
+def check_target_args(args: ImmutableMultiDict[str, str]) -> tuple[str, str | None, str | None]:
+    '''Validate ?role=client|server&loader=&mc= into the (role, loader, mc) an install is for'''
+    role = args.get('role') or 'client'
+    if role not in PACK_ROLES:
+        raise ValueError(f'role must be one of {sorted(PACK_ROLES)}')
+
+    loader = args.get('loader') or None
+    if loader not in (None, *VALID_LOADER_VALUES):
+        raise ValueError(f'loader must be in {VALID_LOADER_VALUES}')
+
+    mc_version = args.get('mc') or None
+    if mc_version is not None and not fullmatch(MC_VERSION_PATTERN, mc_version):
+        raise ValueError('Invalid Minecraft version')
+
+    return role, loader, mc_version
+
+
+def check_search_args(args: ImmutableMultiDict[str, str]) -> dict:
+    '''Validate the /api/info/mods query string into DBConnection.search_mods arguments'''
+    role = args.get('role') or None
+    if role not in (None, *VALID_ROLE_VALUES):
+        raise ValueError(f'role must be in {VALID_ROLE_VALUES}')
+
+    mod_type = args.get('type') or None
+    if mod_type not in (None, *VALID_TYPE_VALUES):
+        raise ValueError(f'type must be in {VALID_TYPE_VALUES}')
+
+    query = search_query(args.get('q', ''))
+
+    sort = args.get('sort') or (SortValues.RELEVANCE if query else SortValues.NAME)
+    if sort not in set(SortValues):
+        raise ValueError(f'sort must be in {set(SortValues)}')
+    if sort == SortValues.RELEVANCE and query is None:
+        sort = SortValues.NAME
+
+    try:
+        limit = int(args.get('limit', SEARCH_LIMIT_DEFAULT))
+    except ValueError:
+        limit = None
+    if limit is None or not 1 <= limit <= SEARCH_LIMIT_MAX:
+        raise ValueError(f'limit must be between 1 and {SEARCH_LIMIT_MAX}')
+
+    after = None
+    if args.get('cursor'):
+        try:
+            cursor = loads(urlsafe_b64decode(args['cursor']))
+        except (ValueError, TypeError):
+            raise ValueError('Invalid cursor')
+
+        if not isinstance(cursor, list) or not cursor:
+            raise ValueError('Invalid cursor')
+
+        cursor_sort, *after = cursor
+        if cursor_sort != sort:
+            raise ValueError('Cursor belongs to a different sort order')
+
+        # one scalar per placeholder in the sort's keyset condition, or sqlite refuses the query
+        if len(after) != SEARCH_ORDERS[sort][1].count('?') or any(type(value) not in (str, int, float) for value in after):
+            raise ValueError('Invalid cursor')
+
+    return {'role': role, 'mod_type': mod_type, 'query': query, 'sort': sort, 'after': after, 'limit': limit}
@@ -2,6 +2,8 @@ from flask import Blueprint, render_template, redirect, request
 from .utils import check_remote_ip
 from server.config import MC_MODLOADER, MC_VERSION, MC_DIFFICULTY
 from server.database.schemas import RoleValues, TypeValues, ModsTable
+from .api import dependency_graph
+from .utils import DEPS_FORM_KEY
 
 
 # web related blueprint
@@ -51,6 +53,8 @@ def add_mod_page():
         link_col=ModsTable.LINK,
         type_col=ModsTable.TYPE,
         role_col=ModsTable.ROLE,
+        deps_col=DEPS_FORM_KEY,
+        mods=sorted(dependency_graph.get().data.nodes.values(), key=lambda mod: mod[ModsTable.NAME].lower()),
         types=[TypeValues.FEATURE, TypeValues.LIBRARY],
         roles=[RoleValues.BOTH, RoleValues.CLIENT, RoleValues.SERVER]
     )
\ No newline at end of file
@@ -0,0 +1,103 @@
+from os.path import abspath, commonpath
+from flask import Response, request, send_file
+from werkzeug.http import is_resource_modified
+from werkzeug.utils import send_file as werkzeug_send_file
+from werkzeug.wsgi import wrap_file
+from server.config import SENDFILE_BACKEND, X_ACCEL_LOCATIONS
+from server.metrics import record_file_send
+
+
+# with 'x-accel' the app only answers with headers and nginx sends the file,
+# which needs one internal location per directory in X_ACCEL_LOCATIONS:
+#
+#     location /internal/blobs/ {
+#         internal;
+#         alias /path/to/blobs/;
+#     }
+
+
+class _FileRange:
+    '''File positioned at the start of a byte range that reads no further than its end
+
+    Keeps fileno() so gunicorn can still os.sendfile from the current offset.
+    '''
+
+    def __init__(self, path: str, start: int, length: int):
+        self._file = open(path, 'rb')
+        self._file.seek(start)
+        self._left = length
+
+    def read(self, size: int = -1) -> bytes:
+        if size < 0 or size > self._left:
+            size = self._left
+        data = self._file.read(size)
+        self._left -= len(data)
+        return data
+
+    def fileno(self) -> int:
+        return self._file.fileno()
+
+    def tell(self) -> int:
+        return self._file.tell()
+
+    def close(self):
+        self._file.close()
+
+
+def _accel_uri(path: str) -> str | None:
+    '''Internal nginx URI for path, or None if no location covers its directory'''
+    path = abspath(path)
+
+    for directory, location in X_ACCEL_LOCATIONS.items():
+        directory = abspath(directory)
+        if commonpath([directory, path]) == directory:
+            return location + path[len(directory):].lstrip('/')
+
+    return None
+
+
+def _offload(path: str, header: str, value: str, **kwargs) -> Response:
+    '''Answer with headers only and let the front proxy send the file, ranges included'''
+    response = werkzeug_send_file(path, request.environ, use_x_sendfile=True, conditional=False, **kwargs)
+    size = response.content_length or 0
+    del response.headers['X-Sendfile']
+    del response.headers['Content-Length']
+
+    etag, _ = response.get_etag()
+    if not is_resource_modified(request.environ, etag=etag, last_modified=response.last_modified):
+        response.status_code = 304
+        return response
+
+    response.headers[header] = value
+
+    # the proxy answers a satisfiable Range with just that slice of the file
+    byte_range = request.range.range_for_length(size) if request.range is not None else None
+    record_file_send(SENDFILE_BACKEND, size if byte_range is None else byte_range[1] - byte_range[0])
+    return response
+
+
+def send_download(path: str, *, mimetype: str | None = None, as_attachment: bool = False,
+                  download_name: str | None = None, etag: bool | str = True, max_age: int | None = None) -> Response:
+    '''send_file through the configured SENDFILE_BACKEND, answering Range and conditional requests'''
+    kwargs = dict(mimetype=mimetype, as_attachment=as_attachment, download_name=download_name, etag=etag, max_age=max_age)
+
+    if SENDFILE_BACKEND == 'x-sendfile':
+        return _offload(path, 'X-Sendfile', abspath(path), **kwargs)
+
+    if SENDFILE_BACKEND == 'x-accel':
+        uri = _accel_uri(path)
+        if uri is not None:
+            return _offload(path, 'X-Accel-Redirect', uri, **kwargs)
+
+    response = send_file(path, conditional=True, **kwargs)
+
+    # werkzeug serves ranges through a wrapper the WSGI server can't sendfile, hand it the file instead
+    if SENDFILE_BACKEND != 'flask' and response.status_code == 206:
+        content_range = response.content_range
+        response.close()
+        response.response = wrap_file(request.environ, _FileRange(path, content_range.start, content_range.stop - content_range.start))
+
+    if response.status_code in (200, 206):
+        record_file_send(SENDFILE_BACKEND, response.content_length or 0)
+
+    return response
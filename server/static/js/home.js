@@ -1,16 +1,39 @@
-let allMods = [];
+const PAGE_SIZE = 50;
 
-async function loadModList() {
-    const res = await fetch("/api/info/mod-display-list");
+let nextCursor = null;
+let requestId = 0;
+
+async function loadModList(append = false) {
+    const params = new URLSearchParams({ limit: PAGE_SIZE });
+
+    const role = document.getElementById("sort-role").value;
+    const type = document.getElementById("sort-type").value;
+    const search = document.getElementById("search").value.trim();
+    const order = document.getElementById("sort-order").value;
+
+    if (role !== "All") params.set("role", role);
+    if (type !== "All") params.set("type", type);
+    if (search) params.set("q", search);
+    if (order) params.set("sort", order);
+    if (append && nextCursor) params.set("cursor", nextCursor);
+
+    // ignore responses to filters the user has already changed
+    const id = ++requestId;
+    const res = await fetch(`/api/info/mods?${params}`);
     const data = await res.json();
-    allMods = data["mod-list"];
+    if (id !== requestId) return;
+
+    nextCursor = data["next"];
+    document.getElementById("load-more").hidden = nextCursor === null;
 
-    renderModList(allMods);
+    renderModList(data["mods"], append);
 }
 
-function renderModList(mods) {
+function renderModList(mods, append) {
     const container = document.getElementById("mod-list");
-    container.innerHTML = ""; // clear existing cards
+    if (!append) {
+        container.innerHTML = ""; // clear existing cards
+    }
 
     mods.forEach(mod => {
         const card = document.createElement("div");
@@ -36,25 +59,22 @@ function renderModList(mods) {
 }
 
 
-document.getElementById("sort-role").addEventListener("change", applySorting);
-document.getElementById("sort-type").addEventListener("change", applySorting);
+let searchTimer = null;
 
 function applySorting() {
-    const role = document.getElementById("sort-role").value;
-    const type = document.getElementById("sort-type").value;
-
-    let filtered = [...allMods];
-
-    if (role !== "All") {
-        filtered = filtered.filter(mod => mod.role === role);
-    }
+    loadModList();
+}
 
-    if (type !== "All") {
-        filtered = filtered.filter(mod => mod.type === type);
-    }
+document.getElementById("sort-role").addEventListener("change", applySorting);
+document.getElementById("sort-type").addEventListener("change", applySorting);
+document.getElementById("sort-order").addEventListener("change", applySorting);
+document.getElementById("load-more").addEventListener("click", () => loadModList(true));
 
-    renderModList(filtered);
-}
+// wait for a pause in typing before searching
+document.getElementById("search").addEventListener("input", () => {
+    clearTimeout(searchTimer);
+    searchTimer = setTimeout(applySorting, 250);
+});
 
 
 loadModList();
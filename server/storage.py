@@ -0,0 +1,134 @@
+from hashlib import file_digest, sha256
+from os import link, makedirs, remove, replace
+from os.path import dirname, exists, join
+from re import fullmatch
+from shutil import copyfileobj
+from tempfile import NamedTemporaryFile
+from typing import BinaryIO
+from server.config import BLOB_DIR
+from server.uploads import UploadSpool
+
+try:
+    from fcntl import ioctl
+except ImportError:
+    ioctl = None
+
+
+# Linux ioctl sharing the source's extents copy-on-write (btrfs, xfs), an instant copy
+# that still can't be changed through the other path
+FICLONE = 0x40049409
+
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+def is_valid_hash(filehash: str) -> bool:
+    '''Return True if filehash looks like a lowercase sha256 hex digest'''
+    return fullmatch(r'[0-9a-f]{64}', filehash) is not None
+
+
+def blob_path(filehash: str) -> str:
+    '''Path of the blob holding the content with the given sha256'''
+    if not is_valid_hash(filehash):
+        raise ValueError(f'\'{filehash}\' is not a sha256 hex digest')
+    return join(BLOB_DIR, filehash[:2], filehash[2:])
+
+
+def has_blob(filehash: str) -> bool:
+    return exists(blob_path(filehash))
+
+
+def store_blob(stream: BinaryIO, filehash: str) -> str:
+    '''Copy stream into the store under filehash, skipping content already stored'''
+    path = blob_path(filehash)
+
+    # identical content is only ever stored once
+    if exists(path):
+        return path
+
+    makedirs(dirname(path), exist_ok=True)
+
+    # write next to the final path, then rename so readers never see a partial blob
+    with NamedTemporaryFile(dir=dirname(path), delete=False) as tmp:
+        try:
+            copyfileobj(stream, tmp)
+        except BaseException:
+            tmp.close()
+            remove(tmp.name)
+            raise
+    replace(tmp.name, path)
+
+    return path
+
+
+def commit_upload(spool: UploadSpool, filehash: str) -> str:
+    '''Move a spooled upload into the store under filehash without reading it again'''
+    path = blob_path(filehash)
+
+    if not exists(path):
+        makedirs(dirname(path), exist_ok=True)
+        spool.keep(path)
+
+    return path
+
+
+def _reflink(src: BinaryIO, dst: BinaryIO) -> bool:
+    if ioctl is None:
+        return False
+    try:
+        ioctl(dst.fileno(), FICLONE, src.fileno())
+        return True
+    except OSError:
+        return False
+
+
+def _copy_file(src: str, dest: str, filehash: str | None = None, overwrite: bool = True):
+    '''Copy src to dest through a temporary file, reflinked where supported
+
+    Never a hardlink or symlink: jars in the mods directories get overwritten
+    in place, and that must not change what a blob URL serves. With filehash,
+    the copy is refused unless its content has that sha256. Without overwrite,
+    FileExistsError is raised if dest already exists.
+    '''
+    with open(src, 'rb') as source, NamedTemporaryFile(dir=dirname(dest), delete=False) as tmp:
+        try:
+            if _reflink(source, tmp):
+                digest = file_digest(tmp, sha256) if filehash is not None else None
+            else:
+                digest = sha256()
+                while chunk := source.read(COPY_CHUNK_SIZE):
+                    tmp.write(chunk)
+                    digest.update(chunk)
+
+            if filehash is not None and digest.hexdigest() != filehash:
+                raise ValueError(f'\'{src}\' does not hash to {filehash}')
+        except BaseException:
+            tmp.close()
+            remove(tmp.name)
+            raise
+
+    if overwrite:
+        replace(tmp.name, dest)
+        return
+
+    # link fails rather than replace whatever is at dest, the temporary name goes either way
+    try:
+        link(tmp.name, dest)
+    finally:
+        remove(tmp.name)
+
+
+def adopt_blob(src: str, filehash: str) -> str:
+    '''Copy an existing file into the store, raising ValueError if it doesn't hash to filehash'''
+    path = blob_path(filehash)
+
+    if not exists(path):
+        makedirs(dirname(path), exist_ok=True)
+        _copy_file(src, path, filehash)
+
+    return path
+
+
+def copy_blob(filehash: str, dest: str, overwrite: bool = True):
+    '''Put an independent copy of a blob at dest, reflinked where the filesystem allows'''
+    # replaced atomically, so a jar being overwritten is never missing or half written
+    _copy_file(blob_path(filehash), dest, overwrite=overwrite)
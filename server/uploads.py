@@ -0,0 +1,62 @@
+from flask import Request
+from hashlib import sha256
+from io import FileIO
+from os import makedirs, remove
+from os.path import join
+from shutil import move
+from tempfile import mkstemp
+from server.config import BLOB_DIR, TEMP_DIR
+
+
+def upload_dir() -> str:
+    '''Directory uploads are spooled to, on the blob store's filesystem by default'''
+    return TEMP_DIR if TEMP_DIR is not None else join(BLOB_DIR, 'tmp')
+
+
+class UploadSpool(FileIO):
+    '''Temp file that hashes everything written to it, so an upload is only read once'''
+
+    def __init__(self):
+        makedirs(upload_dir(), exist_ok=True)
+        fd, self.path = mkstemp(dir=upload_dir(), suffix='.upload')
+        super().__init__(fd, 'w+b')
+        self._digest = sha256()
+        self._kept = False
+
+    def write(self, data) -> int:
+        view = memoryview(data).cast('B')
+
+        # FileIO may write short, the multipart parser expects every byte taken
+        written = 0
+        while written < len(view):
+            written += super().write(view[written:])
+
+        self._digest.update(view)
+        return written
+
+    def hexdigest(self) -> str:
+        return self._digest.hexdigest()
+
+    def keep(self, dest: str):
+        '''Move the spooled file to dest instead of deleting it on close'''
+        self.flush()
+
+        # a rename when TEMP_DIR shares the destination's filesystem, a copy otherwise
+        move(self.path, dest)
+        self._kept = True
+
+    def close(self):
+        super().close()
+
+        if not self._kept:
+            try:
+                remove(self.path)
+            except FileNotFoundError:
+                pass
+
+
+class UploadRequest(Request):
+    '''Request that spools uploaded files straight into hashing temp files'''
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return UploadSpool()
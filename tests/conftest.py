@@ -0,0 +1,30 @@
+'''Point the server config at a scratch directory before any test imports `server`
+
+The config module reads its MCMM_* overrides at import time, so this runs
+at collection, ahead of the test modules.
+'''
+from os import environ, makedirs
+from os.path import abspath, dirname, join
+from sys import path
+from tempfile import mkdtemp
+
+
+REPO_ROOT = dirname(dirname(abspath(__file__)))
+if REPO_ROOT not in path:
+    path.insert(0, REPO_ROOT)
+
+SCRATCH_DIR = mkdtemp(prefix='mcmm-test-')
+
+for name, dir in {
+    'MCMM_SERVER_MODS_DIR': 'mods',
+    'MCMM_CLIENT_MODS_DIR': 'client_mods',
+    'MCMM_TEMP_DIR': 'tmp',
+    'MCMM_BLOB_DIR': 'blobs',
+    'MCMM_PACK_CACHE_DIR': 'packs',
+    'MCMM_PATCH_CACHE_DIR': 'patches',
+}.items():
+    makedirs(join(SCRATCH_DIR, dir), exist_ok=True)
+    environ[name] = join(SCRATCH_DIR, dir)
+
+environ['MCMM_DB_PATH'] = join(SCRATCH_DIR, 'db', 'database.sqlite')
+environ['MCMM_INDEXER'] = '0'
@@ -0,0 +1,148 @@
+"""StagedInstall commits, rollbacks and recovery after an interrupted commit"""
+import os
+import pytest
+from installer import StagedInstall
+
+
+class Crash(BaseException):
+    """Stands in for the process dying mid-commit"""
+
+
+def read_dir(path):
+    contents = {}
+    for name in os.listdir(path):
+        with open(os.path.join(path, name), "rb") as file:
+            contents[name] = file.read()
+    return contents
+
+
+@pytest.fixture
+def mods(tmp_path):
+    """A mods folder with two jars, and an install that updates one, adds one and deletes one"""
+    mods_dir = tmp_path / "mods"
+    mods_dir.mkdir()
+    (mods_dir / "keep.jar").write_bytes(b"keep")
+    (mods_dir / "update.jar").write_bytes(b"old")
+    (mods_dir / "remove.jar").write_bytes(b"remove")
+
+    new_dir = tmp_path / "new"
+    new_dir.mkdir()
+    (new_dir / "update.jar").write_bytes(b"new")
+    (new_dir / "add.jar").write_bytes(b"add")
+
+    def make_install():
+        install = StagedInstall(str(mods_dir))
+        install.stage("update.jar", str(new_dir / "update.jar"))
+        install.stage("add.jar", str(new_dir / "add.jar"))
+        install.delete("remove.jar")
+        return install
+
+    return str(mods_dir), make_install
+
+
+def assert_clean(mods_dir):
+    for suffix in (".staging", ".backup", ".journal"):
+        assert not os.path.exists(mods_dir + suffix)
+
+
+def test_commit_applies_every_change(mods):
+    mods_dir, make_install = mods
+
+    make_install().commit()
+
+    assert read_dir(mods_dir) == {"keep.jar": b"keep", "update.jar": b"new", "add.jar": b"add"}
+    assert_clean(mods_dir)
+
+
+def test_failed_commit_rolls_back(mods, monkeypatch):
+    mods_dir, make_install = mods
+    before = read_dir(mods_dir)
+    install = make_install()
+
+    replace = os.replace
+    calls = []
+    def failing_replace(src, dst):
+        calls.append(src)
+        if len(calls) == 3:
+            raise OSError("disk full")
+        replace(src, dst)
+    monkeypatch.setattr(os, "replace", failing_replace)
+
+    with pytest.raises(OSError):
+        install.commit()
+
+    monkeypatch.undo()
+    assert read_dir(mods_dir) == before
+    assert_clean(mods_dir)
+
+
+@pytest.mark.parametrize("crash_after", range(4))
+def test_recover_undoes_an_interrupted_commit(mods, monkeypatch, crash_after):
+    mods_dir, make_install = mods
+    before = read_dir(mods_dir)
+    install = make_install()
+
+    # Die after crash_after renames, before commit() gets to roll back itself
+    replace = os.replace
+    calls = []
+    def crashing_replace(src, dst):
+        if len(calls) == crash_after:
+            raise Crash()
+        calls.append(src)
+        replace(src, dst)
+    monkeypatch.setattr(os, "replace", crashing_replace)
+    monkeypatch.setattr(StagedInstall, "recover", classmethod(lambda cls, target_dir: False))
+
+    with pytest.raises(Crash):
+        install.commit()
+
+    monkeypatch.undo()
+    assert StagedInstall.recover(mods_dir)
+    assert read_dir(mods_dir) == before
+    assert_clean(mods_dir)
+
+    # Running it again finds nothing to do
+    assert not StagedInstall.recover(mods_dir)
+
+
+def test_recover_ignores_a_torn_journal_line(mods, monkeypatch):
+    mods_dir, make_install = mods
+    before = read_dir(mods_dir)
+    install = make_install()
+
+    def crashing_replace(src, dst):
+        raise Crash()
+    monkeypatch.setattr(os, "replace", crashing_replace)
+    monkeypatch.setattr(StagedInstall, "recover", classmethod(lambda cls, target_dir: False))
+    with pytest.raises(Crash):
+        install.commit()
+    monkeypatch.undo()
+
+    with open(install.journal_path, "a") as journal:
+        journal.write('{"op": "inst')
+
+    assert StagedInstall.recover(mods_dir)
+    assert read_dir(mods_dir) == before
+    assert_clean(mods_dir)
+
+
+def test_recover_keeps_a_finished_commit(mods, monkeypatch):
+    mods_dir, make_install = mods
+
+    # Every step ran, only the cleanup was lost
+    monkeypatch.setattr(StagedInstall, "_cleanup", lambda self: None)
+    make_install().commit()
+    monkeypatch.undo()
+
+    assert StagedInstall.recover(mods_dir)
+    assert read_dir(mods_dir) == {"keep.jar": b"keep", "update.jar": b"new", "add.jar": b"add"}
+    assert_clean(mods_dir)
+
+
+def test_commit_refuses_to_run_over_an_interrupted_one(mods):
+    mods_dir, make_install = mods
+    with open(mods_dir + ".journal", "w"):
+        pass
+
+    with pytest.raises(Exception, match="recover"):
+        make_install().commit()
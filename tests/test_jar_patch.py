@@ -0,0 +1,105 @@
+'''Round trips through the entry-level patches built by server.jars and applied by jar_patch'''
+from hashlib import sha256
+from io import BytesIO
+from json import dumps, loads
+from os import urandom
+from os.path import getsize
+from zipfile import ZipFile, ZIP_DEFLATED
+import pytest
+from jar_patch import PatchMismatch, apply_patch
+from server.jars import DATA, build_patch
+from server.storage import blob_path, store_blob
+
+
+def make_jar(entries: dict[str, bytes]) -> bytes:
+    buffer = BytesIO()
+    with ZipFile(buffer, 'w', ZIP_DEFLATED) as jar:
+        for name, data in entries.items():
+            jar.writestr(name, data)
+    return buffer.getvalue()
+
+
+def read(path: str) -> bytes:
+    with open(path, 'rb') as file:
+        return file.read()
+
+
+def store(data: bytes) -> str:
+    filehash = sha256(data).hexdigest()
+    store_blob(BytesIO(data), filehash)
+    return filehash
+
+
+@pytest.fixture
+def jars():
+    '''An old jar and a new one that shares most of its entries'''
+    shared = {f'mod/Shared{i}.class': urandom(64 * 1024) for i in range(4)}
+    old = make_jar({'META-INF/MANIFEST.MF': b'Implementation-Version: 1.0\n', **shared, 'mod/Old.class': urandom(1024)})
+    new = make_jar({'META-INF/MANIFEST.MF': b'Implementation-Version: 1.1\n', **shared, 'mod/New.class': urandom(1024)})
+    return store(old), store(new)
+
+
+def test_patch_rebuilds_new_jar(jars, tmp_path):
+    old_hash, new_hash = jars
+
+    patch = build_patch(old_hash, new_hash)
+    assert patch is not None
+
+    dest = tmp_path / 'new.jar'
+    assert apply_patch(blob_path(old_hash), patch, str(dest)) == new_hash
+    assert sha256(dest.read_bytes()).hexdigest() == new_hash
+
+    # the shared entries travel as copy ops, not data
+    assert getsize(patch) < getsize(blob_path(new_hash)) / 2
+
+
+def test_patch_is_cached(jars):
+    assert build_patch(*jars) == build_patch(*jars)
+
+
+def test_patch_handles_reordered_and_removed_entries(tmp_path):
+    entries = {f'mod/Class{i}.class': urandom(32 * 1024) for i in range(5)}
+    old_hash = store(make_jar(entries))
+    new_hash = store(make_jar({name: entries[name] for name in reversed(list(entries)[1:])}))
+
+    dest = tmp_path / 'new.jar'
+    assert apply_patch(blob_path(old_hash), build_patch(old_hash, new_hash), str(dest)) == new_hash
+
+
+def test_unrelated_jars_get_no_patch():
+    old_hash = store(make_jar({'a.class': urandom(32 * 1024)}))
+    new_hash = store(make_jar({'b.class': urandom(32 * 1024)}))
+
+    assert build_patch(old_hash, new_hash) is None
+
+
+def test_corrupted_data_is_rejected(jars, tmp_path):
+    old_hash, new_hash = jars
+    patch = tmp_path / 'corrupt.patch'
+    data = bytearray(read(build_patch(old_hash, new_hash)))
+    data[-1] ^= 0xff
+    patch.write_bytes(data)
+
+    with pytest.raises(PatchMismatch):
+        apply_patch(blob_path(old_hash), str(patch), str(tmp_path / 'new.jar'))
+
+
+def test_truncated_patch_is_rejected(jars, tmp_path):
+    old_hash, new_hash = jars
+    patch = tmp_path / 'truncated.patch'
+    patch.write_bytes(read(build_patch(old_hash, new_hash))[:-100])
+
+    with pytest.raises(PatchMismatch):
+        apply_patch(blob_path(old_hash), str(patch), str(tmp_path / 'new.jar'))
+
+
+def test_unknown_op_is_rejected(jars, tmp_path):
+    old_hash, new_hash = jars
+    header, _, body = read(build_patch(old_hash, new_hash)).partition(b'\n')
+    header = loads(header)
+    header['ops'].insert(0, [DATA + 7, 1])
+    patch = tmp_path / 'unknown.patch'
+    patch.write_bytes(dumps(header).encode() + b'\n' + body)
+
+    with pytest.raises(PatchMismatch):
+        apply_patch(blob_path(old_hash), str(patch), str(tmp_path / 'new.jar'))
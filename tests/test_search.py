@@ -0,0 +1,74 @@
+'''Keyset pagination and query validation of /api/info/mods'''
+from base64 import urlsafe_b64encode
+from io import BytesIO
+from json import dumps
+from zipfile import ZipFile
+import pytest
+from server import create_app
+
+
+NAMES = ['Alpha Tools', 'Beta Tools', 'Gamma Tools', 'Delta', 'Epsilon Tools', 'Zeta', 'Eta Tools']
+
+
+def make_jar(content: bytes) -> bytes:
+    buffer = BytesIO()
+    with ZipFile(buffer, 'w') as jar:
+        jar.writestr('a.class', content)
+    return buffer.getvalue()
+
+
+@pytest.fixture(scope='module')
+def client():
+    client = create_app().test_client()
+
+    for i, name in enumerate(NAMES):
+        response = client.post('/api/admin/add-mod', content_type='multipart/form-data', data={
+            'name': name, 'description': 'tools for testing' if 'Tools' in name else 'other',
+            'version': '1', 'link': '', 'type': 'Feature', 'role': 'Client/Server',
+            'file_upload': (BytesIO(make_jar(name.encode())), f'search{i}.jar'),
+        })
+        assert response.status_code == 200, response.get_json()
+
+    return client
+
+
+def cursor(values: list) -> str:
+    return urlsafe_b64encode(dumps(values).encode()).decode()
+
+
+def all_pages(client, query: str, limit: int) -> list[str]:
+    names, next_cursor = [], None
+    while True:
+        url = f'/api/info/mods?{query}&limit={limit}' + (f'&cursor={next_cursor}' if next_cursor else '')
+        page = client.get(url).get_json()
+        names += [mod['name'] for mod in page['mods']]
+        next_cursor = page['next']
+        if next_cursor is None:
+            return names
+
+
+@pytest.mark.parametrize('query', ['sort=name', 'sort=newest', 'q=tools&sort=relevance', 'q=tools&sort=name'])
+@pytest.mark.parametrize('limit', [1, 2, 3])
+def test_pages_add_up_to_one_listing(client, query, limit):
+    everything = [mod['name'] for mod in client.get(f'/api/info/mods?{query}&limit=200').get_json()['mods']]
+
+    assert all_pages(client, query, limit) == everything
+
+
+def test_sorts(client):
+    assert all_pages(client, 'sort=name', 3) == sorted(NAMES)
+    assert all_pages(client, 'sort=newest', 3) == NAMES[::-1]
+    assert set(all_pages(client, 'q=tools', 2)) == {name for name in NAMES if 'Tools' in name}
+
+
+@pytest.mark.parametrize('args', [
+    'limit=abc', 'limit=0', 'limit=201', 'sort=oldest', 'role=Nobody',
+    'cursor=not-base64!', f'cursor={cursor("name")}', f'cursor={cursor([])}',
+    f'cursor={cursor(["name"])}', f'cursor={cursor(["name", {"a": 1}, 2])}', f'cursor={cursor(["name", "Alpha", 1, 2])}',
+    f'cursor={cursor(["newest", 1])}', f'sort=newest&cursor={cursor(["newest", True])}',
+])
+def test_bad_arguments_are_rejected(client, args):
+    response = client.get(f'/api/info/mods?{args}')
+
+    assert response.status_code == 400
+    assert 'error' in response.get_json()